@@ -261,7 +261,12 @@ define([
         },
 
         handleJobLogs: function (message) {
-            if (this.pendingLogRequest && (this.pendingLogLine === message.logs.first || this.pendingLogLine === 'latest' && message.logs.latest)) {
+            if (message.logs.subscribed) {
+                if (this.logSubscribed) {
+                    this.appendLogs(message.logs);
+                }
+            }
+            else if (this.pendingLogRequest && (this.pendingLogLine === message.logs.first || this.pendingLogLine === 'latest' && message.logs.latest)) {
                 this.updateLogs(message.logs);
             }
         },
@@ -330,8 +335,12 @@ define([
                 this.doLogLoop = true;
             }.bind(this));
             $logsPanel.find('#kblog-stop').click(function() {
-                if (this.looper)
-                    clearTimeout(this.looper);
+                if (this.logSubscribed) {
+                    this.runtime.bus().emit('request-job-log-unsubscription', {
+                        jobId: this.jobId
+                    });
+                    this.logSubscribed = false;
+                }
                 $logsPanel.find('button[id!="kblog-stop"]').prop('disabled', false);
                 $logsPanel.find('#kblog-stop').prop('disabled', true);
                 this.logsView.find('#kblog-spinner').hide();
@@ -411,16 +420,49 @@ define([
             this.currentLogLength = logs.lines.length;
             this.logsView.find('#kblog-spinner').hide();
             if (this.doLogLoop) {
-                // don't bother looping if we're complete.
+                // don't bother following the log if we're complete.
                 if (this.state.job_state === 'suspend' || this.state.job_state === 'completed') {
                     this.logsView.find('#kblog-stop').click();
                 }
-                else {
-                    this.looper = setTimeout(function() { this.sendLogRequest('latest', true); }.bind(this), 2000);
+                else if (!this.logSubscribed) {
+                    // the kernel pushes new lines from here on.
+                    this.logSubscribed = true;
+                    this.runtime.bus().emit('request-job-log-subscription', {
+                        jobId: this.jobId,
+                        options: {
+                            first_line: logs.first + logs.lines.length
+                        }
+                    });
                 }
             }
             // var lastPos = this.logsView.find('#kblog-panel').children().last().
             // this.logsView.find('#kblog-panel').children().last().scrollTop=0;
+        },
+
+        /**
+         * Adds lines pushed from a log subscription to the end of the viewer, trimming
+         * the oldest ones off the top once there are more than maxLogLines.
+         */
+        appendLogs: function(logs) {
+            var $panel = this.logsView.find('#kblog-panel');
+            for (var i=0; i<logs.lines.length; i++) {
+                $panel.append($(this.logLineTmpl({lineNum: (logs.first+i+1), log: logs.lines[i]})));
+            }
+            var extra = $panel.children().length - this.maxLogLines;
+            if (extra > 0) {
+                $panel.children().slice(0, extra).remove();
+            }
+            this.currentLogLength = $panel.children().length;
+            this.currentLogStart = logs.first + logs.lines.length - this.currentLogLength;
+            this.maxLogLine = logs.max_lines;
+            if (logs.max_lines > this.maxLogLines) {
+                this.showLogMessage("Showing lines " + (this.currentLogStart+1) + " to " + (this.currentLogStart + this.currentLogLength) + " of " + logs.max_lines);
+            }
+            // stop once a finished job's whole log is here.
+            if ((this.state.job_state === 'suspend' || this.state.job_state === 'completed') &&
+                logs.first + logs.lines.length >= logs.max_lines) {
+                this.logsView.find('#kblog-stop').click();
+            }
         }
     });
 });
\ No newline at end of file
@@ -43,6 +43,7 @@ define([
     return KBWidget({
         COMM_NAME: 'KBaseJobs',
         ALL_STATUS: 'all_status',
+        RESYNC_STATUS: 'resync_status',
         JOB_STATUS: 'job_status',
         STOP_UPDATE_LOOP: 'stop_update_loop',
         START_UPDATE_LOOP: 'start_update_loop',
@@ -52,6 +53,8 @@ define([
         CANCEL_JOB: 'cancel_job',
         JOB_LOGS: 'job_logs',
         JOB_LOGS_LATEST: 'job_logs_latest',
+        SUBSCRIBE_JOB_LOGS: 'subscribe_job_logs',
+        UNSUBSCRIBE_JOB_LOGS: 'unsubscribe_job_logs',
         name: 'kbaseNarrativeJobsPanel',
         parent: kbaseNarrativeControlPanel,
         version: '0.0.1',
@@ -67,6 +70,8 @@ define([
         $methodsList: null,
         // has 'spec' and 'state' keys - populated from server.
         jobStates: {},
+        // app specs, keyed by the 'spec_ref' the server sends with each job status.
+        appSpecs: {},
         comm: null,
         init: function (options) {
             this._super(options);
@@ -210,18 +215,29 @@ define([
             bus.on('request-latest-job-log', function (message) {
                 this.sendCommMessage(this.JOB_LOGS_LATEST, message.jobId, message.options);
             }.bind(this));
+
+            bus.on('request-job-log-subscription', function (message) {
+                this.sendCommMessage(this.SUBSCRIBE_JOB_LOGS, message.jobId, message.options);
+            }.bind(this));
+
+            bus.on('request-job-log-unsubscription', function (message) {
+                this.sendCommMessage(this.UNSUBSCRIBE_JOB_LOGS, message.jobId);
+            }.bind(this));
         },
         /**
          * Sends a comm message to the JobManager in the kernel.
          * If there's no comm channel ready, tries to set one up first.
          * @param msgType {string} - one of (prepend with this.)
          *   ALL_STATUS,
+         *   RESYNC_STATUS,
          *   STOP_UPDATE_LOOP,
          *   START_UPDATE_LOOP,
          *   STOP_JOB_UPDATE,
          *   START_JOB_UPDATE,
          *   DELETE_JOB,
-         *   JOB_LOGS
+         *   JOB_LOGS,
+         *   SUBSCRIBE_JOB_LOGS,
+         *   UNSUBSCRIBE_JOB_LOGS
          * @param jobId {string} - optional - a job id to send along with the
          * message, where appropriate.
          */
@@ -275,6 +291,9 @@ define([
                 case 'job_status':
                     var jobStateMessage = msg.content.data.content,
                         jobId = jobStateMessage.state.job_id;
+                    if (jobStateMessage.spec_ref) {
+                        this.appSpecs[jobStateMessage.spec_ref] = jobStateMessage.spec;
+                    }
                     // We could just copy the entire message into the job
                     // states cache, but referencing each individual property
                     // is more explicit about the structure.
@@ -316,6 +335,9 @@ define([
                      */
                     for (var jobId in incomingJobs) {
                         var jobStateMessage = incomingJobs[jobId];
+                        if (jobStateMessage.spec_ref) {
+                            this.appSpecs[jobStateMessage.spec_ref] = jobStateMessage.spec;
+                        }
                         // We could just copy the entire message into the job
                         // states cache, but referencing each individual property
                         // is more explicit about the structure.
@@ -360,6 +382,51 @@ define([
                     }.bind(this));
                     this.populateJobsPanel(); //status, info, content);
                     break;
+                    /*
+                     * Only the jobs whose status changed since the last message.
+                     * App specs are sent by reference ('spec_ref'), and each one
+                     * is only sent along the first time it's referenced. If we
+                     * get a reference to a spec we don't have, ask for a full
+                     * resync (which arrives as a job_status_all message).
+                     */
+                case 'job_status_delta':
+                    var delta = msg.content.data.content,
+                        needsResync = false;
+                    Object.keys(delta.specs).forEach(function (specRef) {
+                        this.appSpecs[specRef] = delta.specs[specRef];
+                    }.bind(this));
+                    Object.keys(delta.jobs).forEach(function (jobId) {
+                        var jobStateMessage = delta.jobs[jobId],
+                            specRef = jobStateMessage.spec_ref;
+                        if (specRef && !this.appSpecs[specRef]) {
+                            needsResync = true;
+                        }
+                        this.jobStates[jobId] = {
+                            state: jobStateMessage.state,
+                            spec: specRef ? this.appSpecs[specRef] : {},
+                            widgetParameters: jobStateMessage.widget_info,
+                            owner: jobStateMessage.owner
+                        };
+                        this.sendJobMessage('job-status', jobId, {
+                            jobId: jobId,
+                            jobState: jobStateMessage.state,
+                            outputWidgetInfo: jobStateMessage.widget_info
+                        });
+                    }.bind(this));
+                    delta.removed.forEach(function (jobId) {
+                        if (this.jobStates[jobId]) {
+                            this.sendJobMessage('job-deleted', jobId, {
+                                jobId: jobId,
+                                via: 'no_longer_exists'
+                            });
+                            delete this.jobStates[jobId];
+                        }
+                    }.bind(this));
+                    if (needsResync) {
+                        this.sendCommMessage(this.RESYNC_STATUS);
+                    }
+                    this.populateJobsPanel();
+                    break;
                 case 'run_status':
                     // Send job status notifications on the default channel,
                     // with a key on the message type and the job id, sending
@@ -454,6 +521,11 @@ define([
                     console.error('Error from job comm:', msg);
                     break;
 
+                case 'job_init_progress':
+                    var progress = msg.content.data.content;
+                    this.showMessage('Loading jobs (' + progress.loaded + ' of ' + progress.total + ')...', true);
+                    break;
+
                 case 'job_init_err':
                 case 'job_init_lookup_err':
                     var content = msg.content.data.content;
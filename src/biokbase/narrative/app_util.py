@@ -5,11 +5,19 @@ __author__ = "Bill Riehl <wjriehl@lbl.gov>, Roman Sutormin <rsutormin@lbl.gov>"
 
 import os
 import re
+import threading
 import biokbase.narrative.clients as clients
 
 app_version_tags = ['release', 'beta', 'dev']
 _ws_client = clients.get('workspace')
 
+# system variables that take some work to find (e.g. the workspace id needs a call
+# to the Workspace), remembered for as long as KB_WORKSPACE_ID and KB_AUTH_TOKEN
+# stay the same.
+_system_var_cache = dict()
+_system_var_env = None
+_system_var_lock = threading.Lock()
+
 def check_tag(tag, raise_exception=False):
     """
     Checks if the given tag is one of "release", "beta", or "dev".
@@ -35,30 +43,71 @@ def system_variable(var):
         user_id - returns the current user's id
 
     if anything is not found, returns None
+
+    The workspace_id and user_id are only worked out once, then remembered until
+    the KB_WORKSPACE_ID or KB_AUTH_TOKEN environment variables change.
     """
     var = var.lower()
     if var == 'workspace':
         return os.environ.get('KB_WORKSPACE_ID', None)
     elif var == 'workspace_id':
-        ws_name = os.environ.get('KB_WORKSPACE_ID', None)
-        if ws_name is None:
-            return None
-        try:
-            ws_info = _ws_client.get_workspace_info({'workspace': ws_name})
-            return ws_info[0]
-        except:
-            return None
+        return _cached_system_variable(var, _lookup_workspace_id)
     elif var == 'token':
         return os.environ.get('KB_AUTH_TOKEN', None)
     elif var == 'user_id':
-        token = os.environ.get('KB_AUTH_TOKEN', None)
-        if token is None:
-            return None
-        m = re.match("un=(\w+)|", token)
-        if m is not None and len(m.groups()) == 1:
-            return m.group(1)
-        else:
-            return None
+        return _cached_system_variable(var, _parse_user_id)
+    else:
+        return None
+
+
+def clear_system_variable_cache():
+    """
+    Forgets all the remembered system variables, so they get worked out again the
+    next time they're asked for.
+    """
+    global _system_var_env
+    with _system_var_lock:
+        _system_var_cache.clear()
+        _system_var_env = None
+
+
+def _cached_system_variable(var, lookup):
+    """
+    Returns the remembered value of var, or calls lookup(ws_name, token) to find it.
+    Values of None aren't remembered, so failed lookups get tried again next time.
+    """
+    global _system_var_env
+    env = (os.environ.get('KB_WORKSPACE_ID', None), os.environ.get('KB_AUTH_TOKEN', None))
+    with _system_var_lock:
+        if env != _system_var_env:
+            _system_var_cache.clear()
+            _system_var_env = env
+        if var in _system_var_cache:
+            return _system_var_cache[var]
+    value = lookup(*env)
+    if value is not None:
+        with _system_var_lock:
+            if env == _system_var_env:
+                _system_var_cache[var] = value
+    return value
+
+
+def _lookup_workspace_id(ws_name, token):
+    if ws_name is None:
+        return None
+    try:
+        ws_info = _ws_client.get_workspace_info({'workspace': ws_name})
+        return ws_info[0]
+    except:
+        return None
+
+
+def _parse_user_id(ws_name, token):
+    if token is None:
+        return None
+    m = re.match("un=(\w+)|", token)
+    if m is not None and len(m.groups()) == 1:
+        return m.group(1)
     else:
         return None
 
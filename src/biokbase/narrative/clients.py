@@ -4,9 +4,11 @@ from biokbase.narrative_method_store.client import NarrativeMethodStore
 from biokbase.userandjobstate.client import UserAndJobState
 from biokbase.catalog.Client import Catalog
 from biokbase.service.Client import Client as ServiceClient
+from biokbase.workspace.baseclient import AsyncClient
 
 from biokbase.narrative.common.url_config import URLS
 __clients = dict()
+__async_clients = dict()
 
 def get(client_name):
     if client_name in __clients:
@@ -15,6 +17,15 @@ def get(client_name):
     else:
         return __init_client(client_name)
 
+def get_async(client_name):
+    """
+    Returns the named client wrapped in an AsyncClient. Its methods run on a shared
+    thread pool and return futures, so independent calls can be made at once.
+    """
+    if client_name not in __async_clients:
+        __async_clients[client_name] = AsyncClient(get(client_name))
+    return __async_clients[client_name]
+
 def __init_client(client_name):
     if client_name == 'workspace':
         c = Workspace(URLS.workspace)
@@ -18,6 +18,25 @@ from urllib2 import URLError
 def kbase_debug_mode():
     return bool(os.environ.get('KBASE_DEBUG', None))
 
+def kbase_cache_dir(*subdirs):
+    """Get the local directory for data that's cached between kernel sessions.
+
+    This is the directory named by the KB_NARRATIVE_CACHE_DIR environment variable,
+    or ~/.kbase/narrative_cache if that's not set. Any subdirs given are joined onto
+    it. The directory gets created if it doesn't already exist.
+    """
+    cache_dir = os.environ.get('KB_NARRATIVE_CACHE_DIR',
+                               os.path.join(os.path.expanduser('~'), '.kbase', 'narrative_cache'))
+    cache_dir = os.path.join(cache_dir, *subdirs)
+    if not os.path.isdir(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            # might've been made by someone else in the meantime
+            if not os.path.isdir(cache_dir):
+                raise
+    return cache_dir
+
 class _KBaseEnv(object):
     """Single place to get/set KBase environment variables.
 
@@ -46,8 +46,10 @@ from IPython.utils import tz
 from .manager_util import base_model
 from .narrativeio import (
     KBaseWSManagerMixin,
-    PermissionsError
+    PermissionsError,
+    is_missing_object_error
 )
+from biokbase.workspace.baseclient import ServerError
 from .kbasecheckpoints import KBaseCheckpoints
 import biokbase.narrative.ws_util as ws_util
 from biokbase.workspace.client import Workspace
@@ -103,6 +105,7 @@ class KBaseWSManager(KBaseWSManagerMixin, ContentsManager):
     allowed_formats = List([u'json'])
     node_format = ipynb_type
     ws_type = Unicode(ws_util.ws_narrative_type, config=True, help='Type to store narratives within workspace service')
+    strip_outputs = Bool(False, config=True, help='Leave the outputs of KBase app cells out of saved narratives. They get rebuilt from the cell metadata when loaded.')
 
     # regex for parsing out workspace_id and object_id from
     # a "ws.{workspace}.{object}" string
@@ -233,33 +236,50 @@ class KBaseWSManager(KBaseWSManagerMixin, ContentsManager):
         path = path.strip('/')
 
         model = base_model(path, path)
-        if self.exists(path) and type != u'directory':
+        if path and type != u'directory':
             #It's a narrative object, so try to fetch it.
             obj_ref = self._parse_path(path)
             if not obj_ref:
-                raise HTTPError(404, u'Unknown Narrative "{}"'.format(path))
+                raise HTTPError(404, u'Path "{}" is not a valid Narrative path'.format(path))
+            ref = u'{}/{}'.format(obj_ref[u'wsid'], obj_ref[u'objid'])
+            user = self.get_userid()
             try:
-                nar_obj = self.read_narrative(u'{}/{}'.format(obj_ref[u'wsid'], obj_ref[u'objid']), content)
-                model[u'type'] = u'notebook'
-                user = self.get_userid()
-                if content:
-                    model['format'] = u'json'
-                    nb = nbformat.reads(json.dumps(nar_obj['data']), 4)
-                    nb['metadata'].pop('orig_nbformat', None)
-                    self.mark_trusted_cells(nb, path)
-                    model['content'] = nb
-                    model['name'] = nar_obj['data']['metadata'].get('name', 'Untitled')
-                    util.kbase_env.narrative = 'ws.{}.obj.{}'.format(obj_ref['wsid'], obj_ref['objid'])
-                    util.kbase_env.workspace = model['content'].metadata.ws_name
-                if user is not None:
-                    model['writable'] = self.narrative_writable(u'{}/{}'.format(obj_ref['wsid'], obj_ref['objid']), user)
-                self.log.info(u'Got narrative {}'.format(model['name']))
-            except HTTPError:
-                raise
+                # Looks up the narrative and its permissions together. If it can't be
+                # found, it doesn't exist.
+                (nar_obj, writable) = self.fetch_narrative(ref, content=content, user=user)
             except PermissionsError as e:
-                raise HTTPError(403, e)
+                raise HTTPError(403, u"You do not have permission to view the narrative with id {}".format(path))
+            except ServerError as e:
+                if not is_missing_object_error(e.message):
+                    raise HTTPError(500, u'An error occurred while fetching your narrative: {}'.format(e))
+                nar_obj = None
             except Exception as e:
                 raise HTTPError(500, u'An error occurred while fetching your narrative: {}'.format(e))
+            if nar_obj is not None:
+                try:
+                    model[u'type'] = u'notebook'
+                    if content:
+                        model['format'] = u'json'
+                        nb = nbformat.reads(json.dumps(nar_obj['data']), 4)
+                        nb['metadata'].pop('orig_nbformat', None)
+                        self.mark_trusted_cells(nb, path)
+                        model['content'] = nb
+                        model['name'] = nar_obj['data']['metadata'].get('name', 'Untitled')
+                        util.kbase_env.narrative = 'ws.{}.obj.{}'.format(obj_ref['wsid'], obj_ref['objid'])
+                        util.kbase_env.workspace = model['content'].metadata.ws_name
+                    if user is not None:
+                        model['writable'] = writable
+                    self.log.info(u'Got narrative {}'.format(model['name']))
+                    if content:
+                        self.log.info(u'Narrative cache: {hits} hits, {misses} misses '
+                                      u'({hit_rate:.0%} hit rate), {evictions} evictions, '
+                                      u'{entries} narratives, {bytes} bytes'.format(**self.narrative_cache().stats()))
+                except HTTPError:
+                    raise
+                except Exception as e:
+                    raise HTTPError(500, u'An error occurred while fetching your narrative: {}'.format(e))
+        elif type != u'directory':
+            raise HTTPError(404, u'Unknown Narrative "{}"'.format(path))
 
         if not path or type == 'directory':
             #if it's the empty string, look up all narratives, treat them as a dir
@@ -304,7 +324,7 @@ class KBaseWSManager(KBaseWSManagerMixin, ContentsManager):
             self.validate_notebook_model(model)
             validation_message = model.get(u'message', None)
 
-            model = self.get(path, content=False)
+            model = self._saved_model(path, result[3])
             if validation_message:
                 model[u'message'] = validation_message
             return model
@@ -314,6 +334,18 @@ class KBaseWSManager(KBaseWSManagerMixin, ContentsManager):
         except Exception as err:
             raise HTTPError(500, u'An error occurred while saving your Narrative: {}'.format(err))
 
+    def _saved_model(self, path, obj_info):
+        """
+        Builds the model (with no content) of a just-saved narrative from the object
+        info returned by the save, instead of looking it all up again. The save
+        only goes through if the user can write to the narrative, so it's writable.
+        """
+        model = base_model(path, path)
+        model[u'type'] = u'notebook'
+        model[u'last_modified'] = obj_info[3]
+        model[u'writable'] = True
+        return model
+
     def delete_file(self, path):
         """Delete file or directory by path."""
         raise HTTPError(501, u'Narrative deletion not implemented here. Deletion should be handled elsewhere.')
@@ -8,7 +8,10 @@ import biokbase.narrative.common.service as service
 from biokbase.narrative.common import util
 import biokbase.workspace
 from biokbase.workspace import client as WorkspaceClient
-from biokbase.workspace.baseclient import ServerError
+from biokbase.workspace.baseclient import (
+    Batch,
+    ServerError
+)
 from tornado.web import HTTPError
 from notebook.utils import (
     to_api_path,
@@ -21,9 +24,17 @@ from traitlets import (
     List,
     TraitError
 )
+import os
 import re
 import json
-from collections import Counter
+import copy
+import hashlib
+import threading
+from collections import (
+    Counter,
+    OrderedDict
+)
+from contextlib import contextmanager
 from updater import update_narrative
 
 # The list_workspace_objects method has been deprecated, the
@@ -38,6 +49,20 @@ obj_ref_regex = re.compile('^(?P<wsid>\d+)\/(?P<objid>\d+)(\/(?P<ver>\d+))?$')
 MAX_METADATA_STRING_BYTES = 900
 MAX_METADATA_SIZE_BYTES = 16000
 WORKSPACE_TIMEOUT = 30  # seconds
+# Limits on the upgraded narratives kept by NarrativeCache. The size of each is
+# taken as its size in the Workspace, i.e. as JSON.
+NARRATIVE_CACHE_MAX_BYTES = 100 * 1024 * 1024
+NARRATIVE_CACHE_MAX_ENTRIES = 50
+# How many narratives the digest of the last save is remembered for.
+SAVED_DIGESTS_MAX_ENTRIES = 100
+# KBase cell types that rebuild their display from their cell metadata when loaded,
+# so their outputs don't need to be saved.
+REGENERABLE_CELL_TYPES = [u'app']
+
+def _kvp_size(d):
+    # the size of a dict as Workspace metadata, i.e. its keys and values as strings
+    return sum(len(k) + len(unicode(v)) for k, v in d.iteritems())
+
 
 class PermissionsError(ServerError):
     """Raised if user does not have permission to
@@ -55,6 +80,142 @@ class PermissionsError(ServerError):
         ServerError.__init__(self, name, code, message, **kw)
 
 
+def is_missing_object_error(err):
+    """Try to guess if the error string from the workspace means the narrative
+    object doesn't exist, or has been deleted.
+    """
+    pat = re.compile("(No object with (id|name) .* exists)|(Object .* (is|has been) deleted)")
+    return pat.search(err) is not None
+
+
+class NarrativeCache(object):
+    """
+    A least-recently-used cache of narratives, as returned by
+    KBaseWSManagerMixin.read_narrative with content, i.e. already updated. It holds
+    one version of each narrative, keyed by workspace and object id. A cached
+    narrative is only used if the version, save date and checksum in its object
+    info all match.
+
+    It's kept under max_bytes (going by the size of each narrative in the Workspace)
+    and max_entries, and counts hits, misses and evictions.
+    """
+    def __init__(self, max_bytes=NARRATIVE_CACHE_MAX_BYTES, max_entries=NARRATIVE_CACHE_MAX_ENTRIES):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _object_key(info):
+        return (int(info[6]), int(info[0]))
+
+    @staticmethod
+    def _version_key(info):
+        return (info[4], info[3], info[8])
+
+    def has_object(self, ws_id, obj_id):
+        """
+        Returns True if some version of the given narrative is cached.
+        """
+        with self._lock:
+            return (int(ws_id), int(obj_id)) in self._entries
+
+    def get(self, info):
+        """
+        Returns a copy of the cached narrative with the given object info, or None.
+        The narrative has the given info in place of the cached one.
+        """
+        key = self._object_key(info)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != self._version_key(info):
+                self.misses += 1
+                return None
+            self.hits += 1
+            # move it to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+        # copied, so whoever gets it can't change what's cached
+        nar = dict(entry[1])
+        nar['data'] = copy.deepcopy(nar['data'])
+        nar['info'] = info
+        return nar
+
+    def put(self, nar):
+        """
+        Caches a copy of the given narrative, unless it's bigger than max_bytes.
+        """
+        size = nar['info'][9]
+        key = self._object_key(nar['info'])
+        if size <= self.max_bytes:
+            nar = dict(nar)
+            nar['data'] = copy.deepcopy(nar['data'])
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return
+            self._entries[key] = (self._version_key(nar['info']), nar, size)
+            self.size += size
+            while self.size > self.max_bytes or len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, ws_id, obj_id=None):
+        """
+        Removes the given narrative, or all narratives in the workspace if obj_id
+        is None.
+        """
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if key[0] == int(ws_id) and (obj_id is None or key[1] == int(obj_id)):
+                    self._remove(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits) / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.size
+            }
+
+
+def narrative_digest(nb):
+    """
+    Returns a digest of a notebook's content, to tell whether it's changed. This is
+    a tuple of the SHA1 of everything but the cells, and a list of the SHA1 of each cell.
+    """
+    def sha1(obj):
+        return hashlib.sha1(json.dumps(obj, sort_keys=True)).hexdigest()
+    rest = {key: value for key, value in nb.items() if key != 'cells'}
+    return (sha1(rest), [sha1(cell) for cell in nb.get('cells', [])])
+
+
+def strip_regenerable_outputs(nb):
+    """
+    Removes the outputs of the cells in a notebook that rebuild their display when
+    they're loaded, i.e. KBase cells of a type in REGENERABLE_CELL_TYPES. The notebook
+    is changed in place.
+    """
+    for cell in nb.get('cells', []):
+        kbase_type = cell.get('metadata', {}).get('kbase', {}).get('type')
+        if kbase_type in REGENERABLE_CELL_TYPES and cell.get('outputs'):
+            cell['outputs'] = []
+    return nb
+
+
 class KBaseWSManagerMixin(object):
     """
     Manages the connection to the workspace for a user
@@ -62,8 +223,19 @@ class KBaseWSManagerMixin(object):
 
     ws_uri = service.URLS.workspace
     nar_type = 'KBaseNarrative.Narrative'
+    # if True, outputs that get rebuilt on loading are left out of saved narratives.
+    strip_outputs = False
 
     def __init__(self, *args, **kwargs):
+        # passed on, so that configuration reaches the contents manager this is mixed into
+        super(KBaseWSManagerMixin, self).__init__(*args, **kwargs)
+        # made here, not when first used, since fetch_narrative uses them from
+        # several threads at once.
+        self._narrative_cache = NarrativeCache()
+        self._narrative_memo = None
+        self._memo_depth = 0
+        self._memo_lock = threading.Lock()
+        self._saved_digests = OrderedDict()
         if not self.ws_uri:
             raise HTTPError(412, u'Missing KBase workspace service endpoint URI')
         self.test_connection()
@@ -106,6 +278,65 @@ class KBaseWSManagerMixin(object):
             ver=m.group('ver')
         )
 
+    def narrative_cache(self):
+        return self._narrative_cache
+
+    def _saved_narratives(self):
+        # the digest and object info of the last save of each narrative
+        return self._saved_digests
+
+    def _memo(self):
+        # None when there's no _memo_scope open, i.e. nothing is remembered.
+        return self._narrative_memo
+
+    @contextmanager
+    def _memo_scope(self):
+        """
+        Remembers the narrative info and permissions lookups made inside the block
+        (e.g. while handling a single request), so repeating them doesn't go back to
+        the Workspace. Blocks can be nested; everything is forgotten when the
+        outermost one ends.
+        """
+        with self._memo_lock:
+            if self._memo_depth == 0:
+                self._narrative_memo = dict()
+            self._memo_depth += 1
+        try:
+            yield
+        finally:
+            with self._memo_lock:
+                self._memo_depth -= 1
+                if self._memo_depth == 0:
+                    self._narrative_memo = None
+
+    def _memo_key(self, kind, *args):
+        # lookups depend on who's asking
+        return (kind, os.environ.get('KB_AUTH_TOKEN')) + args
+
+    def _memo_get(self, key):
+        # callers get their own copy, so they can't change what's remembered
+        memo = self._memo()
+        if memo is None or key not in memo:
+            return None
+        return copy.deepcopy(memo[key])
+
+    def _memo_put(self, key, value):
+        memo = self._memo()
+        if memo is not None:
+            memo[key] = copy.deepcopy(value)
+
+    def _memo_forget(self, ws_id):
+        """
+        Forgets all remembered lookups for narratives in the given workspace.
+        """
+        ws_id = unicode(ws_id)
+        memo = self._memo()
+        if memo is None:
+            return
+        for key in memo.keys():
+            if key[2] == ws_id:
+                memo.pop(key, None)
+
     def narrative_exists(self, obj_ref):
         """
         Test if a narrative exists.
@@ -126,21 +357,36 @@ class KBaseWSManagerMixin(object):
         and metadata, otherwise, it returns the whole workspace object.
 
         This is mainly a wrapper around Workspace.get_objects(), except that
-        it always returns a dict. If content is False, it returns a dict
-        containing a single key: 'info', with the object info and, optionally,
-        metadata.
+        it always returns a dict. Narratives with content are kept in the
+        narrative_cache, and used again if they haven't been changed since.
+        If content is False, it returns a dict containing a single key: 'info',
+        with the object info and, optionally, metadata.
 
         obj_ref: expected to be in the format "wsid/objid", e.g. "4337/1"
         or even "4337/1/1" to include version.
         """
 
         self._test_obj_ref(obj_ref)
+        ref = self._parse_obj_ref(obj_ref)
+        # only the info is remembered - narratives with content are kept in the cache.
+        memo_key = self._memo_key('info', ref['wsid'], obj_ref, include_metadata)
+        full_memo_key = self._memo_key('info', ref['wsid'], obj_ref, True)
+        if not content:
+            nar = self._memo_get(memo_key) or self._memo_get(full_memo_key)
+            if nar is not None:
+                return nar
         try:
             if content:
-                nar_data = self.ws_client().get_objects([{'ref':obj_ref}])
-                if nar_data:
-                    nar = nar_data[0]
-                    nar['data'] = update_narrative(nar['data'])
+                nar = self._read_cached_narrative(obj_ref, ref)
+                if nar is None:
+                    nar_data = self.ws_client().get_objects([{'ref':obj_ref}])
+                    if nar_data:
+                        nar = nar_data[0]
+                        nar['data'] = update_narrative(nar['data'])
+                        self.narrative_cache().put(nar)
+                if nar is not None:
+                    # it comes with its info and metadata
+                    self._memo_put(full_memo_key, {'info': nar['info']})
                     return nar
             else:
                 nar_data = self.ws_client().get_object_info_new({
@@ -148,10 +394,44 @@ class KBaseWSManagerMixin(object):
                     u'includeMetadata': 1 if include_metadata else 0
                 })
                 if nar_data:
-                    return {'info': nar_data[0]}
+                    nar = {'info': nar_data[0]}
+                    self._memo_put(memo_key, nar)
+                    return nar
         except ServerError, err:
             raise self._ws_err_to_perm_err(err)
 
+    def _read_cached_narrative(self, obj_ref, ref):
+        """
+        Returns the narrative from the cache if it's there and up to date, or None.
+        This looks up the object info to check, which also checks the current user
+        can read it.
+        """
+        cache = self.narrative_cache()
+        if not cache.has_object(ref['wsid'], ref['objid']):
+            return None
+        info = self.ws_client().get_object_info_new({
+            u'objects': [{'ref': obj_ref}],
+            u'includeMetadata': 1
+        })
+        if not info:
+            return None
+        return cache.get(info[0])
+
+    def fetch_narrative(self, obj_ref, content=True, user=None):
+        """
+        Fetches a Narrative, like read_narrative, and whether the given user can
+        write to it, like narrative_writable. The Workspace lookups for these are
+        made at the same time.
+
+        Returns a tuple of (narrative, writable). If user is None, writable is None.
+        Raises whatever read_narrative or narrative_writable would.
+        """
+        with self._memo_scope(), Batch() as b:
+            nar = b.submit(self.read_narrative, obj_ref, content)
+            if user is not None:
+                writable = b.submit(self.narrative_writable, obj_ref, user)
+        return (nar.result(), writable.result() if user is not None else None)
+
     def write_narrative(self, obj_ref, nb, cur_user):
         """
         Given a notebook, break this down into a couple parts:
@@ -159,7 +439,13 @@ class KBaseWSManagerMixin(object):
         2. Build metadata object
         3. Save the narrative object (write_narrative)
         4. Return any notebook changes as a list-
-           (narrative, ws_id, obj_id)
+           (narrative, ws_id, obj_id, obj_info)
+           where obj_info is the saved object's info, as returned by save_objects
+
+        If strip_outputs is True, the outputs of cells that rebuild their display
+        when loaded are removed first.
+        If the notebook is the same as the last one saved here, it isn't saved again,
+        and the object info from that save is returned.
         """
 
         if (nb.has_key('worksheets')):
@@ -212,6 +498,19 @@ class KBaseWSManagerMixin(object):
         except Exception as e:
             raise HTTPError(400, u'Unexpected error setting Narrative attributes: %s' %e)
 
+        if self.strip_outputs:
+            strip_regenerable_outputs(nb)
+
+        # Autosaves are often of a narrative that hasn't changed. If it's exactly what
+        # was last saved here, and nobody's saved it anywhere else since, leave it be.
+        saved_key = self._memo_key('saved', ws_id, obj_id)
+        digest = narrative_digest(nb)
+        saved = self._saved_narratives().get(saved_key)
+        if saved is not None and saved[0] == digest and \
+                self._is_latest_version(saved[1]):
+            obj_info = saved[1]
+            return (nb, obj_info[6], obj_info[0], obj_info)
+
         # With that set, update the workspace metadata with the new info.
         try:
             updated_metadata = {
@@ -271,14 +570,36 @@ class KBaseWSManagerMixin(object):
             # Actually do the save now!
             obj_info = self.ws_client().save_objects({'id': ws_id,
                                                       'objects': [ws_save_obj]})[0]
+            self._memo_forget(ws_id)
+            self.narrative_cache().invalidate(ws_id, obj_id)
+            saved_narratives = self._saved_narratives()
+            saved_narratives.pop(saved_key, None)
+            saved_narratives[saved_key] = (digest, obj_info)
+            while len(saved_narratives) > SAVED_DIGESTS_MAX_ENTRIES:
+                saved_narratives.popitem(last=False)
 
-            return (nb, obj_info[6], obj_info[0])
+            return (nb, obj_info[6], obj_info[0], obj_info)
 
         except ServerError, err:
             raise self._ws_err_to_perm_err(err)
         except Exception as e:
             raise HTTPError(500, u'%s saving Narrative: %s' % (type(e),e))
 
+    def _is_latest_version(self, obj_info):
+        """
+        Returns True if the object with the given info hasn't been saved again since,
+        i.e. its version and save date are still the current ones in the Workspace.
+        If that can't be looked up, this returns False.
+        """
+        try:
+            info = self.ws_client().get_object_info_new({
+                u'objects': [{u'wsid': obj_info[6], u'objid': obj_info[0]}],
+                u'includeMetadata': 0
+            })
+        except ServerError:
+            return False
+        return bool(info) and (info[0][4], info[0][3]) == (obj_info[4], obj_info[3])
+
     def _process_cell_usage(self, nb, metadata):
         """
         A shiny new version of _extract_cell_info that tallies up the methods
@@ -306,39 +627,26 @@ class KBaseWSManagerMixin(object):
 
         method_info = Counter()
         app_info = Counter()
-
-        num_methods = 0
-        num_apps = 0
-
         cell_info = Counter()
         for cell in cells:
             meta = cell['metadata']
             if 'kb-cell' in meta:
                 # It's a KBase cell! So either an app, method, or viewer
-                if 'type' in meta['kb-cell'] and meta['kb-cell']['type'] == 'function_output':
+                kb_cell = meta['kb-cell']
+                if kb_cell.get('type') == 'function_output':
                     cell_info['viewer'] += 1
-                else:
-                    if 'app' in meta['kb-cell']:
-                        app_id = meta['kb-cell']['app']['info']['id']
-                        app_hash = meta['kb-cell']['app']['info'].get('git_commit_hash', '')
-                        app_info[u'app.' + app_id + '/' + app_hash] += 1
-                        num_apps += 1
-                    elif 'method' in meta['kb-cell']:
-                        method_id = meta['kb-cell']['method']['info']['id']
-                        method_hash = meta['kb-cell']['method']['info'].get('git_commit_hash', '')
-                        method_info[u'method.' + method_id + '/' + method_hash] += 1
-                        num_methods += 1
-                    else:
-                        # covers the cases we care about
-                        continue
+                elif 'app' in kb_cell:
+                    info = kb_cell['app']['info']
+                    app_info[u'app.' + info['id'] + '/' + info.get('git_commit_hash', '')] += 1
+                elif 'method' in kb_cell:
+                    info = kb_cell['method']['info']
+                    method_info[u'method.' + info['id'] + '/' + info.get('git_commit_hash', '')] += 1
             elif 'kbase' in meta and 'type' in meta['kbase']:
-                kbase_type = meta['kbase']['type']
-                if kbase_type == 'app':
+                if meta['kbase']['type'] == 'app':
                     app = meta['kbase'].get('appCell', {}).get('app', {})
                     id = app.get('id', 'UnknownApp')
                     commit_hash = app.get('gitCommitHash', 'unknown')
                     method_info[u'method.' + id + '/' + commit_hash] += 1
-                    num_methods += 1
             else:
                 cell_info['jupyter.' + cell.get('cell_type', 'code')] += 1
 
@@ -354,42 +662,10 @@ class KBaseWSManagerMixin(object):
         # 255 bytes. Don't even care.
         # But we do need the totals anyway, in case we blow over the max metadata size.
 
-        # final pass - trim out methods and apps if cell_kvp_size > total allowable size
-        kvp_size = lambda(x): sum([len(k) + len(unicode(x[k])) for k in x])
-
-        metadata_size = kvp_size(metadata)
-        method_size = kvp_size(method_info)
-        app_size = kvp_size(app_info)
-        cell_size = kvp_size(cell_info)
-
-        total_size = metadata_size + cell_size + app_size + method_size
-        if total_size > MAX_METADATA_SIZE_BYTES:
-            meth_overflow_key = u'method.overflow'
-
-            # if we can make it under the limit by removing all methods, then we can likely
-            # do so by removing some. So pop them out one at a time, and keep track of the lengths chopped.
-            # otherwise, remove them all.
-            if total_size - method_size + len(meth_overflow_key) + len(unicode(num_methods)) < MAX_METADATA_SIZE_BYTES:
-                # filter them.
-                method_info = _filter_app_methods(total_size, meth_overflow_key, method_info)
-            else:
-                method_info = Counter({meth_overflow_key : num_methods})
-            total_size -= method_size
-            method_size = kvp_size(method_info)
-            total_size += method_size
-
-        # test again, now focus on apps
-        if total_size > MAX_METADATA_SIZE_BYTES:
-            app_overflow_key = u'app.overflow'
-
-            # same for apps now.
-            if total_size - app_size + len(app_overflow_key) + len(unicode(num_apps)) < MAX_METADATA_SIZE_BYTES:
-                app_info = _filter_app_methods(total_size, app_overflow_key, app_info)
-            else:
-                app_info = Counter({app_overflow_key : num_apps})
-            total_size -= app_size
-            app_size = kvp_size(app_info)
-            total_size += app_size
+        # final pass - if everything's too big, trim methods to fit in what's left, then apps.
+        space = MAX_METADATA_SIZE_BYTES - _kvp_size(metadata) - _kvp_size(cell_info)
+        method_info = self._filter_app_methods(space - _kvp_size(app_info), u'method.overflow', method_info)
+        app_info = self._filter_app_methods(space - _kvp_size(method_info), u'app.overflow', app_info)
 
         # Now the total of everything must be under MAX_METADATA_SIZE_BYTES. Smoosh them together into the
         # proper metadata object.
@@ -399,15 +675,29 @@ class KBaseWSManagerMixin(object):
 
         return metadata
 
-    def _filter_app_methods(self, total_len, overflow_key, filter_dict):
-        overflow_count = 0
-        overflow_key_size = len(overflow_key)
-        while total_len + overflow_key_size + len(unicode(overflow_count)) > MAX_METADATA_SIZE_BYTES:
-            key, val = filter_dict.popitem()
-            overflow_count += val
-            total_len = total_len - len(key) - len(unicode(val))
-        filter_dict[overflow_key] = overflow_count
-        return filter_dict
+    def _filter_app_methods(self, max_size, overflow_key, filter_dict):
+        """
+        Fits a dict of counts into max_size bytes of metadata. If it's too big, the most
+        used keys that fit are kept, and the rest are counted together under overflow_key.
+        If not even that fits, only the overflow key is kept.
+        """
+        if _kvp_size(filter_dict) <= max_size:
+            return filter_dict
+        total = sum(filter_dict.values())
+        kept = Counter()
+        kept_size = 0
+        kept_count = 0
+        # Try each key, most used first. Keeping one never makes the overflow count any
+        # longer, so the ones already kept still fit.
+        for key, val in sorted(filter_dict.items(), key=lambda kv: (-kv[1], kv[0])):
+            size = len(key) + len(unicode(val))
+            overflow_size = len(overflow_key) + len(unicode(total - kept_count - val))
+            if kept_size + size + overflow_size <= max_size:
+                kept[key] = val
+                kept_size += size
+                kept_count += val
+        kept[overflow_key] = total - kept_count
+        return kept
 
     def rename_narrative(self, obj_ref, cur_user, new_name):
         """
@@ -488,11 +778,14 @@ class KBaseWSManagerMixin(object):
         if m is None:
             raise ValueError('Narrative object references must be of the format wsid/objid/ver')
         ws_id = m.group('wsid')
-        perms = {}
-        try:
-            perms = self.ws_client().get_permissions({'id': ws_id})
-        except ServerError, err:
-            raise self._ws_err_to_perm_err(err)
+        memo_key = self._memo_key('permissions', ws_id)
+        perms = self._memo_get(memo_key)
+        if perms is None:
+            try:
+                perms = self.ws_client().get_permissions({'id': ws_id})
+            except ServerError, err:
+                raise self._ws_err_to_perm_err(err)
+            self._memo_put(memo_key, perms)
         if user is not None:
             if perms.has_key(user):
                 perms = {user: perms[user]}
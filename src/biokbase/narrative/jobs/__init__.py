@@ -1 +1 @@
-__all__ = ["job", "appmanager", "jobmanager", "specmanager"]
\ No newline at end of file
+__all__ = ["job", "appmanager", "jobmanager", "specmanager", "scheduler"]
\ No newline at end of file
@@ -4,7 +4,10 @@ A module for managing apps, specs, requirements, and for starting jobs.
 
 from job import Job
 from jobmanager import JobManager
-from specmanager import SpecManager
+from specmanager import (
+    SpecManager,
+    AppParams
+)
 import biokbase.narrative.clients as clients
 from biokbase.narrative.widgetmanager import WidgetManager
 from biokbase.narrative.app_util import (
@@ -15,14 +18,48 @@ from biokbase.narrative.exception_util import (
     transform_job_exception
 )
 from biokbase.narrative.common import kblogging
+from multiprocessing.pool import ThreadPool
+import collections
 import json
 import re
 import datetime
+import threading
+import time
 import traceback
 import random
 
 __author__ = "Bill Riehl <wjriehl@lbl.gov>"
 
+# The most workspace objects to look up in a single get_object_info_new call.
+WS_OBJECT_INFO_BATCH_SIZE = 1000
+# Defaults for run_app_batch - the most jobs to submit at once, and the most
+# jobs to submit per second.
+BATCH_SUBMIT_THREADS = 4
+BATCH_SUBMIT_RATE = 10
+
+
+class _RateLimiter(object):
+    """
+    Spaces out calls to wait(), so they return at most rate times per second,
+    across all threads.
+    """
+    def __init__(self, rate, clock=time.time, sleep=time.sleep):
+        self._interval = 1.0 / rate if rate else 0
+        self._clock = clock
+        self._sleep = sleep
+        self._next_time = None
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self._interval:
+            return
+        with self._lock:
+            now = self._clock()
+            start = now if self._next_time is None else max(now, self._next_time)
+            self._next_time = start + self._interval
+        if start > now:
+            self._sleep(start - now)
+
 
 class AppManager(object):
     """
@@ -200,6 +237,83 @@ class AppManager(object):
         # failure messages. Perhaps a separate function and catch the errors,
         # or return an error structure.
 
+        spec = self._get_job_app_spec(app_id, tag, version)
+
+        # Preflight check the params - all required ones are present, all
+        # values are the right type, all numerical values are in given ranges
+        spec_params = self.spec_manager.app_param_index(app_id, tag)
+        # workspace object info looked up while validating, reused while mapping inputs
+        object_infos = dict()
+
+        (params, ws_input_refs) = self._validate_parameters(app_id,
+                                                            tag,
+                                                            spec_params,
+                                                            params,
+                                                            object_infos=object_infos)
+
+        ws_id = system_variable('workspace_id')
+        if ws_id is None:
+            raise ValueError('Unable to retrive current ' +
+                             'Narrative workspace information!')
+
+        input_vals = self._map_inputs(
+            spec['behavior']['kb_service_input_mapping'],
+            params,
+            spec_params,
+            object_infos=object_infos)
+
+        job_runner_inputs = self._build_job_inputs(spec, app_id, tag, version,
+                                                   ws_id, input_vals,
+                                                   ws_input_refs,
+                                                   cell_id, run_id)
+        service_ver = job_runner_inputs['service_ver']
+
+        # Log that we're trying to run a job...
+        log_info = {
+            'app_id': app_id,
+            'tag': tag,
+            'version': service_ver,
+            'username': system_variable('user_id'),
+            'wsid': ws_id
+        }
+        kblogging.log_event(self._log, "run_app", log_info)
+
+        try:
+            job_id = self.njs.run_job(job_runner_inputs)
+        except Exception as e:
+            log_info.update({'err': str(e)})
+            kblogging.log_event(self._log, "run_app_error", log_info)
+            raise transform_job_exception(e)
+
+        new_job = Job(job_id,
+                      app_id,
+                      [params],
+                      system_variable('user_id'),
+                      tag=tag,
+                      app_version=service_ver,
+                      cell_id=cell_id,
+                      run_id=run_id)
+
+        self._send_comm_message('run_status', {
+            'event': 'launched_job',
+            'event_at': datetime.datetime.utcnow().isoformat() + 'Z',
+            'cell_id': cell_id,
+            'run_id': run_id,
+            'job_id': job_id
+        })
+        JobManager().register_new_job(new_job)
+        if cell_id is not None:
+            return
+        else:
+            return new_job
+
+    def _get_job_app_spec(self, app_id, tag, version):
+        """
+        Returns the spec for an app that gets run as a job, after making sure that
+        it can be run with the given tag and version. Raises a ValueError if the
+        app_id, tag, or version aren't valid, or an Exception if the app isn't one
+        that runs as a job.
+        """
         # Intro tests:
         self.spec_manager.check_app(app_id, tag, raise_exception=True)
 
@@ -227,28 +341,14 @@ class AppManager(object):
             raise Exception("This app does not appear to be a long-running " +
                             "job! Please use 'run_local_app' to start this " +
                             "instead.")
+        return spec
 
-        # Preflight check the params - all required ones are present, all
-        # values are the right type, all numerical values are in given ranges
-        spec_params = self.spec_manager.app_params(spec)
-        spec_params_map = dict((spec_params[i]['id'], spec_params[i])
-                               for i in range(len(spec_params)))
-
-        (params, ws_input_refs) = self._validate_parameters(app_id,
-                                                            tag,
-                                                            spec_params,
-                                                            params)
-
-        ws_id = system_variable('workspace_id')
-        if ws_id is None:
-            raise ValueError('Unable to retrive current ' +
-                             'Narrative workspace information!')
-
-        input_vals = self._map_inputs(
-            spec['behavior']['kb_service_input_mapping'],
-            params,
-            spec_params_map)
-
+    def _build_job_inputs(self, spec, app_id, tag, version, ws_id, input_vals,
+                          ws_input_refs, cell_id=None, run_id=None):
+        """
+        Builds the input set for NJSW.run_job for an app, with its mapped inputs
+        and input object refs.
+        """
         service_method = spec['behavior']['kb_service_method']
         service_name = spec['behavior']['kb_service_name']
         service_ver = spec['behavior'].get('kb_service_version', None)
@@ -279,45 +379,139 @@ class AppManager(object):
         }
         if len(ws_input_refs) > 0:
             job_runner_inputs['source_ws_objects'] = ws_input_refs
+        return job_runner_inputs
+
+    def run_app_batch(self, app_id, params_list, tag="release", version=None,
+                      max_concurrency=BATCH_SUBMIT_THREADS,
+                      max_rate=BATCH_SUBMIT_RATE):
+        """
+        Runs the same app with each of a list of parameter sets, and returns the
+        results, as a list of dicts in the same order as params_list, like this:
+        {
+            'params': the parameter set,
+            'job': the started Job, or None if it couldn't be started,
+            'error': None, or the reason the Job couldn't be started
+        }
+
+        All the parameter sets get validated up front, with all the workspace
+        objects they use looked up together. Any that are valid are then started
+        over up to max_concurrency threads, with no more than max_rate jobs
+        started per second. All the started jobs get registered with the
+        JobManager together at the end.
+
+        If the app can't be run at all (e.g. the app_id or tag is invalid), an
+        error is printed, and this returns None.
+
+        Parameters:
+        -----------
+        app_id - should be from the app spec, e.g. 'MegaHit/run_megahit'.
+        params_list - a list of parameter dicts, one for each job to run. Each
+                      is the same as the params given to run_app.
+        tag - optional, one of [release|beta|dev] (default=release)
+        version - optional, a semantic version string. Only released modules
+                  have versions, so if the tag is not 'release', and a version
+                  is given, a ValueError will be raised.
+        max_concurrency - optional, the most jobs to start at once.
+        max_rate - optional, the most jobs to start per second (if 0 or None,
+                   there's no limit).
+
+        Example:
+        --------
+        results = run_app_batch('MegaHit/run_megahit', [
+            {'read_library_name': 'Library_1', 'output_contigset_name': 'Assembly_1'},
+            {'read_library_name': 'Library_2', 'output_contigset_name': 'Assembly_2'}
+        ])
+        """
+        try:
+            spec = self._get_job_app_spec(app_id, tag, version)
+            spec_params = self.spec_manager.app_param_index(app_id, tag)
+            ws_id = system_variable('workspace_id')
+            workspace = system_variable('workspace')
+            if ws_id is None or workspace is None:
+                raise ValueError('Unable to retrive current ' +
+                                 'Narrative workspace information!')
+            user_id = system_variable('user_id')
+        except Exception as e:
+            print("Error while trying to start your apps (run_app_batch)!\n" +
+                  "-------------------------------------\n" +
+                  str(e))
+            return
+
+        results = [{'params': params, 'job': None, 'error': None}
+                   for params in params_list]
+
+        # look up every input object at once, so each job's validation and input
+        # mapping doesn't need to. A parameter set that can't even be read is
+        # marked as failed here, and left out of the rest.
+        to_validate = list()
+        object_keys = list()
+        for (i, params) in enumerate(params_list):
+            try:
+                params = dict(params) if params else dict()
+                object_keys.extend(self._ws_object_keys(spec_params, params, workspace))
+                to_validate.append((i, params))
+            except Exception as e:
+                results[i]['error'] = str(e)
+        object_infos = self._get_ws_object_infos(object_keys)
+
+        to_submit = list()
+        for (i, params) in to_validate:
+            try:
+                (params, ws_input_refs) = self._validate_parameters(
+                    app_id, tag, spec_params, params, object_infos=object_infos)
+                input_vals = self._map_inputs(
+                    spec['behavior']['kb_service_input_mapping'],
+                    params,
+                    spec_params,
+                    object_infos=object_infos)
+                job_runner_inputs = self._build_job_inputs(
+                    spec, app_id, tag, version, ws_id, input_vals, ws_input_refs)
+                to_submit.append((i, params, job_runner_inputs))
+            except Exception as e:
+                results[i]['error'] = str(e)
 
-        # Log that we're trying to run a job...
         log_info = {
             'app_id': app_id,
             'tag': tag,
-            'version': service_ver,
-            'username': system_variable('user_id'),
-            'wsid': ws_id
+            'username': user_id,
+            'wsid': ws_id,
+            'num_jobs': len(to_submit),
+            'num_invalid': len(params_list) - len(to_submit)
         }
-        kblogging.log_event(self._log, "run_app", log_info)
+        kblogging.log_event(self._log, "run_app_batch", log_info)
 
-        try:
-            job_id = self.njs.run_job(job_runner_inputs)
-        except Exception as e:
-            log_info.update({'err': str(e)})
-            kblogging.log_event(self._log, "run_app_error", log_info)
-            raise transform_job_exception(e)
+        new_jobs = list()
+        if to_submit:
+            limiter = _RateLimiter(max_rate)
 
-        new_job = Job(job_id,
-                      app_id,
-                      [params],
-                      system_variable('user_id'),
-                      tag=tag,
-                      app_version=service_ver,
-                      cell_id=cell_id,
-                      run_id=run_id)
+            def submit(item):
+                limiter.wait()
+                try:
+                    return (item, self.njs.run_job(item[2]), None)
+                except Exception as e:
+                    return (item, None, transform_job_exception(e))
 
-        self._send_comm_message('run_status', {
-            'event': 'launched_job',
-            'event_at': datetime.datetime.utcnow().isoformat() + 'Z',
-            'cell_id': cell_id,
-            'run_id': run_id,
-            'job_id': job_id
-        })
-        JobManager().register_new_job(new_job)
-        if cell_id is not None:
-            return
-        else:
-            return new_job
+            pool = ThreadPool(max(1, min(max_concurrency, len(to_submit))))
+            try:
+                for ((i, params, job_runner_inputs), job_id, err) in pool.imap_unordered(submit, to_submit):
+                    if err is not None:
+                        kblogging.log_event(self._log, "run_app_error",
+                                            dict(log_info, err=str(err)))
+                        results[i]['error'] = str(err)
+                        continue
+                    results[i]['job'] = Job(job_id,
+                                            app_id,
+                                            [params],
+                                            user_id,
+                                            tag=tag,
+                                            app_version=job_runner_inputs['service_ver'])
+                    new_jobs.append(results[i]['job'])
+            finally:
+                pool.close()
+                pool.join()
+        if new_jobs:
+            JobManager().register_new_jobs(new_jobs)
+        return results
 
     def run_local_app(self, app_id, params, tag="release", version=None,
                       cell_id=None, run_id=None, **kwargs):
@@ -417,9 +611,11 @@ class AppManager(object):
         # First, validate.
         # Preflight check the params - all required ones are present, all
         # values are the right type, all numerical values are in given ranges
-        spec_params = self.spec_manager.app_params(spec)
+        spec_params = self.spec_manager.app_param_index(app_id, tag)
+        object_infos = dict()
         (params, ws_refs) = self._validate_parameters(app_id, tag,
-                                                      spec_params, params)
+                                                      spec_params, params,
+                                                      object_infos=object_infos)
 
         # Log that we're trying to run a job...
         log_info = {
@@ -446,12 +642,11 @@ class AppManager(object):
                                                       widget_params,
                                                       cell_id=cell_id, tag=tag)
         elif app_type == 'editor':
-            spec_params_map = dict((spec_params[i]['id'], spec_params[i])
-                                   for i in range(len(spec_params)))
             input_vals = self._map_inputs(
                 spec['behavior']['kb_service_input_mapping'],
                 params,
-                spec_params_map
+                spec_params,
+                object_infos=object_infos
             )
             function_name = "{}.{}".format(
                 spec['behavior']['kb_service_name'],
@@ -575,9 +770,11 @@ class AppManager(object):
         return WidgetManager().show_custom_widget(custom_widget, app_id,
                                                   version, tag, spec, cell_id)
 
-    def _validate_parameters(self, app_id, tag, spec_params, params):
+    def _validate_parameters(self, app_id, tag, spec_params, params,
+                             object_infos=None):
         """
-        Validates the dict of params against the spec_params. If all is good,
+        Validates the dict of params against the spec_params (either an AppParams
+        from the SpecManager, or a list of params). If all is good,
         it updates a few parameters that need it - checkboxes go from
         True/False to 1/0, and sets default values where necessary.
         Then it returns a tuple like this:
@@ -588,16 +785,18 @@ class AppManager(object):
         If it fails, this will raise a ValueError with a description of the
         problem and a (hopefully useful!) hint for the user as to what went
         wrong.
-        """
-        spec_param_ids = [p['id'] for p in spec_params]
 
-        # Cheater way for making a dict of params with param[id] => param
-        params_dict = dict((spec_params[i]['id'], spec_params[i])
-                           for i in range(len(spec_params)))
+        All the workspace objects given as inputs get looked up together, in as
+        few calls as possible. If object_infos is a dict, those lookups get added
+        to it (see _lookup_ws_objects), so they can be used again when mapping
+        inputs.
+        """
+        if not isinstance(spec_params, AppParams):
+            spec_params = AppParams(spec_params)
 
         # First, test for presence.
         missing_params = list()
-        for p in spec_params:
+        for p in spec_params.params:
             if not p['optional'] and \
                not p['default'] and \
                not params.get(p['id'], None):
@@ -611,7 +810,7 @@ class AppManager(object):
         # Next, test for extra params that don't make sense
         extra_params = list()
         for p in params.keys():
-            if p not in spec_param_ids:
+            if p not in spec_params.ids:
                 extra_params.append(p)
         if len(extra_params):
             msg = 'Unknown parameters {} - maybe something was misspelled?\n' \
@@ -630,15 +829,22 @@ class AppManager(object):
             msg = msg.format(workspace, ws_id)
             raise ValueError(msg)
 
+        infos = self._lookup_ws_objects(spec_params, params, workspace,
+                                        known=object_infos)
+        if object_infos is not None:
+            object_infos.update(infos)
+            infos = object_infos
+
         param_errors = list()
         # If they're workspace objects, track their refs in a list we'll pass
         # to run_job as a separate param to track provenance.
         ws_input_refs = list()
-        for p in spec_params:
+        for p in spec_params.params:
             if p['id'] in params:
                 (wsref, err) = self._check_parameter(p, params[p['id']],
                                                      workspace,
-                                                     all_params=params_dict)
+                                                     all_params=spec_params,
+                                                     object_infos=infos)
                 if err is not None:
                     param_errors.append("{} - {}".format(p['id'], err))
                 if wsref is not None:
@@ -653,7 +859,7 @@ class AppManager(object):
                 "\n".join(param_errors)))
 
         # Hooray, parameters are validated. Set them up for transfer.
-        for p in spec_params:
+        for p in spec_params.params:
             # If any param is a checkbox, need to map from boolean to actual
             # expected value in p['checkbox_map']
             # note that True = 0th elem, False = 1st
@@ -668,23 +874,127 @@ class AppManager(object):
 
         return (params, ws_input_refs)
 
-    def _resolve_ref(self, workspace, obj_name):
-        info = self.ws_client.get_object_info_new({'objects': [{'workspace': workspace, 
-                                                                'name': obj_name}]})[0]
+    def _is_input_object_param(self, param):
+        """
+        Returns True if the param takes a workspace object as input (i.e. it has
+        allowed types and isn't an output).
+        """
+        return len(param.get('allowed_types', [])) > 0 and \
+            not param.get('is_output', False)
+
+    def _ws_object_key(self, value, workspace):
+        """
+        Returns the key for a workspace object input value in the dict returned by
+        _lookup_ws_objects. Values with a / are references, others are names of
+        objects in the given workspace.
+        """
+        if '/' in value:
+            return (None, value)
+        return (workspace, value)
+
+    def _lookup_ws_objects(self, spec_params, params, workspace, known=None):
+        """
+        Looks up the info of every workspace object given as an input in params,
+        including in lists and parameter groups. This uses as few
+        get_object_info_new calls as possible, with up to WS_OBJECT_INFO_BATCH_SIZE
+        objects in each. Objects that are already in the known dict (if given)
+        aren't looked up again.
+
+        Returns a dict with key = (workspace, name) for object names, or
+        (None, ref) for references (see _ws_object_key), and value = the object
+        info, or None if it wasn't found. Objects in a batch where the lookup
+        failed altogether are left out, so they just get looked up individually
+        later.
+        """
+        keys = self._ws_object_keys(spec_params, params, workspace)
+        if known:
+            keys = [key for key in keys if key not in known]
+        return self._get_ws_object_infos(keys)
+
+    def _ws_object_keys(self, spec_params, params, workspace):
+        """
+        Returns the list of keys (see _ws_object_key) for all the workspace objects
+        given as inputs in params, without duplicates.
+        """
+        keys = list()
+        seen = set()
+
+        def add(param, value):
+            if not self._is_input_object_param(param) or \
+                    not isinstance(value, basestring) or not value:
+                return
+            if len(value.split('/')) > 3:
+                # not a valid reference - validation will say so.
+                return
+            key = self._ws_object_key(value, workspace)
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+        for p in spec_params.params:
+            if p['id'] not in params:
+                continue
+            values = params[p['id']]
+            if not isinstance(values, list):
+                values = [values]
+            for v in values:
+                if p['type'] == 'group':
+                    if isinstance(v, dict):
+                        for member_id in v:
+                            if member_id in spec_params:
+                                add(spec_params[member_id], v[member_id])
+                else:
+                    add(p, v)
+        return keys
+
+    def _get_ws_object_infos(self, keys):
+        """
+        Looks up the workspace objects with the given keys (see _ws_object_key),
+        in batches, and returns them as described in _lookup_ws_objects.
+        """
+        keys = list(collections.OrderedDict.fromkeys(keys))
+        infos = dict()
+        for i in range(0, len(keys), WS_OBJECT_INFO_BATCH_SIZE):
+            batch = keys[i:i + WS_OBJECT_INFO_BATCH_SIZE]
+            objects = [{'ref': key[1]} if key[0] is None
+                       else {'workspace': key[0], 'name': key[1]}
+                       for key in batch]
+            try:
+                batch_infos = self.ws_client.get_object_info_new({
+                    'objects': objects,
+                    'ignoreErrors': 1
+                })
+            except Exception as e:
+                kblogging.log_event(self._log, "lookup_ws_objects.error",
+                                    {'err': str(e)})
+                continue
+            for (key, info) in zip(batch, batch_infos):
+                infos[key] = info
+        return infos
+
+    def _resolve_ref(self, workspace, obj_name, object_infos=None):
+        info = None
+        if object_infos is not None:
+            info = object_infos.get(self._ws_object_key(obj_name, workspace))
+        if info is None:
+            info = self.ws_client.get_object_info_new({'objects': [{'workspace': workspace,
+                                                                    'name': obj_name}]})[0]
         return "{}/{}/{}".format(info[6], info[0], info[4])
 
-    def _resolve_ref_if_typed(self, value, spec_param):
+    def _resolve_ref_if_typed(self, value, spec_param, object_infos=None):
         is_output = 'is_output' in spec_param and spec_param['is_output'] == 1
         if 'allowed_types' in spec_param and not is_output:
             allowed_types = spec_param['allowed_types']
             if len(allowed_types) > 0:
                 workspace = system_variable('workspace')
-                return self._resolve_ref(workspace, value)
+                return self._resolve_ref(workspace, value, object_infos)
         return value
 
-    def _map_group_inputs(self, value, spec_param, spec_params):
+    def _map_group_inputs(self, value, spec_param, spec_params,
+                          object_infos=None):
         if isinstance(value, list):
-            return [self._map_group_inputs(v, spec_param, spec_params)
+            return [self._map_group_inputs(v, spec_param, spec_params,
+                                           object_infos)
                     for v in value]
         else:
             mapped_value = dict()
@@ -696,11 +1006,13 @@ class AppManager(object):
             for param_id in value:
                 target_key = id_map.get(param_id, param_id)
                 target_val = self._resolve_ref_if_typed(value[param_id],
-                                                        spec_params[param_id])
+                                                        spec_params[param_id],
+                                                        object_infos)
                 mapped_value[target_key] = target_val
             return mapped_value
 
-    def _map_inputs(self, input_mapping, params, spec_params):
+    def _map_inputs(self, input_mapping, params, spec_params,
+                    object_infos=None):
         """
         Maps the dictionary of parameters and inputs based on rules provided in
         the input_mapping. This iterates over the list of input_mappings, and
@@ -712,6 +1024,9 @@ class AppManager(object):
         NarrativeMethodStore.ServiceMethodInputMapping.
         params is a dict of key-value-pairs, each key is the input_parameter
         field of some parameter.
+        object_infos is an optional dict of workspace object infos that were
+        already looked up (see _lookup_ws_objects), so they don't need to be
+        looked up again when resolving references.
         """
         inputs_dict = dict()
         for p in input_mapping:
@@ -724,7 +1039,7 @@ class AppManager(object):
                 p_value = params.get(input_param_id, None)
                 if spec_params[input_param_id].get('type', '') == 'group':
                     p_value = self._map_group_inputs(p_value, spec_params[input_param_id],
-                                                     spec_params)
+                                                     spec_params, object_infos)
                 # turn empty strings into None
                 if isinstance(p_value, basestring) and len(p_value) == 0:
                     p_value = None
@@ -739,7 +1054,7 @@ class AppManager(object):
                 if input_param_id:
                     spec_param = spec_params[input_param_id]
                 p_value = self._transform_input(p['target_type_transform'], p_value,
-                                                spec_param)
+                                                spec_param, object_infos)
 
             # get position!
             arg_position = p.get('target_argument_position', 0)
@@ -784,7 +1099,8 @@ class AppManager(object):
             inputs_list.append(inputs_dict[k])
         return inputs_list
 
-    def _transform_input(self, transform_type, value, spec_param):
+    def _transform_input(self, transform_type, value, spec_param,
+                         object_infos=None):
         """
         Transforms an input according to the rules given in
         NarrativeMethodStore.ServiceMethodInputMapping
@@ -808,7 +1124,8 @@ class AppManager(object):
         elif transform_type == "resolved-ref":
             # make a workspace ref
             if value is not None:
-                value = self._resolve_ref(system_variable('workspace'), value)
+                value = self._resolve_ref(system_variable('workspace'), value,
+                                          object_infos)
             return value
 
         elif transform_type == "future-default":
@@ -817,7 +1134,8 @@ class AppManager(object):
                 return value
             else:
                 if value is not None:
-                    value = self._resolve_ref_if_typed(value, spec_param)
+                    value = self._resolve_ref_if_typed(value, spec_param,
+                                                       object_infos)
                 return value
 
         elif transform_type == "int":
@@ -875,7 +1193,8 @@ class AppManager(object):
             ret = ret + str(generator['suffix'])
         return ret
 
-    def _check_parameter(self, param, value, workspace, all_params=None):
+    def _check_parameter(self, param, value, workspace, all_params=None,
+                         object_infos=None):
         """
         Checks if the given value matches the rules provided in the param dict.
         If yes, returns None
@@ -893,10 +1212,16 @@ class AppManager(object):
             A value input by the user
         workspace : string
             The name of the current workspace to search against (if needed)
-        all_params : dict (param id -> param dict)
+        all_params : AppParams (or dict of param id -> param dict)
             All spec parameters. Really only needed when validating a parameter
-            group, because it probably needs to dig into all of them.
+            group, because it probably needs to dig into all of them. If it's an
+            AppParams, its precompiled patterns get used for validating values.
+        object_infos : dict
+            Workspace object infos that were already looked up (see
+            _lookup_ws_objects). Any input objects not in here get looked up
+            one at a time.
         """
+        param_index = all_params if isinstance(all_params, AppParams) else None
         if param['allow_multiple'] and isinstance(value, list):
             ws_refs = list()
             error_list = list()
@@ -906,14 +1231,17 @@ class AppManager(object):
                     (ref, err) = self._validate_group_values(param,
                                                              v,
                                                              workspace,
-                                                             all_params)
+                                                             all_params,
+                                                             object_infos)
                 else:
                     # returns a single ref / err pair
                     (ref, err) = self._validate_param_value(param,
                                                             v,
-                                                            workspace)
-                    ref = [ref]
-                    err = [err]
+                                                            workspace,
+                                                            param_index,
+                                                            object_infos)
+                    ref = [ref] if ref is not None else []
+                    err = [err] if err is not None else []
                 if err:
                     error_list += err
                 if ref:
@@ -922,15 +1250,21 @@ class AppManager(object):
                 return (None, "\n\t".join(error_list))
             else:
                 return (ws_refs, None)
-        return self._validate_param_value(param, value, workspace)
+        return self._validate_param_value(param, value, workspace, param_index,
+                                          object_infos)
 
-    def _validate_group_values(self, param, value, workspace, spec_params):
+    def _validate_group_values(self, param, value, workspace, spec_params,
+                               object_infos=None):
         ref = list()
         err = list()
 
         if not isinstance(value, dict):
             return (None, "A parameter-group must be a dictionary")
 
+        if isinstance(spec_params, AppParams):
+            member_ids = spec_params.group_members(param['id'])
+        else:
+            member_ids = param.get('parameter_ids', [])
         for param_id in value:
             if param_id not in spec_params:
                 err.append(
@@ -939,7 +1273,7 @@ class AppManager(object):
                     )
                 )
                 continue
-            if param_id not in param.get('parameter_ids', []):
+            if param_id not in member_ids:
                 err.append(
                     'Unmappable parameter id "{}" in parameter group'.format(
                         param_id
@@ -947,7 +1281,9 @@ class AppManager(object):
                 )
                 continue
             (param_ref, param_err) = self._validate_param_value(
-                spec_params[param_id], value[param_id], workspace
+                spec_params[param_id], value[param_id], workspace,
+                spec_params if isinstance(spec_params, AppParams) else None,
+                object_infos
             )
             if param_ref:
                 ref.append(param_ref)
@@ -955,7 +1291,8 @@ class AppManager(object):
                 err.append(param_err)
         return (ref, err)
 
-    def _validate_param_value(self, param, value, workspace):
+    def _validate_param_value(self, param, value, workspace, param_index=None,
+                              object_infos=None):
         """
         Tests a value to make sure it's valid, based on the rules given in the
         param dict. Returns None if valid, an error string if not.
@@ -972,6 +1309,12 @@ class AppManager(object):
         workspace : string
             The name of the current workspace to test workspace object types
             against, if required by the parameter.
+        param_index : AppParams (optional)
+            The indexed params of the app, to get the param's precompiled type
+            and regex patterns from. If None, the param's own patterns are used.
+        object_infos : dict (optional)
+            Workspace object infos that were already looked up (see
+            _lookup_ws_objects). If the value isn't in here, it gets looked up.
         """
         # The workspace reference for the parameter. Can be None.
         ws_ref = None
@@ -1012,12 +1355,18 @@ class AppManager(object):
         if 'allowed_types' in param and len(param['allowed_types']) > 0 and \
                 not param['is_output']:
             try:
+                if '/' in value and len(value.split('/')) > 3:
+                    return (ws_ref, 'Data reference named {} does not '
+                                    'have the right format - should be '
+                                    'workspace/object/version(optional)')
+                key = self._ws_object_key(value, workspace)
+                if object_infos is not None and key in object_infos:
+                    # already looked up with the rest of the inputs.
+                    info = object_infos[key]
+                    if info is None:
+                        raise ValueError('Object {} not found'.format(value))
                 # If we see a / , assume it's already an object reference.
-                if '/' in value:
-                    if len(value.split('/')) > 3:
-                        return (ws_ref, 'Data reference named {} does not '
-                                        'have the right format - should be '
-                                        'workspace/object/version(optional)')
+                elif '/' in value:
                     info = self.ws_client.get_object_info_new({
                         'objects': [{'ref': value}]
                     })[0]
@@ -1028,7 +1377,11 @@ class AppManager(object):
                     })[0]
                 ws_ref = "{}/{}/{}".format(info[6], info[0], info[4])
                 type_ok = False
-                for t in param['allowed_types']:
+                if param_index is not None:
+                    type_patterns = param_index.type_patterns(param['id'])
+                else:
+                    type_patterns = param['allowed_types']
+                for t in type_patterns:
                     if re.match(t, info[2]):
                         type_ok = True
                 if not type_ok:
@@ -1077,11 +1430,15 @@ class AppManager(object):
 
         # Last, regex. not being used in any extant specs, but cover it anyway.
         if 'regex_constraint' in param:
-            for regex in param['regex_constraint']:
+            if param_index is not None:
+                regexes = param_index.regex_constraints(param['id'])
+            else:
+                regexes = param['regex_constraint']
+            for regex in regexes:
                 if not re.match(regex, value):
                     return (ws_ref,
                             'Value {} does not match required regex {}'.format(
-                                value, regex))
+                                value, getattr(regex, 'pattern', regex)))
 
         # Whew. Passed all filters!
         return (ws_ref, None)
@@ -5,6 +5,8 @@ __author__ = "Bill Riehl <wjriehl@lbl.gov>"
 
 import biokbase.narrative.clients as clients
 from .specmanager import SpecManager
+from .scheduler import is_terminal_state
+from .logstore import JobLogStore
 from biokbase.narrative.app_util import (
     system_variable,
     map_inputs_from_job,
@@ -28,7 +30,6 @@ class Job(object):
     run_id = None
     inputs = None
     # _comm = None
-    _job_logs = list()
 
     def __init__(self, job_id, app_id, inputs, owner, tag='release', app_version=None, cell_id=None, run_id=None):
         """
@@ -45,6 +46,17 @@ class Job(object):
         self.inputs = inputs
         self.owner = owner
         self._njs = clients.get('job_service')
+        # Remembered once they're known, since none of these change.
+        # Job params as returned by get_job_params
+        self._job_params = None
+        # The last state seen, once the job's finished or canceled.
+        self._final_state = None
+        # Output viewer parameters for a completed job
+        self._viewer_params = None
+        # Log lines fetched so far, and whether that's all of them (True once the
+        # log's been fetched after the job finished).
+        self._log_store = JobLogStore()
+        self._log_complete = False
 
     @classmethod
     def from_state(Job, job_id, job_info, owner, app_id, tag='release', cell_id=None, run_id=None):
@@ -67,14 +79,62 @@ class Job(object):
             The Tag (release, beta, dev) used to start the job.
         cell_id - the cell associated with the job (optional)
         run_id - the front-end id associated with the job (optional)
+
+        The job_info is remembered as the first element of the Job's parameters(), so
+        it doesn't get fetched again.
+        """
+        job = Job(job_id,
+                  app_id,
+                  job_info['params'],
+                  owner,
+                  tag=tag,
+                  app_version=job_info.get('service_ver', None),
+                  cell_id=cell_id,
+                  run_id=run_id)
+        job._job_params = [job_info]
+        return job
+
+    @classmethod
+    def from_cache(Job, record):
+        """
+        Rebuilds a finished Job from a record made by cache_record(), without needing
+        to talk to the job service.
         """
-        return Job(job_id,
-                   app_id,
-                   job_info['params'],
-                   owner,
-                   tag=tag,
-                   app_version=job_info.get('service_ver', None),
-                   cell_id=cell_id)
+        job = Job(record['job_id'],
+                  record.get('app_id'),
+                  record['job_params'][0]['params'],
+                  record.get('owner'),
+                  tag=record.get('tag', 'release'),
+                  app_version=record['job_params'][0].get('service_ver', None),
+                  cell_id=record.get('cell_id'),
+                  run_id=record.get('run_id'))
+        job._job_params = record['job_params']
+        job._final_state = record['final_state']
+        job._viewer_params = record.get('viewer_params')
+        return job
+
+    def cache_record(self):
+        """
+        Returns a dict with everything needed to rebuild this Job with from_cache(), or
+        None if it can't be rebuilt that way yet. That's the case until the job's
+        finished and its parameters are known, and if it completed, until its output
+        viewer parameters have been built.
+        """
+        if self._final_state is None or self._job_params is None:
+            return None
+        if self._final_state.get('job_state') == 'completed' and self._viewer_params is None:
+            return None
+        return {
+            'job_id': self.job_id,
+            'app_id': self.app_id,
+            'tag': self.tag,
+            'owner': self.owner,
+            'cell_id': self.cell_id,
+            'run_id': self.run_id,
+            'job_params': self._job_params,
+            'final_state': self._final_state,
+            'viewer_params': self._viewer_params
+        }
 
     def info(self):
         spec = self.app_spec()
@@ -98,29 +158,57 @@ class Job(object):
         return self._njs.check_job(self.job_id)['job_state']
 
     def parameters(self):
-        try:
-            return self._njs.get_job_params(self.job_id)
-        except Exception as e:
-            raise Exception("Unable to fetch parameters for job {} - {}".format(self.job_id, e))
+        """
+        Returns the job parameters, as returned by NJS.get_job_params. These only get
+        fetched the first time, since they can't change.
+        """
+        if self._job_params is None:
+            try:
+                self._job_params = self._njs.get_job_params(self.job_id)
+            except Exception as e:
+                raise Exception("Unable to fetch parameters for job {} - {}".format(self.job_id, e))
+        return self._job_params
+
+    def final_state(self):
+        """
+        Returns a copy of the job's state if it's known to be finished or canceled,
+        or None otherwise. This never talks to the job service.
+        """
+        if self._final_state is None:
+            return None
+        return dict(self._final_state)
 
     def state(self):
         """
         Queries the job service to see the status of the current job.
         Returns a <something> stating its status. (string? enum type? different traitlet?)
+        Once the job's finished, its final state is returned without asking the job
+        service again.
         """
+        if self._final_state is not None:
+            return self.final_state()
         try:
             state = self._njs.check_job(self.job_id)
-            if 'cancelled' in state:
-                state[u'canceled'] = state.get('cancelled', 0)
-                del state['cancelled']
-            if state.get('job_state', '') == 'cancelled':
-                state[u'job_state'] = 'canceled'
-            state[u'cell_id'] = self.cell_id
-            state[u'run_id'] = self.run_id
-            return state
+            return self._update_state(state)
         except Exception as e:
             raise Exception("Unable to fetch info for job {} - {}".format(self.job_id, e))
 
+    def _update_state(self, state):
+        """
+        Normalizes a raw job state returned from the job service (either through
+        check_job or check_jobs) and tags it with this Job's cell and run ids.
+        """
+        if 'cancelled' in state:
+            state[u'canceled'] = state.get('cancelled', 0)
+            del state['cancelled']
+        if state.get('job_state', '') == 'cancelled':
+            state[u'job_state'] = 'canceled'
+        state[u'cell_id'] = self.cell_id
+        state[u'run_id'] = self.run_id
+        if is_terminal_state(state):
+            self._final_state = dict(state)
+        return state
+
     def show_output_widget(self, state=None):
         """
         For a complete job, returns the job results.
@@ -136,14 +224,20 @@ class Job(object):
             return "Job is incomplete! It has status '{}'".format(state['job_state'])
 
     def get_viewer_params(self, state):
+        """
+        Returns the output viewer info for a completed job, or None if it's not
+        complete. A completed job's outputs don't change, so this only gets built once.
+        """
         if state is None or state['job_state'] != 'completed':
             return None
-        (output_widget, widget_params) = self._get_output_info(state)
-        return {
-            'name': output_widget,
-            'tag': self.tag,
-            'params': widget_params
-        }
+        if self._viewer_params is None:
+            (output_widget, widget_params) = self._get_output_info(state)
+            self._viewer_params = {
+                'name': output_widget,
+                'tag': self.tag,
+                'params': widget_params
+            }
+        return self._viewer_params
 
     def _get_output_info(self, state):
         spec = self.app_spec()
@@ -171,9 +265,19 @@ class Job(object):
         log() - returns all available log lines
         log(first_line=5) - returns every line available starting with line 5
         log(num_lines=100) - returns the first 100 lines (or all lines available if < 100)
+
+        Only lines that haven't been seen before are fetched from the Job Service, and
+        once the job's finished and its whole log's been fetched, it's never fetched again.
         """
         self._update_log()
-        num_available_lines = len(self._job_logs)
+        return self.cached_log(first_line=first_line, num_lines=num_lines)
+
+    def cached_log(self, first_line=0, num_lines=None):
+        """
+        Same as log(), but only returns lines that have already been fetched, without
+        asking the Job Service for new ones.
+        """
+        num_available_lines = len(self._log_store)
 
         if first_line < 0:
             first_line = 0
@@ -184,19 +288,52 @@ class Job(object):
 
         if first_line >= num_available_lines or num_lines <= 0:
             return (num_available_lines, list())
-        return (num_available_lines, self._job_logs[first_line:first_line+num_lines])
+        return (num_available_lines, self._log_store.get_lines(first_line, num_lines))
+
+    def latest_log(self, num_lines=None):
+        """
+        Like log(), but returns the last num_lines lines of the log (or all of them, if
+        num_lines is None).
+        This returns a 3-tuple (number of available log lines, first line returned, list of log lines)
+        """
+        self._update_log()
+        num_available_lines = len(self._log_store)
+        first_line = 0
+        if num_lines is not None and num_available_lines > num_lines:
+            first_line = num_available_lines - max(num_lines, 0)
+        return (num_available_lines,
+                first_line,
+                self._log_store.get_lines(first_line, num_available_lines - first_line))
 
+    def close_log(self):
+        """
+        Drops the log lines stored for this job, along with any temporary file they were
+        spilled to. They get fetched again if the log's asked for later.
+        """
+        self._log_store.close()
+        self._log_complete = False
 
     def _update_log(self):
-        log_update = self._njs.get_job_logs({'job_id': self.job_id, 'skip_lines': len(self._job_logs)})
+        """
+        Fetches any new log lines from the Job Service, skipping the ones already stored.
+        """
+        if self._log_complete:
+            return
+        # if the job was already finished before this fetch, then this gets the rest of the log.
+        finished = self._final_state is not None
+        log_update = self._njs.get_job_logs({'job_id': self.job_id, 'skip_lines': len(self._log_store)})
         if log_update['lines']:
-            self._job_logs = self._job_logs + log_update['lines']
+            self._log_store.append(log_update['lines'])
+        if finished:
+            self._log_complete = True
 
     def is_finished(self):
         """
         Returns True if the job is finished (in any state, including errors or cancelled),
         False if its running/queued.
         """
+        if self._final_state is not None:
+            return True
         status = self.status()
         return status.lower() in ['completed', 'error', 'suspend', 'cancelled']
 
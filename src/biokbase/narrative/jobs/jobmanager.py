@@ -13,9 +13,14 @@ __version__ = "0.0.1"
 
 import biokbase.narrative.clients as clients
 from .job import Job
+from .scheduler import JobPollScheduler
+from .jobstatecache import JobStateCache
 from ipykernel.comm import Comm
 import threading
+import Queue
+from multiprocessing.pool import ThreadPool
 import json
+import hashlib
 import logging
 from biokbase.narrative.common import kblogging
 from biokbase.narrative.common.log_common import EVENT_MSG_SEP
@@ -31,18 +36,85 @@ from biokbase.narrative.exception_util import (
 import traceback
 import sys
 
+# The largest number of job ids to look up with a single NJS.check_jobs call.
+JOB_STATUS_BATCH_SIZE = 100
+# The most threads to use at once for fetching job info when initializing jobs.
+JOB_INIT_THREADS = 4
+# The most log lines to push to the front end in a single message for a subscribed job.
+LOG_PUSH_MAX_LINES = 500
+# The most bytes (roughly) of log lines to push in a single message for a subscribed job.
+# At least one line always gets sent, no matter how long.
+LOG_PUSH_MAX_BYTES = 256 * 1024
+# The longest the lookup loop will sleep when there are no jobs to look up. It gets
+# woken up early whenever a new job's registered, anyway.
+MAX_LOOKUP_LOOP_SLEEP = 60
+
+
+class _WorkerTask(object):
+    """
+    A function call to be run on the JobManager's worker thread, and what came of it.
+    """
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self._done = threading.Event()
+        self._result = None
+        self._exc_info = None
+
+    def run(self):
+        try:
+            self._result = self.fn(*self.args, **self.kwargs)
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            self._done.set()
+
+    def wait(self):
+        """
+        Waits for the call to finish, then returns its result, or raises what it raised.
+        """
+        # waiting with a timeout keeps this interruptible.
+        while not self._done.wait(1):
+            pass
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+
 class JobManager(object):
     """
     The KBase Job Manager clsas. This handles all jobs and makes their status available.
     On status lookups, it feeds the results to the KBaseJobs channel that the front end
     listens to.
+
+    All calls to the job services and all changes to the set of jobs happen on a single
+    worker thread, one at a time. That thread also runs the status lookup loop in between
+    other work. The public methods hand their work to that thread and wait for it to
+    finish, so they can be called from anywhere. Comm messages get handed over too, but
+    aren't waited for.
     """
     __instance = None
 
-    # keys = job_id, values = { refresh = T/F, job = Job object }
+    # keys = job_id, values = { refresh = T/F, job = Job object, status = last known status,
+    #                           unavailable = error info, if the job couldn't be initialized }
+    # Only changed on the worker thread, with _registry_lock held.
     _running_jobs = dict()
-
-    _lookup_timer = None
+    _registry_lock = threading.RLock()
+
+    # decides which jobs are due for a status lookup on each pass of the lookup loop
+    _scheduler = JobPollScheduler()
+    # the worker thread, and its queue of _WorkerTasks (None just wakes it up)
+    _worker = None
+    _tasks = Queue.Queue()
+    # keys = job_id, values = fingerprint of the last status the front end was sent
+    _sent_status = dict()
+    # refs of the app specs the front end has already been sent
+    _sent_specs = set()
+    # keys = job_id, values = number of the next log line to push to the front end
+    _log_subscriptions = dict()
+    # on-disk cache of the current workspace's finished jobs
+    _job_cache = None
     _comm = None
     _log = kblogging.get_logger(__name__)
     # TODO: should this not be done globally?
@@ -60,10 +132,20 @@ class JobManager(object):
         So it does the following steps.
         1. app_util.system_variable('workspace_id')
         2. get list of jobs with that ws id from UJS (also gets tag, cell_id, run_id)
-        3. initialize the Job objects by running NJS.get_job_params on each of those (also gets app_id)
-        4. start the status lookup loop.
+        3. rebuild any jobs that had finished as of the last session from the local job
+           state cache, without asking NJS about them.
+        4. initialize the rest of the Job objects by fetching their job params from NJS (also
+           gets app_id). This happens in batches, on a few threads at once, and sends
+           job_init_progress messages to the front end as it goes. Jobs whose info can't be
+           fetched are still registered, but marked as unavailable, with an error status.
+        5. look up all job statuses once, then start the status lookup loop.
         """
+        self._run_on_worker(self._initialize_jobs)
 
+    def _initialize_jobs(self):
+        """
+        Does the work of initialize_jobs, on the worker thread.
+        """
         ws_id = system_variable('workspace_id')
         try:
             nar_jobs = clients.get('user_and_job_state').list_jobs2({
@@ -84,55 +166,236 @@ class JobManager(object):
             self._send_comm_message('job_init_err', error)
             raise new_e
 
+        cached_jobs = self._load_job_cache(ws_id)
+        job_infos = self._lookup_job_infos([info[0] for info in nar_jobs
+                                            if info[0] not in cached_jobs])
+
         for info in nar_jobs:
             job_id = info[0]
             user_info = info[1]
             job_meta = info[10]
-            try:
-                job_info = clients.get('job_service').get_job_params(job_id)[0]
-
-                self._running_jobs[job_id] = {
+            if job_id in cached_jobs:
+                self._add_job_entry(job_id, {
                     'refresh': True,
-                    'job': Job.from_state(job_id,
-                                          job_info,
-                                          user_info[0],
-                                          app_id=job_info.get('app_id'),
-                                          tag=job_meta.get('tag', 'release'),
-                                          cell_id=job_meta.get('cell_id', None),
-                                          run_id=job_meta.get('run_id', None))
-                }
-                
-            except Exception as e:
-                kblogging.log_event(self._log, 'init_error', {'err': str(e)})
+                    'job': cached_jobs[job_id]
+                })
+                continue
+            (job_info, job_state) = job_infos.get(job_id, (None, None))
+            if isinstance(job_info, Exception) or job_info is None:
+                e = job_info if job_info is not None else ValueError('No job info found')
+                kblogging.log_event(self._log, 'init_error', {'err': str(e), 'job_id': job_id})
                 new_e = transform_job_exception(e)
-                error = {
-                    'error': 'Unable to get job info on initial lookup',
-                    'job_id': job_id,
-                    'message': getattr(new_e, 'message', 'Unknown reason'),
-                    'code': getattr(new_e, 'code', -1),
-                    'source': getattr(new_e, 'source', 'jobmanager'),
-                    'name': getattr(new_e, 'name', type(e).__name__),
-                    'service': 'job_service'
-                }
-                self._send_comm_message('job_init_lookup_err', error)
-                raise new_e # should crash and burn on any of these.
-
-        if not self._running_lookup_loop:
-            # only keep one loop at a time in cause this gets called again!
-            if self._lookup_timer is not None:
-                self._lookup_timer.cancel()
-            self._running_lookup_loop = True
-            self._lookup_job_status_loop()
-        else:
-            self._lookup_all_job_status()
+                self._add_job_entry(job_id, {
+                    'refresh': False,
+                    'job': Job(job_id,
+                               None,
+                               None,
+                               user_info[0],
+                               tag=job_meta.get('tag', 'release'),
+                               cell_id=job_meta.get('cell_id', None),
+                               run_id=job_meta.get('run_id', None)),
+                    'unavailable': {
+                        'error': 'Unable to get job info on initial lookup',
+                        'message': getattr(new_e, 'message', 'Unknown reason'),
+                        'code': getattr(new_e, 'code', -1),
+                        'source': getattr(new_e, 'source', 'jobmanager'),
+                        'name': getattr(new_e, 'name', type(e).__name__),
+                        'service': 'job_service',
+                        'exception': {
+                            'error_message': str(new_e),
+                            'error_type': type(e).__name__,
+                            'error_stacktrace': ''
+                        }
+                    }
+                })
+                continue
+
+            job = Job.from_state(job_id,
+                                 job_info,
+                                 user_info[0],
+                                 app_id=job_info.get('app_id'),
+                                 tag=job_meta.get('tag', 'release'),
+                                 cell_id=job_meta.get('cell_id', None),
+                                 run_id=job_meta.get('run_id', None))
+            if job_state is not None:
+                job._update_state(job_state)
+            self._add_job_entry(job_id, {
+                'refresh': True,
+                'job': job
+            })
+            self._scheduler.add_job(job_id)
+
+        self._lookup_all_job_status()
+        # drops any jobs that aren't around anymore, and adds any that finished since
+        # the last session.
+        self._save_job_cache()
+        # only keeps one loop at a time, in case this gets called again.
+        self._lookup_job_status_loop()
+
+    def _load_job_cache(self, ws_id):
+        """
+        Sets up the job state cache for the given workspace, and returns the Jobs it
+        has, as a dict with key = job_id, value = Job. Any record that can't be made
+        into a Job is left out (so that job gets looked up as usual). If the cache can't
+        be set up at all (e.g. its directory can't be written), there's no cache, and all
+        jobs get looked up.
+        """
+        jobs = dict()
+        try:
+            self._job_cache = JobStateCache(ws_id)
+        except Exception as e:
+            kblogging.log_event(self._log, 'job_cache_error', {'err': str(e)})
+            self._job_cache = None
+            return jobs
+        try:
+            records = self._job_cache.load()
+        except Exception as e:
+            kblogging.log_event(self._log, 'job_cache_error', {'err': str(e)})
+            return jobs
+        for (job_id, record) in records.items():
+            try:
+                jobs[job_id] = Job.from_cache(record)
+            except Exception as e:
+                kblogging.log_event(self._log, 'job_cache_error', {'err': str(e), 'job_id': job_id})
+        return jobs
+
+    def _save_job_cache(self):
+        """
+        Replaces the job state cache's contents with the finished jobs that are
+        registered now.
+        """
+        if self._job_cache is None:
+            return
+        records = list()
+        for job_id in self._job_ids():
+            record = self._running_jobs[job_id]['job'].cache_record()
+            if record is not None:
+                records.append(record)
+        try:
+            self._job_cache.save(records)
+        except Exception as e:
+            kblogging.log_event(self._log, 'job_cache_error', {'err': str(e)})
+
+    def _cache_job(self, job):
+        """
+        Adds a Job to the job state cache, if it's finished and not already there.
+        """
+        if self._job_cache is None or self._job_cache.has_job(job.job_id):
+            return
+        record = job.cache_record()
+        if record is None:
+            return
+        try:
+            self._job_cache.add(record)
+        except Exception as e:
+            kblogging.log_event(self._log, 'job_cache_error', {'err': str(e), 'job_id': job.job_id})
+
+    def _lookup_job_infos(self, job_ids):
+        """
+        Fetches the job info (the first element of what NJS.get_job_params returns) and
+        current state for each of the given job ids. This uses NJS.check_jobs with job
+        params, in batches of JOB_STATUS_BATCH_SIZE, run over up to JOB_INIT_THREADS threads.
+        If a batch fails, its jobs get looked up with get_job_params, one at a time
+        (but still on those threads).
+
+        A job_init_progress message gets sent to the front end as each batch or job
+        finishes, with content {'loaded': number done so far, 'total': number of jobs}.
+
+        Returns a dict with key = job_id, value = (job_info, job_state). If a job's
+        info can't be fetched, its job_info is the Exception that explains why. If its
+        state wasn't fetched along with the info, job_state is None.
+        """
+        job_infos = dict()
+        if not job_ids:
+            return job_infos
+        total = len(job_ids)
+        batches = [job_ids[i:i + JOB_STATUS_BATCH_SIZE] for i in range(0, total, JOB_STATUS_BATCH_SIZE)]
+        retry_ids = list()
+        pool = ThreadPool(min(JOB_INIT_THREADS, len(batches)))
+        try:
+            for (batch, result) in pool.imap_unordered(self._fetch_job_info_batch, batches):
+                if isinstance(result, Exception):
+                    retry_ids.extend(batch)
+                    continue
+                job_infos.update(result)
+                self._send_comm_message('job_init_progress', {'loaded': len(job_infos), 'total': total})
+            for (job_id, job_info) in pool.imap_unordered(self._fetch_job_info, retry_ids):
+                job_infos[job_id] = (job_info, None)
+                self._send_comm_message('job_init_progress', {'loaded': len(job_infos), 'total': total})
+        finally:
+            pool.close()
+            pool.join()
+        return job_infos
+
+    def _fetch_job_info_batch(self, job_ids):
+        """
+        Fetches the job info and state for a batch of jobs with a single NJS.check_jobs call.
+        Returns a tuple of (job_ids, result). The result is either the Exception raised
+        by the call, or a dict with key = job_id, value = (job_info, job_state) (as
+        described in _lookup_job_infos).
+        """
+        try:
+            results = clients.get('job_service').check_jobs({
+                'job_ids': job_ids,
+                'with_job_params': 1
+            })
+        except Exception as e:
+            kblogging.log_event(self._log, 'init_error', {'err': str(e)})
+            return (job_ids, e)
+        job_states = results.get('job_states', {})
+        job_params = results.get('job_params', {})
+        errors = results.get('check_error', {})
+        infos = dict()
+        for job_id in job_ids:
+            if job_id in job_params:
+                infos[job_id] = (job_params[job_id], job_states.get(job_id))
+            else:
+                err = errors.get(job_id, 'No job info returned from job service')
+                if isinstance(err, dict):
+                    err = err.get('message', err)
+                infos[job_id] = (Exception('Unable to fetch info for job {} - {}'.format(job_id, err)), None)
+        return (job_ids, infos)
+
+    def _fetch_job_info(self, job_id):
+        """
+        Fetches the job info for a single job with NJS.get_job_params. Returns a tuple
+        of (job_id, job_info), where job_info is the Exception raised if it fails.
+        """
+        try:
+            return (job_id, clients.get('job_service').get_job_params(job_id)[0])
+        except Exception as e:
+            return (job_id, e)
+
+    def _add_job_entry(self, job_id, entry):
+        """
+        Adds (or replaces) a job in the registry of running jobs.
+        """
+        with self._registry_lock:
+            self._running_jobs[job_id] = entry
+
+    def _job_ids(self, refresh_only=False):
+        """
+        Returns a snapshot list of the registered job ids, so callers don't run into
+        update-while-iterating problems. If refresh_only is True, only returns the jobs
+        that are flagged to be refreshed.
+        """
+        with self._registry_lock:
+            return [job_id for job_id in self._running_jobs.keys()
+                    if not refresh_only or self._running_jobs[job_id]['refresh']]
 
     def list_jobs(self):
         """
         List all job ids, their info, and status in a quick HTML format.
         """
+        return self._run_on_worker(self._list_jobs)
+
+    def _list_jobs(self):
+        """
+        Does the work of list_jobs, on the worker thread.
+        """
         try:
             status_set = list()
-            for job_id in self._running_jobs:
+            for job_id in self._job_ids():
                 job = self._running_jobs[job_id]['job']
                 job_state = job.state()
                 job_params = job.parameters()
@@ -193,7 +456,8 @@ class JobManager(object):
         """
         A convenience method for fetching an unordered list of all running Jobs.
         """
-        return [j['job'] for j in self._running_jobs.values()]
+        with self._registry_lock:
+            return [j['job'] for j in self._running_jobs.values()]
 
     # def _get_existing_job(self, job_tuple):
     #     """
@@ -215,10 +479,16 @@ class JobManager(object):
     #         kblogging.log_event(self._log, "get_existing_job.error", {'job_id': job_id, 'err': str(e)})
     #         raise
 
-    def _construct_job_status(self, job_id):
+    def _construct_job_status(self, job_id, job_state=None):
         """
         Always creates a Job Status.
         It'll embed error messages into the status if there are problems.
+        The new status gets remembered as the job's last known status, and the job
+        is rescheduled for its next lookup.
+
+        If job_state is given (e.g. from a batched _lookup_job_states call), it's
+        used instead of looking up the job's state again. It can also be the
+        Exception that was raised while fetching that state.
         """
 
         state = {}
@@ -246,17 +516,44 @@ class JobManager(object):
             return {
                 'state': state,
                 'app_spec': app_spec,
+                'spec_ref': None,
                 'widget_info': widget_info,
                 'owner': None
             }
 
+        if 'unavailable' in self._running_jobs[job_id]:
+            state = {
+                'job_state': 'error',
+                'error': self._running_jobs[job_id]['unavailable'],
+                'creation_time': 0,
+                'cell_id': job.cell_id,
+                'run_id': job.run_id,
+                'job_id': job_id
+            }
+            status = {
+                'state': state,
+                'spec': app_spec,
+                'spec_ref': None,
+                'widget_info': widget_info,
+                'owner': job.owner
+            }
+            self._running_jobs[job_id]['status'] = status
+            # there's nothing to look up, so it shouldn't ever be due for a lookup.
+            self._scheduler.remove_job(job_id)
+            return status
+
         try:
             app_spec = job.app_spec()
         except Exception as e:
             kblogging.log_event(self._log, "lookup_job_status.error", {'err': str(e)})
 
         try:
-            state = job.state()
+            if isinstance(job_state, Exception):
+                raise job_state
+            elif job_state is not None:
+                state = job_state
+            else:
+                state = job.state()
         except Exception as e:
             kblogging.log_event(self._log, "lookup_job_status.error", {'err': str(e)})
 
@@ -306,19 +603,27 @@ class JobManager(object):
         if 'canceling' in self._running_jobs[job_id]:
             state['job_state'] = 'canceling'
 
-        return {'state': state,
-                'spec': app_spec,
-                'widget_info': widget_info,
-                'owner': job.owner}
+        status = {'state': state,
+                  'spec': app_spec,
+                  'spec_ref': self._spec_ref(job, app_spec),
+                  'widget_info': widget_info,
+                  'owner': job.owner}
+        self._running_jobs[job_id]['status'] = status
+        self._scheduler.job_polled(job_id, state)
+        self._cache_job(job)
+        return status
 
 
-    def _lookup_job_status(self, job_id):
+    def _lookup_job_status(self, job_id, job_state=None):
         """
         Will raise a ValueError if job_id doesn't exist.
         Sends the status over the comm channel as the usual job_status message.
+        If job_state is given, it's used instead of looking up the job's state again
+        (see _construct_job_status).
         """
-        status = self._construct_job_status(job_id)
+        status = self._construct_job_status(job_id, job_state)
         self._send_comm_message('job_status', status)
+        self._mark_status_sent(job_id, status)
 
     def _lookup_all_job_status(self, ignore_refresh_flag=False):
         """
@@ -326,30 +631,250 @@ class JobManager(object):
         Once job info is acquired, it gets pushed to the front end over the
         'KBaseJobs' channel.
         """
-        status_set = dict()
-        # grab the list of running job ids, so we don't run into update-while-iterating problems.
-        for job_id in self._running_jobs.keys():
-            if self._running_jobs[job_id]['refresh'] or ignore_refresh_flag:
-                status_set[job_id] = self._construct_job_status(job_id)
+        # Jobs that couldn't be initialized always go along with their error status
+        # (it doesn't take a lookup), otherwise the front end takes them as deleted.
+        with self._registry_lock:
+            job_ids = [job_id for (job_id, entry) in self._running_jobs.items()
+                       if ignore_refresh_flag or entry['refresh'] or 'unavailable' in entry]
+        status_set = self._get_job_status_set(job_ids)
         self._send_comm_message('job_status_all', status_set)
+        # The front end replaces its whole cache with this, so it's the new baseline
+        # that deltas get computed against.
+        self._sent_status.clear()
+        for job_id in status_set:
+            self._mark_status_sent(job_id, status_set[job_id])
+
+    def _lookup_due_job_status(self):
+        """
+        Looks up status for only the jobs that the scheduler says are due for a lookup
+        (or that have never been looked up), then sends the ones that changed to the
+        front end as a job_status_delta message.
+        Then pushes any new log lines for jobs with log subscriptions.
+        """
+        due = set(self._scheduler.due_jobs())
+        job_ids = [job_id for job_id in self._job_ids(refresh_only=True)
+                   if job_id in due or 'status' not in self._running_jobs[job_id]]
+        # anything due that isn't getting looked up shouldn't be scheduled anymore.
+        for job_id in due.difference(job_ids):
+            self._scheduler.remove_job(job_id)
+        self._send_job_status_delta(self._get_job_status_set(job_ids))
+        looked_up = set(job_ids)
+        for job_id in list(self._log_subscriptions.keys()):
+            # Only go to the job service for new lines along with the job's status
+            # lookups, but keep sending lines that are already here.
+            self._push_job_logs(job_id, fetch=job_id in looked_up)
+
+    def _get_job_status_set(self, job_ids):
+        """
+        Looks up the status of every given job, and returns them as a dict with
+        key = job_id, value = job status.
+        """
+        job_states = self._lookup_job_states(job_ids)
+        status_set = dict()
+        for job_id in job_ids:
+            if job_id not in self._running_jobs:
+                # deleted while we were looking things up.
+                continue
+            status_set[job_id] = self._construct_job_status(job_id, job_states.get(job_id))
+        return status_set
+
+    def _send_job_status_delta(self, status_set):
+        """
+        Sends a job_status_delta message with only the statuses in status_set that are
+        different from the last ones sent to the front end. Each status has its app spec
+        replaced by a reference ('spec_ref'), and each spec is only sent the first time
+        it's referenced. The content looks like:
+        {
+            'jobs': { job_id: status (without 'spec') },
+            'specs': { spec_ref: app spec },
+            'removed': [ ids of jobs that the front end was told about, but are gone ]
+        }
+        Nothing gets sent if nothing changed.
+        """
+        changed = dict()
+        specs = dict()
+        for job_id in status_set:
+            status = status_set[job_id]
+            spec_ref = status.get('spec_ref')
+            new_spec = spec_ref is not None and spec_ref not in self._sent_specs
+            if not self._mark_status_sent(job_id, status):
+                continue
+            changed[job_id] = dict((k, v) for k, v in status.items() if k != 'spec')
+            if new_spec:
+                specs[spec_ref] = status['spec']
+        removed = [job_id for job_id in self._sent_status.keys() if job_id not in self._running_jobs]
+        for job_id in removed:
+            del self._sent_status[job_id]
+        if changed or removed:
+            self._send_comm_message('job_status_delta', {
+                'jobs': changed,
+                'specs': specs,
+                'removed': removed
+            })
+
+    def _mark_status_sent(self, job_id, status):
+        """
+        Remembers a fingerprint of the status that the front end has for a job. Returns
+        True if it's different from the one it had before, False otherwise.
+        A status with its spec in place also tells the front end about that spec.
+        """
+        fingerprint = hashlib.md5(json.dumps(
+            dict((k, v) for k, v in status.items() if k != 'spec'), sort_keys=True
+        )).hexdigest()
+        if status.get('spec_ref') is not None and status.get('spec'):
+            self._sent_specs.add(status['spec_ref'])
+        if self._sent_status.get(job_id) == fingerprint:
+            return False
+        self._sent_status[job_id] = fingerprint
+        return True
+
+    def _spec_ref(self, job, app_spec):
+        """
+        Returns the reference the front end uses to find a job's app spec, or None if
+        there's no spec to refer to.
+        """
+        if not app_spec:
+            return None
+        return '{}/{}'.format(job.tag, job.app_id)
+
+    def _lookup_job_states(self, job_ids):
+        """
+        Looks up the current state of all given jobs with as few calls to
+        NJS.check_jobs as possible (at most JOB_STATUS_BATCH_SIZE jobs per call).
+
+        Returns a dict with key = job_id, value = the normalized job state. If a
+        single job's state can't be found, its value is the Exception describing
+        why, so one bad job doesn't spoil the rest of the batch. If a whole batch
+        call fails, those jobs are left out, and get looked up one at a time by
+        _construct_job_status.
+
+        Jobs that are already known to be finished just use their final state, and
+        aren't looked up at all.
+        """
+        states = dict()
+        pending_ids = list()
+        for job_id in job_ids:
+            if job_id not in self._running_jobs or 'unavailable' in self._running_jobs[job_id]:
+                continue
+            final_state = self._running_jobs[job_id]['job'].final_state()
+            if final_state is not None:
+                states[job_id] = final_state
+            else:
+                pending_ids.append(job_id)
+
+        for i in range(0, len(pending_ids), JOB_STATUS_BATCH_SIZE):
+            batch = pending_ids[i:i + JOB_STATUS_BATCH_SIZE]
+            try:
+                results = clients.get('job_service').check_jobs({
+                    'job_ids': batch,
+                    'with_job_params': 0
+                })
+            except Exception as e:
+                kblogging.log_event(self._log, "lookup_job_states.error", {'err': str(e)})
+                continue
+            batch_states = results.get('job_states', {})
+            batch_errors = results.get('check_error', {})
+            for job_id in batch:
+                try:
+                    job = self.get_job(job_id)
+                except ValueError:
+                    # deleted while we were looking it up.
+                    continue
+                if job_id in batch_states:
+                    states[job_id] = job._update_state(batch_states[job_id])
+                else:
+                    err = batch_errors.get(job_id, 'No state returned from job service')
+                    if isinstance(err, dict):
+                        err = err.get('message', err)
+                    states[job_id] = Exception("Unable to fetch info for job {} - {}".format(job_id, err))
+        return states
 
     def _lookup_job_status_loop(self):
         """
-        Initialize a loop that will look up job info. This uses a Timer thread on a 10
-        second loop to update things.
+        Starts the loop that looks up job info, if it's not already running.
+        The loop runs on the worker thread. Whenever it's not busy with anything else,
+        it sleeps until the scheduler says the next job is due for a lookup, then looks
+        up all the due jobs together.
         """
-        self._lookup_all_job_status()
-        self._lookup_timer = threading.Timer(10, self._lookup_job_status_loop)
-        self._lookup_timer.start()
+        self._running_lookup_loop = True
+        self._start_worker()
+        self._wake_worker()
 
     def cancel_job_lookup_loop(self):
         """
-        Cancels a running timer if one's still alive.
+        Stops the lookup loop if it's running. It might make one more pass, depending
+        on the thread state.
         """
-        if self._lookup_timer:
-            self._lookup_timer.cancel()
-            self._lookup_timer = None
         self._running_lookup_loop = False
+        self._wake_worker()
+
+    def _start_worker(self):
+        """
+        Starts the worker thread, if it's not already running.
+        """
+        with self._registry_lock:
+            if self._worker is not None and self._worker.is_alive():
+                return
+            self._worker = threading.Thread(target=self._run_worker, name='KBaseJobsWorker')
+            self._worker.daemon = True
+            self._worker.start()
+
+    def _wake_worker(self):
+        """
+        Wakes up the worker thread, so it checks again for jobs that are due for lookup.
+        """
+        self._tasks.put(None)
+
+    def _run_on_worker(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on the worker thread, waits for it to finish, and returns
+        its result (or raises whatever it raised). If this is already on the worker thread,
+        fn just gets called.
+        """
+        if threading.current_thread() is self._worker:
+            return fn(*args, **kwargs)
+        self._start_worker()
+        task = _WorkerTask(fn, args, kwargs)
+        self._tasks.put(task)
+        return task.wait()
+
+    def _post_to_worker(self, fn, *args, **kwargs):
+        """
+        Queues up fn(*args, **kwargs) to run on the worker thread, and returns right away,
+        without waiting for it. Anything it raises gets logged.
+        """
+        def run():
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                kblogging.log_event(self._log, "worker_task.error", {'err': str(e)})
+        self._start_worker()
+        self._tasks.put(_WorkerTask(run, (), {}))
+
+    def _run_worker(self):
+        """
+        The body of the worker thread. Runs tasks as they come in. If the lookup loop is
+        running, then whenever jobs are due for a lookup, it looks them up before taking
+        the next task, so a steady stream of requests can't hold up status updates.
+        """
+        while True:
+            wait = None
+            if self._running_lookup_loop:
+                wait = self._scheduler.time_to_next_poll()
+                if wait is not None and wait <= 0:
+                    try:
+                        self._lookup_due_job_status()
+                    except Exception as e:
+                        kblogging.log_event(self._log, "lookup_job_status_loop.error", {'err': str(e)})
+                    continue
+                if wait is None or wait > MAX_LOOKUP_LOOP_SLEEP:
+                    wait = MAX_LOOKUP_LOOP_SLEEP
+            try:
+                task = self._tasks.get(timeout=wait)
+            except Queue.Empty:
+                continue
+            if task is not None:
+                task.run()
 
     def register_new_job(self, job):
         """
@@ -362,20 +887,53 @@ class JobManager(object):
         job : biokbase.narrative.jobs.job.Job object
             The new Job that was started.
         """
-        self._running_jobs[job.job_id] = {'job': job, 'refresh': True}
+        self._run_on_worker(self._register_new_job, job)
+
+    def _register_new_job(self, job):
+        """
+        Does the work of register_new_job, on the worker thread.
+        """
+        self._add_job_entry(job.job_id, {'job': job, 'refresh': True})
+        self._scheduler.add_job(job.job_id)
         # push it forward! create a new_job message.
         self._lookup_job_status(job.job_id)
         self._send_comm_message('new_job', {})
 
+    def register_new_jobs(self, jobs):
+        """
+        Registers a batch of new Jobs with the manager, e.g. from
+        AppManager.run_app_batch. This works like register_new_job, but the
+        statuses of all the Jobs get looked up together and sent in a single
+        job_status_delta message, followed by a single new_job message.
+
+        Parameters:
+        -----------
+        jobs : list of biokbase.narrative.jobs.job.Job objects
+            The new Jobs that were started.
+        """
+        self._run_on_worker(self._register_new_jobs, jobs)
+
+    def _register_new_jobs(self, jobs):
+        """
+        Does the work of register_new_jobs, on the worker thread.
+        """
+        if not jobs:
+            return
+        for job in jobs:
+            self._add_job_entry(job.job_id, {'job': job, 'refresh': True})
+            self._scheduler.add_job(job.job_id)
+        self._send_job_status_delta(self._get_job_status_set([job.job_id for job in jobs]))
+        self._send_comm_message('new_job', {})
+
     def get_job(self, job_id):
         """
         Returns a Job with the given job_id.
         Raises a ValueError if not found.
         """
-        if job_id in self._running_jobs:
-            return self._running_jobs[job_id]['job']
-        else:
-            raise ValueError('No job present with id {}'.format(job_id))
+        with self._registry_lock:
+            if job_id in self._running_jobs:
+                return self._running_jobs[job_id]['job']
+        raise ValueError('No job present with id {}'.format(job_id))
 
     def _handle_comm_message(self, msg):
         """
@@ -385,6 +943,10 @@ class JobManager(object):
         * all_status
             refresh all jobs that are flagged to be looked up. Will send a
             message back with all lookup status.
+        * resync_status
+            the front end has lost track of things (e.g. got a job_status_delta
+            referring to an app spec it doesn't have). Forgets what the front end was
+            sent before, and sends a full job_status_all message, with specs.
         * job_status
             refresh the single job given in the 'job_id' field. Sends a message
             back with that single job's status, or an error message.
@@ -400,8 +962,23 @@ class JobManager(object):
         * start_job_update
             remove the flag that gets set by stop_job_update (needs an accompanying 'job_id'
             field)
+        * subscribe_job_logs
+            start pushing new log lines for the given job id to the front end as they come
+            in, along with the refresh cycle. These come as job_logs messages with a
+            'subscribed' flag. An optional 'first_line' field says where to start;
+            otherwise only lines after the current end of the log are sent.
+        * unsubscribe_job_logs
+            stop pushing log lines for the given job id.
+
+        The request itself gets handled on the worker thread. This doesn't wait for it,
+        so the kernel isn't held up by slow job service calls.
+        """
+        self._post_to_worker(self._handle_comm_request, msg)
+
+    def _handle_comm_request(self, msg):
+        """
+        Does the work of _handle_comm_message, on the worker thread.
         """
-        
         if 'request_type' in msg['content']['data']:
             r_type = msg['content']['data']['request_type']
             job_id = msg['content']['data'].get('job_id', None)
@@ -417,24 +994,32 @@ class JobManager(object):
             if r_type == 'all_status':
                 self._lookup_all_job_status(ignore_refresh_flag=True)
 
+            elif r_type == 'resync_status':
+                self._sent_specs.clear()
+                self._lookup_all_job_status(ignore_refresh_flag=True)
+
             elif r_type == 'job_status':
                 if job_id is not None:
                     self._lookup_job_status(job_id)
 
             elif r_type == 'stop_update_loop':
-                if self._lookup_timer is not None:
-                    self._lookup_timer.cancel()
+                self.cancel_job_lookup_loop()
 
             elif r_type == 'start_update_loop':
                 self._lookup_job_status_loop()
 
             elif r_type == 'stop_job_update':
                 if job_id is not None:
-                    self._running_jobs[job_id]['refresh'] = False
+                    with self._registry_lock:
+                        self._running_jobs[job_id]['refresh'] = False
+                    self._scheduler.remove_job(job_id)
 
             elif r_type == 'start_job_update':
                 if job_id is not None:
-                    self._running_jobs[job_id]['refresh'] = True
+                    with self._registry_lock:
+                        self._running_jobs[job_id]['refresh'] = True
+                    if 'unavailable' not in self._running_jobs[job_id]:
+                        self._scheduler.add_job(job_id)
 
             elif r_type == 'delete_job':
                 if job_id is not None:
@@ -463,6 +1048,15 @@ class JobManager(object):
                     num_lines = msg['content']['data'].get('num_lines', None)
                     self._get_latest_job_logs(job_id, num_lines=num_lines)
 
+            elif r_type == 'subscribe_job_logs':
+                if job_id is not None:
+                    first_line = msg['content']['data'].get('first_line', None)
+                    self._subscribe_job_logs(job_id, first_line=first_line)
+
+            elif r_type == 'unsubscribe_job_logs':
+                if job_id is not None:
+                    self._log_subscriptions.pop(job_id, None)
+
             else:
                 self._send_comm_message('job_comm_error', {'message': 'Unknown message', 'request_type': r_type})
                 raise ValueError('Unknown KBaseJobs message "{}"'.format(r_type))
@@ -472,12 +1066,7 @@ class JobManager(object):
         if job is None:
             raise ValueError('job "{}" not found while fetching logs!'.format(job_id))
 
-        (max_lines, logs) = job.log()
-
-        first_line = 0
-        if num_lines is not None and max_lines > num_lines:
-            first_line = max_lines - num_lines
-            logs = logs[first_line:]
+        (max_lines, first_line, logs) = job.latest_log(num_lines=num_lines)
         self._send_comm_message('job_logs', {'job_id': job_id, 'first': first_line, 'max_lines': max_lines, 'lines': logs, 'latest': True})
 
 
@@ -489,6 +1078,61 @@ class JobManager(object):
         (max_lines, log_slice) = job.log(first_line=first_line, num_lines=num_lines)
         self._send_comm_message('job_logs', {'job_id': job_id, 'first': first_line, 'max_lines': max_lines, 'lines': log_slice, 'latest': False})
 
+    def _subscribe_job_logs(self, job_id, first_line=None):
+        """
+        Starts pushing log lines for a job to the front end, starting with first_line (or
+        with the end of the log, if that's None). Any lines already available past that
+        get pushed right away.
+        """
+        job = self.get_job(job_id)
+        if first_line is None:
+            (first_line, _, _) = job.latest_log(num_lines=0)
+        self._log_subscriptions[job_id] = max(first_line, 0)
+        self._push_job_logs(job_id, fetch=True)
+
+    def _push_job_logs(self, job_id, fetch=True):
+        """
+        Sends the next batch of log lines for a job with a log subscription, as a job_logs
+        message. A batch is at most LOG_PUSH_MAX_LINES lines, and roughly LOG_PUSH_MAX_BYTES.
+        If fetch is True, new lines are fetched from the job service first, otherwise
+        only lines that have already been fetched are sent. Nothing gets sent if there
+        are no new lines.
+        Once a finished job's whole log has been sent, its subscription ends.
+        """
+        first_line = self._log_subscriptions.get(job_id)
+        if first_line is None:
+            return
+        if job_id not in self._running_jobs:
+            del self._log_subscriptions[job_id]
+            return
+        job = self._running_jobs[job_id]['job']
+        try:
+            if fetch:
+                (max_lines, lines) = job.log(first_line=first_line, num_lines=LOG_PUSH_MAX_LINES)
+            else:
+                (max_lines, lines) = job.cached_log(first_line=first_line, num_lines=LOG_PUSH_MAX_LINES)
+        except Exception as e:
+            kblogging.log_event(self._log, "push_job_logs.error", {'err': str(e), 'job_id': job_id})
+            return
+        num_bytes = 0
+        for i in range(len(lines)):
+            num_bytes += len(json.dumps(lines[i]))
+            if num_bytes > LOG_PUSH_MAX_BYTES and i > 0:
+                lines = lines[:i]
+                break
+        if lines:
+            self._log_subscriptions[job_id] = first_line + len(lines)
+            self._send_comm_message('job_logs', {
+                'job_id': job_id,
+                'first': first_line,
+                'max_lines': max_lines,
+                'lines': lines,
+                'latest': False,
+                'subscribed': True
+            })
+        if fetch and job.final_state() is not None and first_line + len(lines) >= max_lines:
+            del self._log_subscriptions[job_id]
+
     def delete_job(self, job_id):
         """
         If the job_id doesn't exist, raises a ValueError.
@@ -496,6 +1140,12 @@ class JobManager(object):
         raises an exception. If it can be canceled but not deleted, it gets canceled, then raises
         an exception.
         """
+        self._run_on_worker(self._delete_job, job_id)
+
+    def _delete_job(self, job_id):
+        """
+        Does the work of delete_job, on the worker thread.
+        """
         if job_id is None:
             raise ValueError('Job id required for deletion!')
         if job_id not in self._running_jobs:
@@ -504,7 +1154,7 @@ class JobManager(object):
             # raise ValueError('Attempting to cancel a Job that does not exist!')
 
         try:
-            self.cancel_job(job_id)
+            self._cancel_job(job_id)
         except Exception as e:
             raise
 
@@ -513,7 +1163,11 @@ class JobManager(object):
         except Exception as e:
             raise
 
-        del self._running_jobs[job_id]
+        with self._registry_lock:
+            job = self._running_jobs.pop(job_id)['job']
+        self._scheduler.remove_job(job_id)
+        self._log_subscriptions.pop(job_id, None)
+        job.close_log()
         self._send_comm_message('job_deleted', {'job_id': job_id})
 
     def cancel_job(self, job_id):
@@ -522,7 +1176,12 @@ class JobManager(object):
         Does NOT delete the job.
         Raises an exception if the current user doesn't have permission to cancel the job.
         """
+        self._run_on_worker(self._cancel_job, job_id)
 
+    def _cancel_job(self, job_id):
+        """
+        Does the work of cancel_job, on the worker thread.
+        """
         if job_id is None:
             raise ValueError('Job id required for cancellation!')
         if job_id not in self._running_jobs:
@@ -539,11 +1198,14 @@ class JobManager(object):
             raise ValueError('Unable to get Job state')
 
         # Stop updating the job status while we try to cancel.
-        # Also, set it to have a special state of 'canceling' while we're doing the cancel
-        is_refreshing = self._running_jobs[job_id].get('refresh', False)
-        self._running_jobs[job_id]['refresh'] = False
-        self._running_jobs[job_id]['canceling'] = True
+        # Also, set it to have a special state of 'canceling' while we're doing the cancel,
+        # and tell the front end so before the (possibly slow) cancel call.
+        with self._registry_lock:
+            is_refreshing = self._running_jobs[job_id].get('refresh', False)
+            self._running_jobs[job_id]['refresh'] = False
+            self._running_jobs[job_id]['canceling'] = True
         try:
+            self._lookup_job_status(job_id, dict(state))
             clients.get('job_service').cancel_job({'job_id': job_id})
         except Exception as e:
             new_e = transform_job_exception(e)
@@ -559,12 +1221,15 @@ class JobManager(object):
             self._send_comm_message('job_comm_error', error)
             raise(e)
         finally:
-            self._running_jobs[job_id]['refresh'] = is_refreshing
-            del self._running_jobs[job_id]['canceling']
+            with self._registry_lock:
+                self._running_jobs[job_id]['refresh'] = is_refreshing
+                del self._running_jobs[job_id]['canceling']
 
         #
         # self._send_comm_message('job_canceled', {'job_id': job_id})
         # Rather than a separate message, how about triggering a job-status message:
+        # (and watch it closely until the cancel goes through)
+        self._scheduler.add_job(job_id)
         self._lookup_job_status(job_id)
 
     def _send_comm_message(self, msg_type, content):
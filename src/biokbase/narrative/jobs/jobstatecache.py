@@ -0,0 +1,100 @@
+"""
+A local, on-disk cache of finished jobs.
+
+When a kernel restarts, the JobManager has to rebuild its set of jobs. Jobs that had
+already finished (or been canceled) can't change, so what's needed to rebuild them -
+their final state, job parameters, output viewer parameters, and so on - gets saved
+here, one file per workspace. Those jobs can then be rebuilt without asking the job
+service about them again.
+
+Each file is in JSON-lines format: one job record per line, with later lines for the
+same job overriding earlier ones.
+"""
+
+import json
+import os
+import threading
+from biokbase.narrative.common.util import kbase_cache_dir
+
+
+class JobStateCache(object):
+    """
+    The cache of finished jobs for a single workspace.
+
+    This is safe to use from multiple threads.
+    """
+    def __init__(self, ws_id, cache_dir=None):
+        """
+        Parameters:
+        -----------
+        ws_id - int or string
+            The workspace id whose jobs get cached.
+        cache_dir - string
+            The directory to keep the cache file in. Defaults to the 'jobs' directory
+            under the KBase cache directory.
+        """
+        if cache_dir is None:
+            cache_dir = kbase_cache_dir('jobs')
+        self.path = os.path.join(cache_dir, 'ws_{}.jsonl'.format(ws_id))
+        # ids of the jobs that are in the file already
+        self._saved = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Returns all the cached job records, as a dict with key = job_id, value = record
+        (see Job.cache_record). Lines that can't be read are skipped. If the cache
+        file doesn't exist (or can't be read at all), this returns an empty dict.
+        """
+        records = dict()
+        with self._lock:
+            try:
+                with open(self.path) as cache_file:
+                    for line in cache_file:
+                        try:
+                            record = json.loads(line)
+                            records[record['job_id']] = record
+                        except (ValueError, KeyError, TypeError):
+                            continue
+            except (IOError, OSError):
+                pass
+            self._saved = set(records.keys())
+        return records
+
+    def save(self, records):
+        """
+        Replaces the whole cache with the given list of job records. This is done by
+        writing a new file, then moving it over the old one, so nothing gets lost if
+        it's interrupted.
+        """
+        with self._lock:
+            tmp_path = '{}.{}.tmp'.format(self.path, os.getpid())
+            try:
+                with open(tmp_path, 'w') as tmp_file:
+                    for record in records:
+                        tmp_file.write(json.dumps(record) + '\n')
+                os.rename(tmp_path, self.path)
+            except (IOError, OSError):
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            self._saved = set(record['job_id'] for record in records)
+
+    def add(self, record):
+        """
+        Adds a single job record to the end of the cache, unless that job's already
+        been saved.
+        """
+        with self._lock:
+            if record['job_id'] in self._saved:
+                return
+            with open(self.path, 'a') as cache_file:
+                cache_file.write(json.dumps(record) + '\n')
+            self._saved.add(record['job_id'])
+
+    def has_job(self, job_id):
+        """
+        Returns True if the job's been saved to the cache.
+        """
+        with self._lock:
+            return job_id in self._saved
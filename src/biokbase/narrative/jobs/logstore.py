@@ -0,0 +1,139 @@
+"""
+Local storage for job logs.
+
+Each Job keeps its log lines in a JobLogStore, so they only need to be fetched from the
+job service once. The most recent lines are kept in memory. When there are more than
+that, the oldest ones get spilled to a temporary file on disk (or dropped, if spilling
+is turned off), so a job with a huge log doesn't eat all the kernel's memory.
+"""
+
+from array import array
+import json
+import tempfile
+import threading
+
+# The most log lines to keep in memory for a single job.
+MAX_MEMORY_LOG_LINES = 20000
+
+
+class JobLogStore(object):
+    """
+    Holds the log lines for a single job, in order. Lines are referred to by their
+    absolute line number (0-indexed), no matter where they're stored.
+
+    This is safe to use from multiple threads.
+    """
+    def __init__(self, max_memory_lines=MAX_MEMORY_LOG_LINES, spill=True):
+        """
+        Parameters:
+        -----------
+        max_memory_lines - int
+            The most lines to keep in memory. Once there are more than this, the oldest
+            half get moved out of memory.
+        spill - boolean
+            If True, lines moved out of memory get written to a temporary file and can
+            still be fetched. If False, they're dropped.
+        """
+        self.max_memory_lines = max_memory_lines
+        self.spill = spill
+        # the lines still in memory, starting with line number self._memory_start
+        self._lines = list()
+        self._memory_start = 0
+        # lines before self._memory_start live here (if spilling), one JSON line each.
+        self._spill_file = None
+        # file offset of the start of each spilled line
+        self._spill_offsets = array('L')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """
+        The total number of lines stored, including any that were spilled or dropped.
+        """
+        with self._lock:
+            return self._memory_start + len(self._lines)
+
+    def first_available_line(self):
+        """
+        The number of the first line that can still be fetched. This is always 0 unless
+        spilling is turned off and some lines have been dropped.
+        """
+        with self._lock:
+            if self.spill:
+                return 0
+            return self._memory_start
+
+    def append(self, lines):
+        """
+        Adds a list of log lines to the end of the store.
+        """
+        with self._lock:
+            self._lines.extend(lines)
+            if len(self._lines) > self.max_memory_lines:
+                self._evict(len(self._lines) - self.max_memory_lines // 2)
+
+    def get_lines(self, first_line, num_lines):
+        """
+        Returns a list of up to num_lines log lines, starting with line number first_line.
+        Lines that were dropped (if spilling is off) are left out.
+        """
+        with self._lock:
+            total = self._memory_start + len(self._lines)
+            first_line = max(first_line, 0)
+            last_line = min(first_line + max(num_lines, 0), total)
+            if first_line >= last_line:
+                return list()
+            lines = list()
+            if first_line < self._memory_start:
+                if self.spill:
+                    lines = self._read_spilled(first_line, min(last_line, self._memory_start))
+                first_line = self._memory_start
+            if last_line > first_line:
+                lines.extend(self._lines[first_line - self._memory_start:last_line - self._memory_start])
+            return lines
+
+    def close(self):
+        """
+        Drops all stored lines and removes the spill file, if there is one.
+        """
+        with self._lock:
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+            self._spill_offsets = array('L')
+            self._lines = list()
+            self._memory_start = 0
+
+    def _evict(self, num_lines):
+        """
+        Moves the oldest num_lines lines out of memory. Expects the lock to be held.
+        """
+        if self.spill:
+            if self._spill_file is None:
+                self._spill_file = tempfile.TemporaryFile(prefix='kbase_job_log_')
+            self._spill_file.seek(0, 2)
+            offset = self._spill_file.tell()
+            chunk = list()
+            for line in self._lines[:num_lines]:
+                encoded = json.dumps(line) + '\n'
+                self._spill_offsets.append(offset)
+                offset += len(encoded)
+                chunk.append(encoded)
+            self._spill_file.write(''.join(chunk))
+        del self._lines[:num_lines]
+        self._memory_start += num_lines
+
+    def _read_spilled(self, first_line, last_line):
+        """
+        Reads lines first_line up to (not including) last_line back from the spill file.
+        Expects the lock to be held.
+        """
+        self._spill_file.flush()
+        start = self._spill_offsets[first_line]
+        if last_line < len(self._spill_offsets):
+            end = self._spill_offsets[last_line]
+        else:
+            self._spill_file.seek(0, 2)
+            end = self._spill_file.tell()
+        self._spill_file.seek(start)
+        data = self._spill_file.read(end - start)
+        return [json.loads(line) for line in data.rstrip('\n').split('\n')]
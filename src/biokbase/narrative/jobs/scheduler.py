@@ -0,0 +1,158 @@
+"""
+Scheduling for the JobManager's job status lookup loop.
+
+Rather than looking up every job on a fixed timer, the JobPollScheduler keeps a
+deadline for each job's next status lookup. Jobs get looked up quickly right after
+they're registered, or right after their state changes. Each lookup that finds a
+job in the same state as before doubles the time until the next one, up to a
+maximum that depends on that state - a job that's been queued for hours gets
+looked up much less often than one that's running. Jobs that reach a terminal
+state are retired and never looked up again.
+"""
+
+import threading
+import time
+
+# Seconds to wait before the first lookup after a job starts or changes state.
+FAST_POLL_INTERVAL = 2
+# How much to grow the interval by every time a job is found in the same state.
+POLL_BACKOFF = 2
+# The longest we'll wait between lookups of a job in any state not listed below.
+MAX_POLL_INTERVAL = 10
+# The longest we'll wait between lookups of a job in a given state.
+MAX_STATE_POLL_INTERVALS = {
+    'queued': 120
+}
+
+
+def is_terminal_state(state):
+    """
+    Returns True if the given job state dict (as returned by Job.state()) says the job
+    is done - either finished (successfully or not) or canceled.
+    """
+    if state is None:
+        return False
+    return state.get('finished', 0) == 1 or state.get('canceled', 0) == 1
+
+
+class JobPollScheduler(object):
+    """
+    Keeps track of when each job's status should next be looked up.
+
+    Usage is something like:
+    scheduler.add_job(job_id)
+    ...
+    for job_id in scheduler.due_jobs():
+        state = lookup_state(job_id)
+        scheduler.job_polled(job_id, state)
+    sleep(scheduler.time_to_next_poll())
+
+    This is safe to use from multiple threads.
+    """
+    def __init__(self, clock=time.time, fast_interval=FAST_POLL_INTERVAL,
+                 backoff=POLL_BACKOFF, max_interval=MAX_POLL_INTERVAL,
+                 max_state_intervals=None):
+        """
+        Parameters:
+        -----------
+        clock - function
+            Returns the current time in seconds. Defaults to time.time, but can be
+            swapped out (mainly for testing).
+        fast_interval - number
+            Seconds until a job is looked up after it's added or changes state.
+        backoff - number
+            Multiplier on the interval each time a job is found in the same state.
+        max_interval - number
+            Longest interval between lookups for states not in max_state_intervals.
+        max_state_intervals - dict
+            key = job_state string, value = longest interval between lookups for a
+            job in that state.
+        """
+        self._clock = clock
+        self.fast_interval = fast_interval
+        self.backoff = backoff
+        self.max_interval = max_interval
+        if max_state_intervals is None:
+            max_state_intervals = MAX_STATE_POLL_INTERVALS
+        self.max_state_intervals = dict(max_state_intervals)
+        # key = job_id, value = {state, interval, next_poll}
+        self._jobs = dict()
+        self._lock = threading.Lock()
+
+    def add_job(self, job_id):
+        """
+        Starts scheduling lookups for a job. It's due for a lookup right away. If it
+        was already being scheduled, this resets it to be due right away.
+        """
+        with self._lock:
+            self._jobs[job_id] = {
+                'state': None,
+                'interval': self.fast_interval,
+                'next_poll': self._clock()
+            }
+
+    def remove_job(self, job_id):
+        """
+        Stops scheduling lookups for a job. Does nothing if the job isn't known.
+        """
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def has_job(self, job_id):
+        """
+        Returns True if the job is being scheduled (i.e. it hasn't been retired or removed).
+        """
+        with self._lock:
+            return job_id in self._jobs
+
+    def due_jobs(self):
+        """
+        Returns the list of job ids that are due for a status lookup.
+        """
+        with self._lock:
+            now = self._clock()
+            return [job_id for job_id in self._jobs if self._jobs[job_id]['next_poll'] <= now]
+
+    def job_polled(self, job_id, state):
+        """
+        Reschedules a job after its status was looked up.
+
+        If the job's in a terminal state, it gets retired. If its job_state changed
+        since the last lookup, the next one happens soon. Otherwise, the interval
+        backs off.
+
+        Parameters:
+        -----------
+        job_id - string
+            The id of the job that was just looked up.
+        state - dict
+            The job state as returned by Job.state() (or an error state from the
+            JobManager, if the lookup failed).
+        """
+        with self._lock:
+            if job_id not in self._jobs:
+                return
+            if is_terminal_state(state):
+                del self._jobs[job_id]
+                return
+            job_state = state.get('job_state') if state is not None else None
+            info = self._jobs[job_id]
+            if job_state != info['state']:
+                interval = self.fast_interval
+            else:
+                max_interval = self.max_state_intervals.get(job_state, self.max_interval)
+                interval = min(info['interval'] * self.backoff, max_interval)
+            info['state'] = job_state
+            info['interval'] = interval
+            info['next_poll'] = self._clock() + interval
+
+    def time_to_next_poll(self):
+        """
+        Returns the number of seconds until the next job is due for a lookup (0 if
+        one's already due), or None if there are no jobs being scheduled.
+        """
+        with self._lock:
+            if not self._jobs:
+                return None
+            next_poll = min(info['next_poll'] for info in self._jobs.values())
+            return max(next_poll - self._clock(), 0)
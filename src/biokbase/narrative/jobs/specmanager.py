@@ -3,19 +3,215 @@ from biokbase.narrative.app_util import (
     app_version_tags,
     check_tag
 )
+from biokbase.narrative.common import kblogging
+from biokbase.narrative.common.url_config import URLS
+from biokbase.narrative.common.util import kbase_cache_dir
+import collections
+import hashlib
 import json
+import os
+import re
+import threading
 from jinja2 import Template
 from IPython.display import HTML
 
+# If more than this fraction of a tag's cached specs are out of date, just fetch
+# all of them again, instead of only the changed ones.
+MAX_CHANGED_SPEC_FRACTION = 0.5
+
+
+class TagSpecs(dict):
+    """
+    The app specs for each release tag, as a dict with key = tag, value = dict of
+    specs with key = app id. Each tag's specs get loaded the first time they're used.
+
+    Loaded specs are also kept in a cache file for each tag and NMS URL. When a tag
+    is loaded and there's a cache file for it, that gets checked against the versions
+    and git commit hashes of the apps in NMS. Only the specs of apps that are new
+    or have changed get fetched.
+    """
+    def __init__(self, cache_dir=None):
+        super(TagSpecs, self).__init__()
+        # defaults to the 'specs' directory under the KBase cache directory, but that
+        # only gets created when it's first needed.
+        self.cache_dir = cache_dir
+        self._lock = threading.RLock()
+        self._log = kblogging.get_logger(__name__)
+
+    def __missing__(self, tag):
+        if tag not in app_version_tags:
+            raise KeyError(tag)
+        return self.load(tag)
+
+    def __contains__(self, tag):
+        return tag in app_version_tags or super(TagSpecs, self).__contains__(tag)
+
+    def load(self, tag):
+        """
+        Loads (or reloads) the specs for the given tag, and returns them.
+        """
+        with self._lock:
+            specs = self._load_specs(tag)
+            self[tag] = specs
+            return specs
+
+    def _load_specs(self, tag):
+        nms = clients.get('narrative_method_store')
+        cached = self._read_cache(tag)
+        if cached:
+            try:
+                specs = self._revalidate(nms, tag, cached)
+            except Exception as e:
+                # better to have slightly old specs than none at all.
+                kblogging.log_event(self._log, 'spec_cache_error', {'err': str(e), 'tag': tag})
+                return cached
+        else:
+            specs = dict()
+            for spec in nms.list_methods_spec({'tag': tag}):
+                specs[spec['info']['id']] = spec
+        if specs is not cached:
+            self._write_cache(tag, specs)
+        return specs
+
+    def _revalidate(self, nms, tag, cached):
+        """
+        Checks the cached specs for a tag against the app versions in NMS, and returns
+        the up to date specs. That's the cached dict itself if nothing changed.
+        """
+        versions = dict((info['id'], _spec_version(info)) for info in nms.list_methods({'tag': tag}))
+        if not any(v != (None, None) for v in versions.values()):
+            # NMS isn't giving out versions, so there's nothing to compare to.
+            changed = versions.keys()
+        else:
+            changed = [app_id for app_id in versions
+                       if app_id not in cached or _spec_version(cached[app_id]['info']) != versions[app_id]]
+        removed = [app_id for app_id in cached if app_id not in versions]
+        if not changed and not removed:
+            return cached
+        if len(changed) > len(versions) * MAX_CHANGED_SPEC_FRACTION:
+            fetched = nms.list_methods_spec({'tag': tag})
+        else:
+            fetched = nms.get_method_spec({'ids': changed, 'tag': tag}) if changed else []
+        specs = dict((app_id, spec) for (app_id, spec) in cached.items() if app_id in versions)
+        for spec in fetched:
+            specs[spec['info']['id']] = spec
+        return specs
+
+    def _cache_path(self, tag):
+        if self.cache_dir is None:
+            self.cache_dir = kbase_cache_dir('specs')
+        url_hash = hashlib.sha1(URLS.narrative_method_store).hexdigest()
+        return os.path.join(self.cache_dir, '{}_{}.json'.format(url_hash, tag))
+
+    def _read_cache(self, tag):
+        """
+        Returns the cached specs for a tag, or None if there aren't any (or they can't be read).
+        """
+        try:
+            with open(self._cache_path(tag)) as cache_file:
+                cache = json.load(cache_file)
+            if cache.get('nms_url') != URLS.narrative_method_store or cache.get('tag') != tag:
+                return None
+            return cache['specs']
+        except (IOError, OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def _write_cache(self, tag, specs):
+        try:
+            path = self._cache_path(tag)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w') as cache_file:
+                json.dump({'nms_url': URLS.narrative_method_store, 'tag': tag, 'specs': specs}, cache_file)
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            kblogging.log_event(self._log, 'spec_cache_error', {'err': str(e), 'tag': tag})
+
+
+def _spec_version(info):
+    return (info.get('ver'), info.get('git_commit_hash'))
+
+
+def _compile_patterns(patterns):
+    """
+    Compiles a list of regexes. Any that don't compile are left as strings, so they
+    raise their errors when used, same as if they were never compiled.
+    """
+    compiled = list()
+    for pattern in patterns:
+        try:
+            compiled.append(re.compile(pattern))
+        except (re.error, TypeError):
+            compiled.append(pattern)
+    return tuple(compiled)
+
+
+class AppParams(collections.Mapping):
+    """
+    An indexed set of an app's parameters, as built by SpecManager.app_params.
+
+    This works as a read-only dict with key = param id, value = param dict, and the
+    params property has the full list, in the same order as app_params returns them.
+    The allowed type and regex constraint patterns of each param are compiled ahead
+    of time, and group memberships are indexed.
+
+    These are shared between everything that runs the same app, so neither this nor
+    the param dicts in it should be changed.
+    """
+    def __init__(self, params):
+        self.params = tuple(params)
+        self._by_id = dict((p['id'], p) for p in self.params)
+        self.ids = frozenset(self._by_id)
+        # key = group id, value = set of the param ids in it
+        self._groups = dict()
+        self._type_patterns = dict()
+        self._regex_constraints = dict()
+        for p in self.params:
+            if p.get('is_group'):
+                self._groups[p['id']] = frozenset(p.get('parameter_ids', []))
+            if p.get('allowed_types'):
+                self._type_patterns[p['id']] = _compile_patterns(p['allowed_types'])
+            if p.get('regex_constraint'):
+                self._regex_constraints[p['id']] = _compile_patterns(p['regex_constraint'])
+
+    def __getitem__(self, param_id):
+        return self._by_id[param_id]
+
+    def __iter__(self):
+        return iter(self._by_id)
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def group_members(self, group_id):
+        """
+        Returns the set of param ids in the given parameter group (empty if it's not a group).
+        """
+        return self._groups.get(group_id, frozenset())
+
+    def type_patterns(self, param_id):
+        """
+        Returns the compiled allowed_types patterns for a param (empty if it has none).
+        """
+        return self._type_patterns.get(param_id, ())
+
+    def regex_constraints(self, param_id):
+        """
+        Returns the compiled regex_constraint patterns for a param (empty if it has none).
+        """
+        return self._regex_constraints.get(param_id, ())
+
+
 class SpecManager(object):
     __instance = None
 
-    app_specs = dict()
+    app_specs = TagSpecs()
+    # key = (app_id, tag), value = (spec, spec hash, AppParams built from that spec)
+    _param_indexes = dict()
+    _param_index_lock = threading.Lock()
 
     def __new__(cls):
         if SpecManager.__instance is None:
             SpecManager.__instance = object.__new__(cls)
-            SpecManager.__instance.reload()
         return SpecManager.__instance
 
     def get_spec(self, app_id, tag='release'):
@@ -26,14 +222,10 @@ class SpecManager(object):
     def reload(self):
         """
         Reloads all app specs into memory from the latest update.
+        Only the specs that changed since they were last cached get fetched.
         """
         for tag in app_version_tags:
-            specs = clients.get('narrative_method_store').list_methods_spec({'tag': tag})
-
-            spec_dict = dict()
-            for spec in specs:
-                spec_dict[spec['info']['id']] = spec
-            self.app_specs[tag] = spec_dict
+            self.app_specs.load(tag)
 
     def app_description(self, app_id, tag='release'):
         """
@@ -119,6 +311,28 @@ class SpecManager(object):
 
         return AppUsage(usage)
 
+    def app_param_index(self, app_id, tag='release'):
+        """
+        Returns the AppParams for the given app and tag. These are only built once for
+        each version of the app's spec, so apps that are run over and over don't need
+        their specs parsed every time.
+        If either the app_id or tag are invalid, a ValueError is raised.
+        """
+        spec = self.get_spec(app_id, tag)
+        key = (app_id, tag)
+        with self._param_index_lock:
+            cached = self._param_indexes.get(key)
+            if cached is not None and cached[0] is spec:
+                return cached[2]
+            # the spec might've been reloaded without changing
+            spec_hash = hashlib.md5(json.dumps(spec, sort_keys=True)).hexdigest()
+            if cached is not None and cached[1] == spec_hash:
+                index = cached[2]
+            else:
+                index = AppParams(self.app_params(spec))
+            self._param_indexes[key] = (spec, spec_hash, index)
+            return index
+
     def check_app(self, app_id, tag='release', raise_exception=False):
         """
         Checks if a method (and release tag) is available for running and such.
@@ -0,0 +1,141 @@
+"""
+Benchmarks for the per-call overhead of the JSON-RPC service clients.
+
+This makes calls through BaseClient to a stub JSON-RPC service running on localhost,
+first opening a new connection for every call (the way BaseClient used to call
+requests.post), then over the shared session with pooled, keep-alive connections.
+It reports the mean and median time per call, and the number of connections the
+stub service saw, for one thread and for several threads making calls at once.
+
+The stub only speaks plain HTTP, so this only measures the TCP connection savings;
+against a real service over HTTPS the savings from skipping the TLS handshake are
+larger.
+
+It's not run as part of the test suite. Run it directly from this directory, with
+the src directory on the PYTHONPATH, e.g.:
+    python client_benchmark.py
+    python client_benchmark.py --calls 500 --threads 8 --latency 0.001
+"""
+
+import argparse
+import json
+import requests
+import threading
+import time
+import biokbase.workspace.baseclient as baseclient
+from biokbase.workspace.baseclient import BaseClient
+from util import StubRPCServer
+
+
+class ClientBenchmark(object):
+    def __init__(self, calls=200, threads=4, latency=0, payload_size=100):
+        self.calls = calls
+        self.threads = threads
+        self.payload = 'x' * payload_size
+        self.stub = StubRPCServer(methods={'Stub.echo': lambda params: [params[0]]},
+                                  latency=latency)
+
+    def _run(self, client, num_threads):
+        """
+        Makes self.calls calls, split over num_threads threads. Returns the time each
+        call took.
+        """
+        times = list()
+        lock = threading.Lock()
+
+        def worker(n):
+            mine = list()
+            for i in range(n):
+                start = time.time()
+                client.call_method('Stub.echo', [self.payload])
+                mine.append(time.time() - start)
+            with lock:
+                times.extend(mine)
+
+        per_thread = self.calls // num_threads
+        workers = [threading.Thread(target=worker, args=(per_thread,))
+                   for i in range(num_threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        return times
+
+    def _measure(self, mode, num_threads):
+        self.stub.start()
+        try:
+            if mode == 'new connection':
+                # a session that's closed after each call acts like requests.post
+                client = BaseClient(self.stub.url, token='fake_token',
+                                    session=_OneShotSession())
+            else:
+                baseclient.configure_session(pool_maxsize=max(num_threads, 10))
+                client = BaseClient(self.stub.url, token='fake_token')
+            # warm up, outside of the measurements
+            client.call_method('Stub.echo', [self.payload])
+            start = time.time()
+            times = sorted(self._run(client, num_threads))
+            wall = time.time() - start
+            return {
+                'mode': mode,
+                'threads': num_threads,
+                'calls': len(times),
+                'mean_ms': 1000 * sum(times) / len(times),
+                'median_ms': 1000 * times[len(times) // 2],
+                'calls_per_s': len(times) / wall,
+                'connections': self.stub.connection_count
+            }
+        finally:
+            self.stub.stop()
+            self.stub = StubRPCServer(methods=self.stub.methods, latency=self.stub.latency)
+
+    def run(self):
+        results = list()
+        for num_threads in sorted(set([1, self.threads])):
+            for mode in ['new connection', 'pooled session']:
+                results.append(self._measure(mode, num_threads))
+        return results
+
+
+class _OneShotSession(object):
+    """
+    Makes each post with requests.post, which opens and closes its own connection.
+    """
+    def post(self, *args, **kwargs):
+        return requests.post(*args, **kwargs)
+
+
+def format_results(results):
+    lines = ['{:<16} {:>8} {:>7} {:>10} {:>10} {:>10} {:>12}'.format(
+        'mode', 'threads', 'calls', 'mean (ms)', 'median (ms)', 'calls/s', 'connections')]
+    for r in results:
+        lines.append('{:<16} {:>8} {:>7} {:>10.3f} {:>10.3f} {:>10.1f} {:>12}'.format(
+            r['mode'], r['threads'], r['calls'], r['mean_ms'], r['median_ms'],
+            r['calls_per_s'], r['connections']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the per-call overhead of service clients.')
+    parser.add_argument('--calls', type=int, default=200,
+                        help='number of calls to make in each run')
+    parser.add_argument('--threads', type=int, default=4,
+                        help='number of threads to make calls from in the threaded runs')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds the stub service takes to answer each call')
+    parser.add_argument('--payload', type=int, default=100,
+                        help='size in bytes of the string sent and returned by each call')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON instead of a table')
+    args = parser.parse_args()
+
+    results = ClientBenchmark(calls=args.calls, threads=args.threads,
+                              latency=args.latency, payload_size=args.payload).run()
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
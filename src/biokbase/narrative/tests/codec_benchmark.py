@@ -0,0 +1,149 @@
+"""
+Benchmarks for the JSON libraries the service clients can use to decode responses.
+
+This writes a large Workspace get_objects response to a temporary file, made to look
+like a Genome object with many features (50 MB by default). Then, for each JSON
+library that's installed, it reports the time to decode the response and how much the
+peak memory use (max RSS) grew while doing it. If ijson is installed, it also reports
+the streaming decode that the clients use for large responses, reading from the file
+instead of from a string that holds the whole response.
+
+Each measurement runs in its own process, so they don't affect each other's peak
+memory use. Encoding times for the same object are reported as well.
+
+It's not run as part of the test suite. Run it directly from this directory, with
+the src directory on the PYTHONPATH, e.g.:
+    python codec_benchmark.py
+    python codec_benchmark.py --size 100 --repeat 5
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import tempfile
+import time
+import biokbase.workspace.baseclient as baseclient
+
+
+def make_feature(i):
+    return {
+        'id': 'kb|g.0.peg.{}'.format(i),
+        'type': 'CDS',
+        'location': [['kb|g.0.c.1', 1000 * i, '+', 900]],
+        'function': 'hypothetical protein {}'.format(i),
+        'protein_translation': 'MKRISTTITTTITITTGNGAG' * 15,
+        'protein_translation_length': 315,
+        'aliases': ['alias_{}'.format(i), 'locus_{}'.format(i)],
+        'quality': {'hit_count': 3.25, 'weighted_hit_count': i / 7.0},
+        'md5': '7c5f2d1b5ab1e8e7e3a0e8c1f1b9d0a{}'.format(i % 10)
+    }
+
+
+def make_response(size_mb):
+    """
+    Returns a JSON-RPC response for get_objects on one Genome, about size_mb in size.
+    """
+    feature_size = len(json.dumps(make_feature(0)))
+    num_features = int(size_mb * 1024 * 1024 / feature_size)
+    genome = {
+        'id': 'kb|g.0',
+        'scientific_name': 'Some bacterium',
+        'domain': 'Bacteria',
+        'features': [make_feature(i) for i in range(num_features)]
+    }
+    info = [1, 'some_genome', 'KBaseGenomes.Genome-8.0', '2017-01-01T00:00:00+0000',
+            1, 'some_user', 12345, 'some_workspace', 'abc', 1, {}]
+    return {'version': '1.1', 'id': '1',
+            'result': [[{'data': genome, 'info': info, 'provenance': [], 'refs': []}]]}
+
+
+def _max_rss_mb():
+    # ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def _measure(mode, codec, path, repeat, queue):
+    if mode == 'stream':
+        start_rss = _max_rss_mb()
+        start = time.time()
+        for i in range(repeat):
+            with open(path, 'rb') as f:
+                baseclient._stream_result(f)
+        decode = (time.time() - start) / repeat
+        queue.put({'codec': 'ijson (stream)', 'decode_s': decode,
+                   'encode_s': None, 'peak_mb': _max_rss_mb() - start_rss})
+        return
+    baseclient.set_json_codec(codec)
+    c = baseclient._codec
+    with open(path, 'rb') as f:
+        data = f.read()
+    start_rss = _max_rss_mb()
+    start = time.time()
+    obj = None
+    for i in range(repeat):
+        # let go of the last one first, so only one decoded copy is ever held
+        obj = None
+        obj = c.loads(data)
+    decode = (time.time() - start) / repeat
+    peak = _max_rss_mb() - start_rss
+    start = time.time()
+    for i in range(repeat):
+        c.dumps(obj)
+    encode = (time.time() - start) / repeat
+    queue.put({'codec': codec, 'decode_s': decode, 'encode_s': encode, 'peak_mb': peak})
+
+
+def run(size_mb=50, repeat=3):
+    (fd, path) = tempfile.mkstemp(suffix='.json')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(make_response(size_mb), f)
+        size = os.path.getsize(path) / (1024.0 * 1024.0)
+        runs = [('load', codec) for codec in baseclient.json_codecs()]
+        if baseclient._ijson is not None:
+            runs.append(('stream', None))
+        results = list()
+        for (mode, codec) in runs:
+            queue = multiprocessing.Queue()
+            p = multiprocessing.Process(target=_measure, args=(mode, codec, path, repeat, queue))
+            p.start()
+            result = queue.get()
+            p.join()
+            result['size_mb'] = size
+            results.append(result)
+        return results
+    finally:
+        os.remove(path)
+
+
+def format_results(results):
+    lines = ['{:<16} {:>10} {:>12} {:>12} {:>14}'.format(
+        'codec', 'size (MB)', 'decode (s)', 'encode (s)', 'peak +MB')]
+    for r in results:
+        encode = '-' if r['encode_s'] is None else '{:.3f}'.format(r['encode_s'])
+        lines.append('{:<16} {:>10.1f} {:>12.3f} {:>12} {:>14.1f}'.format(
+            r['codec'], r['size_mb'], r['decode_s'], encode, r['peak_mb']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark JSON decoding of large service responses.')
+    parser.add_argument('--size', type=float, default=50,
+                        help='approximate size of the response in MB')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times to decode and encode it, to average over')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON instead of a table')
+    args = parser.parse_args()
+
+    results = run(size_mb=args.size, repeat=args.repeat)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(format_results(results))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,308 @@
+"""
+Benchmarks for the JobManager's job initialization and status refresh path.
+
+This runs the JobManager against in-process fakes of the NarrativeJobService and
+UserAndJobState services, and a fake Comm that records everything that gets sent to
+the front end. For each number of jobs, it reports the number of service calls, the
+wall clock and CPU time, and the number of messages and bytes sent over the comm for:
+* initialize_jobs
+* a full status lookup (what happens on an all_status request)
+* an average pass of the status lookup loop, with every unfinished job due for lookup
+* list_jobs
+
+It's not run as part of the test suite. Run it directly from this directory, with
+the src directory on the PYTHONPATH, e.g.:
+    python job_benchmark.py
+    python job_benchmark.py --jobs 100,1000 --latency 0.005 --log-lines 5000
+"""
+
+import argparse
+import json
+import mock
+import os
+import resource
+import shutil
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from biokbase.narrative.jobs.job import Job
+from biokbase.narrative.jobs.jobmanager import JobManager
+from biokbase.narrative.jobs.scheduler import JobPollScheduler
+from util import FakeClock
+
+DEFAULT_JOB_COUNTS = [10, 100, 1000, 5000]
+
+
+class CallCounter(object):
+    """
+    Counts calls to the fake services, by method name. Safe to use from multiple threads.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = defaultdict(int)
+
+    def count(self, method):
+        with self._lock:
+            self.calls[method] += 1
+
+    def total(self):
+        with self._lock:
+            return sum(self.calls.values())
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+
+class FakeNJS(object):
+    """
+    A fake NarrativeJobService with a fixed set of jobs. Every call sleeps for the given
+    latency. Each call to tick() finishes some of the running jobs.
+    """
+    def __init__(self, job_ids, counter, latency=0, finished_fraction=0.5,
+                 finish_per_tick=0.05, log_lines=100):
+        self.counter = counter
+        self.latency = latency
+        self.log_lines = log_lines
+        self.finish_per_tick = finish_per_tick
+        self._lock = threading.Lock()
+        self.states = dict()
+        num_finished = int(len(job_ids) * finished_fraction)
+        for (i, job_id) in enumerate(job_ids):
+            state = {
+                'job_id': job_id,
+                'job_state': 'in-progress',
+                'finished': 0,
+                'creation_time': 1500000000000 + i,
+                'exec_start_time': 1500000001000 + i
+            }
+            if i < num_finished:
+                self._finish(state)
+            self.states[job_id] = state
+
+    def _call(self, method):
+        self.counter.count(method)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _finish(self, state):
+        state.update({
+            'job_state': 'completed',
+            'finished': 1,
+            'finish_time': state['exec_start_time'] + 60000,
+            'result': [{}]
+        })
+
+    def _state(self, job_id):
+        with self._lock:
+            return dict(self.states[job_id])
+
+    def tick(self):
+        with self._lock:
+            running = [s for s in self.states.values() if not s['finished']]
+            for state in running[:int(len(running) * self.finish_per_tick)]:
+                self._finish(state)
+
+    def _job_params(self, job_id):
+        return {'params': [{}], 'app_id': 'SomeModule/some_app', 'service_ver': '1.0.0'}
+
+    def check_job(self, job_id):
+        self._call('check_job')
+        return self._state(job_id)
+
+    def check_jobs(self, params):
+        self._call('check_jobs')
+        result = {'job_states': dict((job_id, self._state(job_id)) for job_id in params['job_ids'])}
+        if params.get('with_job_params'):
+            result['job_params'] = dict((job_id, self._job_params(job_id)) for job_id in params['job_ids'])
+        return result
+
+    def get_job_params(self, job_id):
+        self._call('get_job_params')
+        return [self._job_params(job_id), {}]
+
+    def get_job_logs(self, params):
+        self._call('get_job_logs')
+        first = params.get('skip_lines', 0)
+        return {
+            'lines': [{'is_error': 0, 'line': 'log line {}'.format(i)}
+                      for i in range(first, self.log_lines)],
+            'last_line_number': self.log_lines
+        }
+
+
+class FakeUJS(object):
+    """
+    A fake UserAndJobState service that lists a fixed set of jobs.
+    """
+    def __init__(self, job_ids, counter, latency=0):
+        self.counter = counter
+        self.latency = latency
+        self.job_ids = job_ids
+
+    def list_jobs2(self, params):
+        self.counter.count('list_jobs2')
+        if self.latency:
+            time.sleep(self.latency)
+        return [[job_id, ['some_user'], None, None, None, None, None, None, None, None,
+                 {'tag': 'release', 'cell_id': 'cell_{}'.format(job_id)}]
+                for job_id in self.job_ids]
+
+
+class RecordingComm(object):
+    """
+    A fake Comm that records the number of messages and bytes sent.
+    """
+    def __init__(self, *args, **kwargs):
+        self.reset()
+
+    def on_msg(self, *args, **kwargs):
+        pass
+
+    def send(self, msg):
+        self.messages += 1
+        self.bytes += len(json.dumps(msg))
+
+    def reset(self):
+        self.messages = 0
+        self.bytes = 0
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+class JobManagerBenchmark(object):
+    """
+    Sets up a JobManager with fake services for a given number of jobs, and measures
+    how its initialization and refresh path performs.
+    """
+    def __init__(self, num_jobs, latency=0, finished_fraction=0.5, log_lines=100,
+                 log_subscriptions=10, cycles=10):
+        self.num_jobs = num_jobs
+        self.cycles = cycles
+        self.log_subscriptions = log_subscriptions
+        self.counter = CallCounter()
+        job_ids = ['job_{:06d}'.format(i) for i in range(num_jobs)]
+        self.njs = FakeNJS(job_ids, self.counter, latency=latency,
+                           finished_fraction=finished_fraction, log_lines=log_lines)
+        self.ujs = FakeUJS(job_ids, self.counter, latency=latency)
+        self.comm = RecordingComm()
+        self.clock = FakeClock()
+
+    def _reset_job_manager(self):
+        jm = JobManager()
+        jm.cancel_job_lookup_loop()
+        jm._running_jobs.clear()
+        jm._sent_status.clear()
+        jm._sent_specs.clear()
+        jm._log_subscriptions.clear()
+        jm._job_cache = None
+        jm._scheduler = JobPollScheduler(clock=self.clock)
+        jm._comm = self.comm
+        return jm
+
+    def _measure(self, name, fn):
+        self.counter.reset()
+        self.comm.reset()
+        cpu = _cpu_time()
+        start = time.time()
+        fn()
+        return {
+            'phase': name,
+            'jobs': self.num_jobs,
+            'rpcs': self.counter.total(),
+            'wall': time.time() - start,
+            'cpu': _cpu_time() - cpu,
+            'messages': self.comm.messages,
+            'bytes': self.comm.bytes
+        }
+
+    def run(self):
+        """
+        Runs the benchmark, and returns a list of result dicts, one per phase.
+        """
+        services = {'job_service': self.njs, 'user_and_job_state': self.ujs}
+        cache_dir = tempfile.mkdtemp()
+        jm = self._reset_job_manager()
+        results = list()
+        try:
+            with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', side_effect=lambda n: services[n]), \
+                    mock.patch('biokbase.narrative.jobs.job.clients.get', side_effect=lambda n: services[n]), \
+                    mock.patch('biokbase.narrative.jobs.jobmanager.system_variable', return_value=12345), \
+                    mock.patch.dict(os.environ, {'KB_NARRATIVE_CACHE_DIR': cache_dir}), \
+                    mock.patch.object(jm, '_lookup_job_status_loop'), \
+                    mock.patch.object(Job, 'app_spec', return_value={'info': {'name': 'Some App'}}), \
+                    mock.patch.object(Job, 'get_viewer_params', return_value={'name': 'someViewer'}):
+                results.append(self._measure('initialize_jobs', jm.initialize_jobs))
+
+                for job_id in jm._job_ids()[:self.log_subscriptions]:
+                    jm._log_subscriptions[job_id] = 0
+
+                results.append(self._measure(
+                    'all_status',
+                    lambda: jm._run_on_worker(jm._lookup_all_job_status)))
+
+                def refresh_cycles():
+                    for i in range(self.cycles):
+                        self.njs.tick()
+                        # far enough ahead that every unfinished job is due
+                        self.clock.advance(3600)
+                        jm._run_on_worker(jm._lookup_due_job_status)
+                cycle = self._measure('refresh_cycle', refresh_cycles)
+                for key in ['rpcs', 'wall', 'cpu', 'messages', 'bytes']:
+                    cycle[key] = cycle[key] / float(self.cycles)
+                results.append(cycle)
+
+                results.append(self._measure('list_jobs', jm.list_jobs))
+        finally:
+            self._reset_job_manager()
+            shutil.rmtree(cache_dir)
+        return results
+
+
+def format_results(results):
+    lines = ['{:>6} {:<16} {:>9} {:>10} {:>10} {:>9} {:>12}'.format(
+        'jobs', 'phase', 'rpcs', 'wall (s)', 'cpu (s)', 'messages', 'bytes')]
+    for r in results:
+        lines.append('{:>6} {:<16} {:>9.1f} {:>10.4f} {:>10.4f} {:>9.1f} {:>12.1f}'.format(
+            r['jobs'], r['phase'], r['rpcs'], r['wall'], r['cpu'], r['messages'], r['bytes']))
+    return '\n'.join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the JobManager refresh path.')
+    parser.add_argument('--jobs', default=','.join(str(n) for n in DEFAULT_JOB_COUNTS),
+                        help='comma-separated list of job counts to run')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds each fake service call takes')
+    parser.add_argument('--finished', type=float, default=0.5,
+                        help='fraction of jobs that start out finished')
+    parser.add_argument('--log-lines', type=int, default=100,
+                        help='number of log lines per job')
+    parser.add_argument('--log-subscriptions', type=int, default=10,
+                        help='number of jobs with log subscriptions')
+    parser.add_argument('--cycles', type=int, default=10,
+                        help='number of refresh cycles to average over')
+    parser.add_argument('--json', action='store_true',
+                        help='print the results as JSON instead of a table')
+    args = parser.parse_args()
+
+    results = list()
+    for num_jobs in [int(n) for n in args.jobs.split(',')]:
+        results.extend(JobManagerBenchmark(num_jobs,
+                                           latency=args.latency,
+                                           finished_fraction=args.finished,
+                                           log_lines=args.log_lines,
+                                           log_subscriptions=args.log_subscriptions,
+                                           cycles=args.cycles).run())
+    if args.json:
+        print json.dumps(results, indent=2)
+    else:
+        print format_results(results)
+
+
+if __name__ == "__main__":
+    main()
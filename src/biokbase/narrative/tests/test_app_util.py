@@ -7,6 +7,7 @@ import unittest
 from biokbase.narrative.app_util import (
     check_tag,
     system_variable,
+    clear_system_variable_cache,
     get_result_sub_path,
     map_inputs_from_job,
     map_outputs_from_state
@@ -30,6 +31,9 @@ class AppUtilTestCase(unittest.TestCase):
         self.bad_fake_token = "NotAGoodTokenLOL"
         self.workspace = "{}:12345".format(self.user_id)
 
+    def setUp(self):
+        clear_system_variable_cache()
+
     def test_check_tag_good(self):
         self.assertTrue(check_tag(self.good_tag))
 
@@ -74,6 +78,35 @@ class AppUtilTestCase(unittest.TestCase):
         m.get_workspace_info.side_effect = Exception('not found')
         self.assertIsNone(system_variable('workspace_id'))
 
+    @mock.patch('biokbase.narrative.app_util._ws_client')
+    def test_sys_var_workspace_id_cached(self, m):
+        os.environ['KB_WORKSPACE_ID'] = self.workspace
+        os.environ['KB_AUTH_TOKEN'] = self.good_fake_token
+        m.get_workspace_info.return_value = [12345, 'foo', 'bar']
+        for i in range(3):
+            self.assertEquals(system_variable('workspace_id'), 12345)
+        self.assertEquals(m.get_workspace_info.call_count, 1)
+        # changing either the workspace or the token means looking it up again.
+        os.environ['KB_WORKSPACE_ID'] = 'other_ws'
+        m.get_workspace_info.return_value = [67890, 'other_ws', 'bar']
+        self.assertEquals(system_variable('workspace_id'), 67890)
+        os.environ['KB_AUTH_TOKEN'] = self.bad_fake_token
+        self.assertEquals(system_variable('workspace_id'), 67890)
+        self.assertEquals(m.get_workspace_info.call_count, 3)
+
+    @mock.patch('biokbase.narrative.app_util._ws_client')
+    def test_sys_var_workspace_id_failure_not_cached(self, m):
+        os.environ['KB_WORKSPACE_ID'] = self.workspace
+        m.get_workspace_info.side_effect = [Exception('not found'), [12345, 'foo', 'bar']]
+        self.assertIsNone(system_variable('workspace_id'))
+        self.assertEquals(system_variable('workspace_id'), 12345)
+
+    def test_sys_var_user_token_change(self):
+        os.environ['KB_AUTH_TOKEN'] = self.good_fake_token
+        self.assertEquals(system_variable('user_id'), self.user_id)
+        os.environ['KB_AUTH_TOKEN'] = self.good_fake_token.replace(self.user_id, 'someone_else')
+        self.assertEquals(system_variable('user_id'), 'someone_else')
+
     def test_sys_var_bad_token(self):
         if 'KB_AUTH_TOKEN' in os.environ:
             del os.environ['KB_AUTH_TOKEN']
@@ -1,14 +1,23 @@
 """
 Tests for the app manager.
 """
-from biokbase.narrative.jobs.appmanager import AppManager
-from biokbase.narrative.jobs.specmanager import SpecManager
+from biokbase.narrative.jobs.appmanager import (
+    AppManager,
+    _RateLimiter
+)
+from biokbase.narrative.jobs.specmanager import (
+    SpecManager,
+    AppParams
+)
 from IPython.display import HTML
 import unittest
 import mock
 from traitlets import Instance
 import os
 import json
+import threading
+import time
+from util import FakeClock
 
 
 class AppManagerTestCase(unittest.TestCase):
@@ -149,6 +158,183 @@ class AppManagerTestCase(unittest.TestCase):
         else:
             os.environ['KB_WORKSPACE_ID'] = prev_ws_id
 
+    @mock.patch('biokbase.narrative.jobs.appmanager.system_variable')
+    def test_validate_params_indexed(self, mock_sys_var):
+        mock_sys_var.side_effect = lambda v: {'workspace': 'some_ws', 'workspace_id': 12345}[v]
+        spec_params = AppParams([{
+            'id': 'name', 'optional': False, 'default': None, 'type': 'string',
+            'allow_multiple': False, 'is_output': False, 'regex_constraint': ['^[a-z]+$']
+        }])
+        (params, ws_inputs) = self.mm._validate_parameters('SomeModule/some_app', 'dev',
+                                                           spec_params, {'name': 'abc'})
+        self.assertEqual(params, {'name': 'abc'})
+        with self.assertRaises(ValueError) as err:
+            self.mm._validate_parameters('SomeModule/some_app', 'dev', spec_params, {'name': 'ABC'})
+        self.assertIn('does not match required regex ^[a-z]+$', str(err.exception))
+        with self.assertRaises(ValueError):
+            self.mm._validate_parameters('SomeModule/some_app', 'dev', spec_params, {'nmae': 'abc'})
+
+    @mock.patch('biokbase.narrative.jobs.appmanager.WS_OBJECT_INFO_BATCH_SIZE', 4)
+    @mock.patch('biokbase.narrative.jobs.appmanager.system_variable')
+    def test_validate_params_batched_lookup(self, mock_sys_var):
+        mock_sys_var.side_effect = lambda v: {'workspace': 'some_ws', 'workspace_id': 12345}[v]
+        ws = mock.MagicMock()
+
+        def get_object_info_new(params):
+            infos = list()
+            for obj in params['objects']:
+                name = obj.get('name', obj.get('ref'))
+                if name == 'missing':
+                    infos.append(None)
+                else:
+                    infos.append([int(name[-1]), name, 'KBaseFile.PairedEndLibrary-2.0',
+                                  None, 1, None, 12345])
+            return infos
+        ws.get_object_info_new.side_effect = get_object_info_new
+        spec_params = AppParams([{
+            'id': 'reads', 'optional': False, 'default': None, 'type': 'text',
+            'allow_multiple': True, 'is_output': False,
+            'allowed_types': ['KBaseFile.PairedEndLibrary']
+        }])
+        reads = ['reads_{}'.format(i) for i in range(6)] + ['12345/7/1', 'reads_0']
+        object_infos = dict()
+        with mock.patch.object(self.mm, 'ws_client', ws):
+            (params, ws_inputs) = self.mm._validate_parameters('SomeModule/some_app', 'dev', spec_params,
+                                                               {'reads': reads}, object_infos=object_infos)
+            # 7 distinct objects, in batches of 4
+            self.assertEqual(ws.get_object_info_new.call_count, 2)
+            self.assertTrue(all(c[0][0]['ignoreErrors'] for c in ws.get_object_info_new.call_args_list))
+            self.assertEqual(ws_inputs[:2], ['12345/0/1', '12345/1/1'])
+            self.assertEqual(len(ws_inputs), 8)
+            self.assertEqual(len(object_infos), 7)
+            # the mapping step reuses what's been looked up.
+            self.assertEqual(self.mm._resolve_ref('some_ws', 'reads_3', object_infos), '12345/3/1')
+            self.assertEqual(ws.get_object_info_new.call_count, 2)
+
+            with self.assertRaises(ValueError) as err:
+                self.mm._validate_parameters('SomeModule/some_app', 'dev', spec_params,
+                                             {'reads': ['reads_1', 'missing']})
+            self.assertIn('Data object named missing not found', str(err.exception))
+
+    def _batch_mocks(self):
+        spec = {'behavior': {
+            'kb_service_name': 'SomeModule',
+            'kb_service_method': 'some_method',
+            'kb_service_version': 'abcdef',
+            'kb_service_input_mapping': [{
+                'input_parameter': 'reads',
+                'target_property': 'reads_ref',
+                'target_type_transform': 'resolved-ref'
+            }]
+        }}
+        spec_params = AppParams([{
+            'id': 'reads', 'optional': False, 'default': None, 'type': 'text',
+            'allow_multiple': False, 'is_output': False,
+            'allowed_types': ['KBaseFile.PairedEndLibrary']
+        }])
+        ws = mock.MagicMock()
+        ws.get_object_info_new.side_effect = lambda p: [
+            None if o['name'] == 'missing' else
+            [int(o['name'][-1]), o['name'], 'KBaseFile.PairedEndLibrary-2.0', None, 1, None, 12345]
+            for o in p['objects']]
+        return (spec, spec_params, ws)
+
+    @mock.patch('biokbase.narrative.jobs.appmanager.JobManager')
+    @mock.patch('biokbase.narrative.jobs.job.clients.get')
+    @mock.patch('biokbase.narrative.jobs.appmanager.system_variable')
+    def test_run_app_batch(self, mock_sys_var, mock_clients, mock_jm):
+        mock_sys_var.side_effect = lambda v: {'workspace': 'some_ws', 'workspace_id': 12345,
+                                              'user_id': 'some_user'}[v]
+        (spec, spec_params, ws) = self._batch_mocks()
+        njs = mock.MagicMock()
+        lock = threading.Lock()
+        running = {'now': 0, 'max': 0}
+
+        def run_job(inputs):
+            with lock:
+                running['now'] += 1
+                running['max'] = max(running['max'], running['now'])
+            time.sleep(0.01)
+            with lock:
+                running['now'] -= 1
+            if inputs['params'][0]['reads_ref'] == '12345/3/1':
+                raise Exception('NJS is unhappy')
+            return 'job_' + inputs['params'][0]['reads_ref']
+        njs.run_job.side_effect = run_job
+        params_list = [{'reads': 'reads_{}'.format(i)} for i in range(8)]
+        params_list[5] = {'reads': 'missing'}
+        with mock.patch.object(self.mm, '_get_job_app_spec', return_value=spec), \
+                mock.patch.object(self.mm.spec_manager, 'app_param_index', return_value=spec_params), \
+                mock.patch.object(self.mm, 'ws_client', ws), \
+                mock.patch.object(self.mm, 'njs', njs):
+            results = self.mm.run_app_batch('SomeModule/some_app', params_list, tag='dev',
+                                            max_concurrency=2, max_rate=None)
+        # every input object's looked up in one go, and the valid ones submitted.
+        self.assertEqual(ws.get_object_info_new.call_count, 1)
+        self.assertEqual(njs.run_job.call_count, 7)
+        self.assertLessEqual(running['max'], 2)
+        self.assertEqual([r['params'] for r in results], params_list)
+        for (i, r) in enumerate(results):
+            if i == 3:
+                self.assertIsNone(r['job'])
+                self.assertIn('NJS is unhappy', r['error'])
+            elif i == 5:
+                self.assertIsNone(r['job'])
+                self.assertIn('Data object named missing not found', r['error'])
+            else:
+                self.assertIsNone(r['error'])
+                self.assertEqual(r['job'].job_id, 'job_12345/{}/1'.format(i))
+                self.assertEqual(r['job'].app_version, 'abcdef')
+        # all started jobs get registered together.
+        mock_jm.return_value.register_new_jobs.assert_called_once()
+        registered = mock_jm.return_value.register_new_jobs.call_args[0][0]
+        self.assertEqual(sorted(j.job_id for j in registered),
+                         sorted(r['job'].job_id for r in results if r['job']))
+        mock_jm.return_value.register_new_job.assert_not_called()
+
+    @mock.patch('biokbase.narrative.jobs.appmanager.JobManager')
+    @mock.patch('biokbase.narrative.jobs.job.clients.get')
+    @mock.patch('biokbase.narrative.jobs.appmanager.system_variable')
+    def test_run_app_batch_bad_params(self, mock_sys_var, mock_clients, mock_jm):
+        mock_sys_var.side_effect = lambda v: {'workspace': 'some_ws', 'workspace_id': 12345,
+                                              'user_id': 'some_user'}[v]
+        (spec, spec_params, ws) = self._batch_mocks()
+        njs = mock.MagicMock()
+        njs.run_job.side_effect = lambda inputs: 'job_' + inputs['params'][0]['reads_ref']
+        params_list = [{'reads': 'reads_1'}, 'not a dict', {'reads': 'reads_2'}]
+        with mock.patch.object(self.mm, '_get_job_app_spec', return_value=spec), \
+                mock.patch.object(self.mm.spec_manager, 'app_param_index',
+                                  return_value=spec_params), \
+                mock.patch.object(self.mm, 'ws_client', ws), \
+                mock.patch.object(self.mm, 'njs', njs):
+            results = self.mm.run_app_batch('SomeModule/some_app', params_list, tag='dev',
+                                            max_rate=None)
+        # a parameter set that can't be read only fails itself.
+        self.assertEqual(len(results), 3)
+        self.assertIsNone(results[1]['job'])
+        self.assertIsNotNone(results[1]['error'])
+        self.assertEqual(results[0]['job'].job_id, 'job_12345/1/1')
+        self.assertEqual(results[2]['job'].job_id, 'job_12345/2/1')
+        self.assertEqual(njs.run_job.call_count, 2)
+
+    def test_run_app_batch_bad_app(self):
+        self.assertIsNone(self.mm.run_app_batch(self.bad_app_id, [{}], tag=self.good_tag))
+
+    def test_rate_limiter(self):
+        clock = FakeClock()
+        sleeps = list()
+
+        def sleep(t):
+            sleeps.append(t)
+            clock.advance(t)
+        limiter = _RateLimiter(4, clock=clock, sleep=sleep)
+        for i in range(3):
+            limiter.wait()
+        self.assertEqual(sleeps, [0.25, 0.25])
+        clock.advance(10)
+        limiter.wait()
+        self.assertEqual(len(sleeps), 2)
+
     def test_input_mapping(self):
         inputs = {
             "reads_tuple": [
@@ -0,0 +1,377 @@
+import unittest
+import decimal
+import json
+import mock
+import requests
+import threading
+import time
+import biokbase.workspace.baseclient as baseclient
+from biokbase.workspace.baseclient import (
+    AsyncClient,
+    BaseClient,
+    Batch,
+    ServerError,
+    ServiceURLCache,
+    submit
+)
+from util import FakeClock, StubRPCServer
+
+"""
+Tests for the JSON-RPC BaseClient, against a local stub service.
+"""
+
+
+class BaseClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubRPCServer(methods={
+            'Stub.echo': lambda params: [params[0]],
+            'Stub.fail': lambda params: 1 / 0
+        }).start()
+        baseclient.configure_session()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_call_method(self):
+        client = BaseClient(self.stub.url, token='some_token')
+        self.assertEquals(client.call_method('Stub.echo', [{'a': 1}]), {'a': 1})
+        self.assertEquals(self.stub.calls, ['Stub.echo'])
+
+    def test_call_method_error(self):
+        client = BaseClient(self.stub.url, token='some_token')
+        with self.assertRaises(ServerError):
+            client.call_method('Stub.fail', [])
+        with self.assertRaises(ServerError):
+            client.call_method('Stub.not_a_method', [])
+
+    def test_connections_reused(self):
+        clients = [BaseClient(self.stub.url, token='some_token') for i in range(3)]
+        for i in range(10):
+            for client in clients:
+                self.assertEquals(client.call_method('Stub.echo', [i]), i)
+        self.assertEquals(len(self.stub.calls), 30)
+        self.assertEquals(self.stub.connection_count, 1)
+
+    def test_shared_session(self):
+        c1 = BaseClient(self.stub.url, token='some_token')
+        c2 = BaseClient(self.stub.url, token='some_token')
+        self.assertIs(c1._session, c2._session)
+        self.assertIs(c1._session, baseclient.get_session())
+
+    def test_configure_session(self):
+        old_session = baseclient.get_session()
+        baseclient.configure_session(pool_maxsize=20)
+        new_session = baseclient.get_session()
+        self.assertIsNot(old_session, new_session)
+        self.assertEquals(new_session.get_adapter(self.stub.url)._pool_maxsize, 20)
+        baseclient.configure_session(pool_maxsize=10)
+
+    def test_configure_session_existing_clients(self):
+        client = BaseClient(self.stub.url, token='some_token')
+        own = BaseClient(self.stub.url, token='some_token', session=requests.Session())
+        own_session = own._session
+        self.assertEquals(client.call_method('Stub.echo', [1]), 1)
+        baseclient.configure_session(pool_maxsize=20)
+        # a client made before uses the new session from its next call on
+        self.assertIs(client._session, baseclient.get_session())
+        self.assertEquals(client._session.get_adapter(self.stub.url)._pool_maxsize, 20)
+        self.assertEquals(client.call_method('Stub.echo', [2]), 2)
+        self.assertEquals(self.stub.connection_count, 2)
+        # but one with its own session keeps it
+        self.assertIs(own._session, own_session)
+        baseclient.configure_session(pool_maxsize=10)
+
+    def test_own_session(self):
+        session = requests.Session()
+        client = BaseClient(self.stub.url, token='some_token', session=session)
+        self.assertIs(client._session, session)
+        self.assertEquals(client.call_method('Stub.echo', ['foo']), 'foo')
+
+
+class BatchTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubRPCServer(methods={
+            'Stub.echo': lambda params: [params[0]],
+            'Stub.fail': lambda params: 1 / 0
+        }, latency=0.1).start()
+        self.client = BaseClient(self.stub.url, token='some_token')
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_batch_concurrent(self):
+        start = time.time()
+        with self.client.batch(max_workers=10) as b:
+            futures = [b.call_method('Stub.echo', [i]) for i in range(10)]
+            self.assertFalse(futures[0].done())
+        self.assertLess(time.time() - start, 0.5)
+        self.assertEquals([f.result() for f in futures], list(range(10)))
+        self.assertEquals(self.stub.request_count, 10)
+
+    def test_batch_errors(self):
+        with self.client.batch() as b:
+            good = b.call_method('Stub.echo', ['foo'])
+            bad = b.call_method('Stub.fail', [])
+        self.assertEquals(good.result(), 'foo')
+        self.assertIsNone(good.exception())
+        self.assertIsInstance(bad.exception(), ServerError)
+        with self.assertRaises(ServerError):
+            bad.result()
+
+    def test_batch_not_sent(self):
+        b = self.client.batch()
+        f = b.call_method('Stub.echo', ['foo'])
+        with self.assertRaises(RuntimeError):
+            f.result()
+        try:
+            with b:
+                raise ValueError('oops')
+        except ValueError:
+            pass
+        self.assertEquals(self.stub.calls, [])
+
+    def test_batch_single_request(self):
+        self.stub.supports_batch = True
+        with self.client.batch(single_request=True) as b:
+            futures = [b.call_method('Stub.echo', [i]) for i in range(5)]
+            bad = b.call_method('Stub.fail', [])
+        self.assertEquals([f.result() for f in futures], list(range(5)))
+        self.assertIsInstance(bad.exception(), ServerError)
+        self.assertEquals(self.stub.request_count, 1)
+
+    def test_batch_single_request_unsupported(self):
+        with self.client.batch(single_request=True) as b:
+            futures = [b.call_method('Stub.echo', [i]) for i in range(5)]
+        self.assertEquals([f.result() for f in futures], list(range(5)))
+        # the batch request that failed, then each call on its own
+        self.assertEquals(self.stub.request_count, 6)
+
+    def test_batch_generated_client(self):
+        # generated clients like Workspace and Catalog call through a BaseClient
+        class StubClient(object):
+            def __init__(self, url):
+                self._client = BaseClient(url, token='some_token')
+
+            def echo(self, value, context=None):
+                return self._client.call_method('Stub.echo', [value], None, context)
+
+        self.stub.supports_batch = True
+        stub_client = StubClient(self.stub.url)
+        with Batch(single_request=True) as b:
+            c = b.client(stub_client)
+            futures = [c.echo(i) for i in range(5)]
+        self.assertEquals([f.result() for f in futures], list(range(5)))
+        self.assertEquals(self.stub.request_count, 1)
+
+    def test_batch_old_style_client(self):
+        # older generated clients, like NarrativeJobService and NarrativeMethodStore,
+        # make their own calls, so each call is run as a whole
+        njs = mock.MagicMock()
+        njs._client = None
+        njs.check_job.side_effect = lambda job_id: {'job_id': job_id}
+        with Batch() as b:
+            c = b.client(njs)
+            futures = [c.check_job(str(i)) for i in range(3)]
+            self.assertEquals(njs.check_job.call_count, 0)
+        self.assertEquals([f.result() for f in futures],
+                          [{'job_id': str(i)} for i in range(3)])
+
+
+class ServiceURLCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.cache = ServiceURLCache(ttl=60, clock=self.clock)
+
+    def test_get_cached(self):
+        lookup = mock.MagicMock(return_value='http://foo')
+        for i in range(3):
+            self.assertEquals(self.cache.get(('wiz', 'Foo', 'release'), lookup), 'http://foo')
+        self.assertEquals(lookup.call_count, 1)
+        self.assertEquals(self.cache.stats(), {'hits': 2, 'misses': 1, 'size': 1})
+        # versions are cached separately
+        self.cache.get(('wiz', 'Foo', 'dev'), lookup)
+        self.assertEquals(lookup.call_count, 2)
+
+    def test_get_expired(self):
+        lookup = mock.MagicMock(side_effect=['http://foo', 'http://bar'])
+        self.assertEquals(self.cache.get('key', lookup), 'http://foo')
+        self.clock.advance(59)
+        self.assertEquals(self.cache.get('key', lookup), 'http://foo')
+        self.clock.advance(2)
+        self.assertEquals(self.cache.get('key', lookup), 'http://bar')
+
+    def test_invalidate(self):
+        lookup = mock.MagicMock(return_value='http://foo')
+        self.cache.get('key', lookup)
+        self.cache.invalidate('key')
+        self.cache.get('key', lookup)
+        self.assertEquals(lookup.call_count, 2)
+
+    def test_lookup_error_not_cached(self):
+        lookup = mock.MagicMock(side_effect=[ValueError('nope'), 'http://foo'])
+        with self.assertRaises(ValueError):
+            self.cache.get('key', lookup)
+        self.assertEquals(self.cache.get('key', lookup), 'http://foo')
+
+    def test_single_flight(self):
+        started = threading.Event()
+        release = threading.Event()
+        calls = list()
+
+        def lookup():
+            calls.append(1)
+            started.set()
+            release.wait()
+            return 'http://foo'
+
+        results = list()
+        threads = [threading.Thread(target=lambda: results.append(self.cache.get('key', lookup)))
+                   for i in range(5)]
+        threads[0].start()
+        started.wait()
+        for t in threads[1:]:
+            t.start()
+        time.sleep(0.1)
+        release.set()
+        for t in threads:
+            t.join()
+        self.assertEquals(len(calls), 1)
+        self.assertEquals(results, ['http://foo'] * 5)
+        self.assertEquals(self.cache.misses, 1)
+
+
+class ServiceLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubRPCServer(methods={
+            'ServiceWizard.get_service_status': lambda params: [{'url': self.stub.url}],
+            'Stub.echo': lambda params: [params[0]]
+        }).start()
+        baseclient.service_url_cache.invalidate()
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_lookup_cached(self):
+        client = BaseClient(self.stub.url, token='some_token', lookup_url=True)
+        for i in range(3):
+            self.assertEquals(client.call_method('Stub.echo', [i], service_ver='dev'), i)
+        self.assertEquals(self.stub.calls.count('ServiceWizard.get_service_status'), 1)
+        self.assertEquals(self.stub.calls.count('Stub.echo'), 3)
+
+    def test_connection_error_invalidates(self):
+        client = BaseClient(self.stub.url, token='some_token', lookup_url=True)
+        key = (self.stub.url, 'Stub', 'dev')
+        baseclient.service_url_cache.get(key, lambda: 'http://127.0.0.1:1')
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.call_method('Stub.echo', ['foo'], service_ver='dev')
+        self.assertEquals(client.call_method('Stub.echo', ['foo'], service_ver='dev'), 'foo')
+
+
+class AsyncClientTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stub = StubRPCServer(methods={
+            'Stub.echo': lambda params: [params[0]],
+            'Stub.fail': lambda params: 1 / 0
+        }, latency=0.2).start()
+
+        class StubClient(object):
+            def __init__(self, url):
+                self._client = BaseClient(url, token='some_token')
+
+            def echo(self, value):
+                return self._client.call_method('Stub.echo', [value])
+
+            def fail(self):
+                return self._client.call_method('Stub.fail', [])
+        self.client = AsyncClient(StubClient(self.stub.url))
+
+    def tearDown(self):
+        self.stub.stop()
+
+    def test_concurrent_calls(self):
+        # all the calls should take about as long as one call
+        start = time.time()
+        futures = [self.client.echo(i) for i in range(8)]
+        self.assertEquals([f.result() for f in futures], list(range(8)))
+        self.assertLess(time.time() - start, 0.6)
+        self.assertEquals(len(self.stub.calls), 8)
+
+    def test_error(self):
+        f = self.client.fail()
+        self.assertIsInstance(f.exception(), ServerError)
+        with self.assertRaises(ServerError):
+            f.result()
+
+    def test_submit(self):
+        f = submit(lambda x, y=0: x + y, 1, y=2)
+        self.assertEquals(f.result(timeout=5), 3)
+        self.assertTrue(f.done())
+
+
+class JSONCodecTestCase(unittest.TestCase):
+    def setUp(self):
+        self.default_codec = baseclient.get_json_codec()
+        self.stub = StubRPCServer(methods={
+            'Stub.echo': lambda params: [params[0]]
+        }).start()
+        self.client = BaseClient(self.stub.url, token='some_token')
+
+    def tearDown(self):
+        baseclient.set_json_codec(self.default_codec)
+        baseclient.stream_threshold = 10 * 1024 * 1024
+        self.stub.stop()
+
+    def test_codecs(self):
+        self.assertIn('json', baseclient.json_codecs())
+        self.assertEquals(baseclient.json_codecs()[0], self.default_codec)
+        with self.assertRaises(ValueError):
+            baseclient.set_json_codec('not_a_json_library')
+
+    def test_encode_sets(self):
+        obj = {'a': set([1]), 'b': frozenset(['x']), 'c': [1.5, u'\u00e9', None]}
+        for name in baseclient.json_codecs():
+            baseclient.set_json_codec(name)
+            self.assertEquals(json.loads(baseclient._codec.dumps(obj)),
+                              {'a': [1], 'b': ['x'], 'c': [1.5, u'\u00e9', None]})
+
+    def test_call_each_codec(self):
+        value = {'data': [{'id': i, 'score': i / 3.0} for i in range(10)], 'set': set([3])}
+        for name in baseclient.json_codecs():
+            baseclient.set_json_codec(name)
+            result = self.client.call_method('Stub.echo', [value])
+            self.assertEquals(result['set'], [3])
+            self.assertEquals(result['data'], value['data'])
+
+    def test_ijson_streams(self):
+        class OldIjson(object):
+            # like ijson 2.x, without use_float
+            @staticmethod
+            def kvitems(f, prefix):
+                return iter([('a', decimal.Decimal('0.5'))])
+        self.assertFalse(baseclient._ijson_streams(OldIjson))
+        self.assertFalse(baseclient._ijson_streams(object()))
+
+    def test_large_response_without_ijson(self):
+        baseclient.stream_threshold = 100
+        value = {'data': [{'id': i, 'score': i / 3.0} for i in range(100)]}
+        with mock.patch('biokbase.workspace.baseclient._ijson', None), \
+                mock.patch('biokbase.workspace.baseclient._stream_result') as stream:
+            self.assertEquals(self.client.call_method('Stub.echo', [value]), value)
+        self.assertEquals(stream.call_count, 0)
+
+    def test_streaming_decode(self):
+        if baseclient._ijson is None:
+            self.skipTest('ijson 3.1 or later is not installed')
+        baseclient.stream_threshold = 100
+        value = {'data': [{'id': i, 'score': i / 3.0, 'name': 'feature_{}'.format(i)}
+                          for i in range(100)]}
+        with mock.patch('biokbase.workspace.baseclient._stream_result',
+                        wraps=baseclient._stream_result) as stream:
+            self.assertEquals(self.client.call_method('Stub.echo', [value]), value)
+            self.assertEquals(stream.call_count, 1)
+            self.assertEquals(self.client.call_method('Stub.echo', ['small']), 'small')
+            self.assertEquals(stream.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,115 @@
+import unittest
+import mock
+from biokbase.narrative.jobs.job import Job
+
+"""
+Tests for the Job class that don't need a live job service.
+"""
+
+
+class JobTestCase(unittest.TestCase):
+    def setUp(self):
+        self.njs = mock.MagicMock()
+        self.njs.get_job_params.return_value = [{'params': [{'an_input': 'foo'}]}, {}]
+        with mock.patch('biokbase.narrative.jobs.job.clients.get', return_value=self.njs):
+            self.job = Job('job1', 'SomeModule/some_app', [{}], 'some_user')
+        self.job.app_spec = mock.MagicMock(return_value={})
+
+    def test_parameters_memoized(self):
+        params = self.job.parameters()
+        self.assertEqual(self.job.parameters(), params)
+        self.assertEqual(self.njs.get_job_params.call_count, 1)
+
+    def test_parameters_from_state(self):
+        job_info = {'params': [{'an_input': 'foo'}], 'service_ver': '1.0'}
+        with mock.patch('biokbase.narrative.jobs.job.clients.get', return_value=self.njs):
+            job = Job.from_state('job1', job_info, 'some_user', 'SomeModule/some_app')
+        self.assertEqual(job.parameters()[0], job_info)
+        self.assertEqual(self.njs.get_job_params.call_count, 0)
+
+    def test_running_state_not_frozen(self):
+        self.njs.check_job.return_value = {'job_state': 'in-progress', 'finished': 0}
+        self.job.state()
+        self.job.state()
+        self.assertEqual(self.njs.check_job.call_count, 2)
+        self.assertIsNone(self.job.final_state())
+
+    def test_final_state_frozen(self):
+        self.njs.check_job.return_value = {'job_state': 'completed', 'finished': 1, 'result': []}
+        state = self.job.state()
+        self.assertEqual(self.job.state(), state)
+        self.assertEqual(self.njs.check_job.call_count, 1)
+        self.assertTrue(self.job.is_finished())
+        # changing a returned state doesn't change the frozen one.
+        state['job_state'] = 'error'
+        self.assertEqual(self.job.final_state()['job_state'], 'completed')
+
+    def test_canceled_state_frozen(self):
+        self.njs.check_job.return_value = {'job_state': 'cancelled', 'cancelled': 1, 'finished': 0}
+        self.assertEqual(self.job.state()['job_state'], 'canceled')
+        self.assertEqual(self.job.final_state()['canceled'], 1)
+
+    @mock.patch('biokbase.narrative.jobs.job.map_outputs_from_state',
+                return_value=('kbaseDefaultNarrativeOutput', {'some': 'output'}))
+    @mock.patch('biokbase.narrative.jobs.job.map_inputs_from_job', return_value={})
+    def test_viewer_params_memoized(self, map_inputs, map_outputs):
+        state = {'job_state': 'completed', 'finished': 1, 'result': []}
+        params = self.job.get_viewer_params(state)
+        self.assertEqual(params['name'], 'kbaseDefaultNarrativeOutput')
+        self.assertEqual(self.job.get_viewer_params(state), params)
+        self.assertEqual(map_outputs.call_count, 1)
+        self.assertEqual(self.njs.get_job_params.call_count, 1)
+
+    def test_viewer_params_incomplete(self):
+        self.assertIsNone(self.job.get_viewer_params({'job_state': 'in-progress'}))
+        self.assertIsNone(self.job.get_viewer_params(None))
+
+
+    def _fake_logs(self, total):
+        """
+        Makes the fake NJS act like a job with a log that's total lines long.
+        """
+        self.njs.get_job_logs.side_effect = lambda p: {
+            'lines': [{'is_error': 0, 'line': str(i)} for i in range(p['skip_lines'], total)],
+            'last_line_number': total
+        }
+
+    def test_log_incremental(self):
+        self._fake_logs(10)
+        (num_lines, lines) = self.job.log()
+        self.assertEqual(num_lines, 10)
+        self.assertEqual(len(lines), 10)
+        self._fake_logs(15)
+        (num_lines, lines) = self.job.log(first_line=8, num_lines=4)
+        self.assertEqual(num_lines, 15)
+        self.assertEqual([l['line'] for l in lines], ['8', '9', '10', '11'])
+        self.assertEqual(self.njs.get_job_logs.call_args[0][0]['skip_lines'], 10)
+
+    def test_logs_not_shared(self):
+        self._fake_logs(5)
+        self.job.log()
+        with mock.patch('biokbase.narrative.jobs.job.clients.get', return_value=mock.MagicMock()) as njs:
+            other_job = Job('job2', 'SomeModule/some_app', [{}], 'some_user')
+        njs.return_value.get_job_logs.return_value = {'lines': [], 'last_line_number': 0}
+        self.assertEqual(other_job.log(), (0, []))
+
+    def test_latest_log(self):
+        self._fake_logs(10)
+        (num_lines, first_line, lines) = self.job.latest_log(num_lines=3)
+        self.assertEqual((num_lines, first_line), (10, 7))
+        self.assertEqual([l['line'] for l in lines], ['7', '8', '9'])
+        (num_lines, first_line, lines) = self.job.latest_log()
+        self.assertEqual((num_lines, first_line, len(lines)), (10, 0, 10))
+
+    def test_finished_log_not_refetched(self):
+        self.njs.check_job.return_value = {'job_state': 'completed', 'finished': 1}
+        self.job.state()
+        self._fake_logs(10)
+        self.job.log()
+        self.job.log()
+        self.job.latest_log(num_lines=2)
+        self.assertEqual(self.njs.get_job_logs.call_count, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
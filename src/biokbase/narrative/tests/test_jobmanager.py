@@ -1,6 +1,13 @@
 import unittest
 import mock
+import os
+import shutil
+import tempfile
+import threading
 import biokbase.narrative.jobs.jobmanager
+from biokbase.narrative.jobs.job import Job
+from biokbase.narrative.jobs.scheduler import JobPollScheduler
+from util import FakeClock
 
 """
 Tests for job management
@@ -14,15 +21,23 @@ class MockComm(object):
     """
     def __init__(self, *args, **kwargs):
         """Mock the init"""
-        pass
+        self.messages = list()
 
     def on_msg(self, *args, **kwargs):
         """Mock the msg router"""
         pass
 
-    def send(self, msg_type, content):
+    def send(self, msg):
         """Mock sending a msg"""
-        pass
+        self.messages.append(msg)
+
+
+def make_job(job_id, njs):
+    with mock.patch('biokbase.narrative.jobs.job.clients.get', return_value=njs):
+        job = Job(job_id, 'SomeModule/some_app', [{}], 'some_user')
+    job.app_spec = mock.MagicMock(return_value={})
+    job.get_viewer_params = mock.MagicMock(return_value={})
+    return job
 
 
 class JobManagerTest(unittest.TestCase):
@@ -32,8 +47,573 @@ class JobManagerTest(unittest.TestCase):
         self.jm = biokbase.narrative.jobs.jobmanager.JobManager()
         self.jm._comm = MockComm()
 
+    def setUp(self):
+        self.jm._running_jobs.clear()
+        self.jm._sent_status.clear()
+        self.jm._sent_specs.clear()
+        self.jm._log_subscriptions.clear()
+        self.jm._comm.messages = list()
+        self.njs = mock.MagicMock()
+        self.clock = FakeClock()
+        self.jm._scheduler = JobPollScheduler(clock=self.clock)
+        self.jm._job_cache = None
+        self.cache_dir = tempfile.mkdtemp()
+        self.env_patch = mock.patch.dict(os.environ, {'KB_NARRATIVE_CACHE_DIR': self.cache_dir})
+        self.env_patch.start()
+
+    def tearDown(self):
+        self.env_patch.stop()
+        self.jm._job_cache = None
+        shutil.rmtree(self.cache_dir)
+
+    def _send_comm_request(self, data):
+        """
+        Sends a comm request to the JobManager, and waits for the worker to handle it.
+        """
+        self.jm._handle_comm_message({'content': {'data': data}})
+        self.jm._run_on_worker(lambda: None)
+
+    def _add_jobs(self, job_ids):
+        for job_id in job_ids:
+            self.jm._running_jobs[job_id] = {'refresh': True, 'job': make_job(job_id, self.njs)}
+            self.jm._scheduler.add_job(job_id)
+
     def test_init(self):
         pass
 
+    def test_lookup_all_job_status_batched(self):
+        job_ids = ['job{}'.format(i) for i in range(5)]
+        self._add_jobs(job_ids)
+        self.njs.check_jobs.return_value = {
+            'job_states': dict((j, {'job_id': j, 'job_state': 'queued'}) for j in job_ids),
+            'check_error': {}
+        }
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._lookup_all_job_status()
+        self.assertEqual(self.njs.check_jobs.call_count, 1)
+        self.assertEqual(self.njs.check_job.call_count, 0)
+        msg = self.jm._comm.messages[-1]
+        self.assertEqual(msg['msg_type'], 'job_status_all')
+        self.assertEqual(sorted(msg['content'].keys()), job_ids)
+        self.assertEqual(msg['content']['job0']['state']['job_state'], 'queued')
+
+    @mock.patch('biokbase.narrative.jobs.jobmanager.JOB_STATUS_BATCH_SIZE', 2)
+    def test_lookup_all_job_status_chunked(self):
+        job_ids = ['job{}'.format(i) for i in range(5)]
+        self._add_jobs(job_ids)
+        self.njs.check_jobs.side_effect = lambda p: {
+            'job_states': dict((j, {'job_id': j, 'job_state': 'queued'}) for j in p['job_ids'])
+        }
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._lookup_all_job_status()
+        self.assertEqual(self.njs.check_jobs.call_count, 3)
+        self.assertEqual(len(self.jm._comm.messages[-1]['content']), 5)
+
+    def test_lookup_all_job_status_bad_job(self):
+        self._add_jobs(['good_job', 'bad_job'])
+        self.njs.check_jobs.return_value = {
+            'job_states': {'good_job': {'job_id': 'good_job', 'job_state': 'in-progress'}},
+            'check_error': {'bad_job': {'message': 'no such job'}}
+        }
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._lookup_all_job_status()
+        status = self.jm._comm.messages[-1]['content']
+        self.assertEqual(status['good_job']['state']['job_state'], 'in-progress')
+        self.assertEqual(status['bad_job']['state']['job_state'], 'error')
+        self.assertIn('no such job',
+                      status['bad_job']['state']['error']['exception']['error_message'])
+
+    def test_lookup_all_job_status_batch_failure(self):
+        self._add_jobs(['job1', 'job2'])
+        self.njs.check_jobs.side_effect = Exception('check_jobs is broken')
+        self.njs.check_job.side_effect = lambda j: {'job_id': j, 'job_state': 'queued'}
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._lookup_all_job_status()
+        self.assertEqual(self.njs.check_job.call_count, 2)
+        status = self.jm._comm.messages[-1]['content']
+        self.assertEqual(status['job1']['state']['job_state'], 'queued')
+
+    def _run_lookup_ticks(self, seconds, job_states):
+        """
+        Runs the lookup loop body once a second for the given number of (fake) seconds.
+        job_states is a function that takes the time elapsed and returns the state
+        of a job at that time.
+        """
+        start = self.clock.now
+        self.njs.check_jobs.side_effect = lambda p: {
+            'job_states': dict((j, job_states(self.clock.now - start)) for j in p['job_ids'])
+        }
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            for i in range(seconds):
+                self.jm._lookup_due_job_status()
+                self.clock.advance(1)
+
+    def test_long_queued_job_backs_off(self):
+        self._add_jobs(['job1'])
+        self._run_lookup_ticks(600, lambda t: {'job_state': 'queued', 'finished': 0})
+        # A fixed 10 second loop would make 60 lookups here.
+        self.assertLessEqual(self.njs.check_jobs.call_count, 12)
+        # and nothing changed after the first one, so there's nothing else to send.
+        self.assertEqual(len(self.jm._comm.messages), 1)
+
+    def test_running_job_polled_fast_after_transition(self):
+        self._add_jobs(['job1'])
+        self._run_lookup_ticks(300, lambda t: {'job_state': 'queued', 'finished': 0})
+        queued_calls = self.njs.check_jobs.call_count
+        self._run_lookup_ticks(3, lambda t: {'job_state': 'in-progress', 'finished': 0})
+        # a queued job that's been sitting there isn't due again for a while
+        self.assertEqual(self.njs.check_jobs.call_count, queued_calls)
+        # once it's seen to be running, it gets looked up again quickly.
+        self.jm._scheduler.add_job('job1')
+        self._run_lookup_ticks(3, lambda t: {'job_state': 'in-progress', 'finished': 0})
+        self.assertEqual(self.njs.check_jobs.call_count, queued_calls + 2)
+
+    def test_finished_job_retired(self):
+        self._add_jobs(['done_job', 'running_job'])
+        self._run_lookup_ticks(60, lambda t: {'job_state': 'completed', 'finished': 1}
+                               if t >= 5 else {'job_state': 'in-progress', 'finished': 0})
+        self.assertFalse(self.jm._scheduler.has_job('done_job'))
+        calls = self.njs.check_jobs.call_count
+        self._add_jobs(['new_job'])
+        self.jm._scheduler.remove_job('running_job')
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        # only the new job gets looked up
+        self.assertEqual(self.njs.check_jobs.call_count, calls + 1)
+        self.assertEqual(self.njs.check_jobs.call_args[0][0]['job_ids'], ['new_job'])
+        delta = self.jm._comm.messages[-1]['content']
+        self.assertEqual(delta['jobs'].keys(), ['new_job'])
+        self.assertEqual(delta['jobs']['new_job']['state']['job_state'], 'queued')
+
+    def test_status_delta(self):
+        self._add_jobs(['job1', 'job2'])
+        for job_id in ['job1', 'job2']:
+            job = self.jm._running_jobs[job_id]['job']
+            job.app_spec.return_value = {'info': {'name': 'Some App'}}
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        msg = self.jm._comm.messages[-1]
+        self.assertEqual(msg['msg_type'], 'job_status_delta')
+        self.assertEqual(sorted(msg['content']['jobs'].keys()), ['job1', 'job2'])
+        spec_ref = msg['content']['jobs']['job1']['spec_ref']
+        self.assertEqual(spec_ref, 'release/SomeModule/some_app')
+        self.assertNotIn('spec', msg['content']['jobs']['job1'])
+        self.assertEqual(msg['content']['specs'], {spec_ref: {'info': {'name': 'Some App'}}})
+        self.assertEqual(msg['content']['removed'], [])
+
+        # nothing changed, nothing sent
+        self.jm._comm.messages = list()
+        self.jm._scheduler.add_job('job1')
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        self.assertEqual(self.jm._comm.messages, [])
+
+        # one job changed, only it gets sent, and without the spec.
+        self.jm._scheduler.add_job('job1')
+        self.jm._scheduler.add_job('job2')
+        self.njs.check_jobs.side_effect = lambda p: {'job_states': {
+            'job1': {'job_state': 'in-progress', 'finished': 0},
+            'job2': {'job_state': 'queued', 'finished': 0}
+        }}
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._lookup_due_job_status()
+        msg = self.jm._comm.messages[-1]['content']
+        self.assertEqual(msg['jobs'].keys(), ['job1'])
+        self.assertEqual(msg['specs'], {})
+
+    def test_status_delta_removed(self):
+        self._add_jobs(['job1', 'job2'])
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        del self.jm._running_jobs['job2']
+        self.jm._scheduler.add_job('job1')
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        msg = self.jm._comm.messages[-1]['content']
+        self.assertEqual(msg['jobs'], {})
+        self.assertEqual(msg['removed'], ['job2'])
+
+    def test_resync_status(self):
+        self._add_jobs(['job1'])
+        self.jm._running_jobs['job1']['job'].app_spec.return_value = {'info': {'name': 'Some App'}}
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self._send_comm_request({'request_type': 'resync_status'})
+        msg = self.jm._comm.messages[-1]
+        self.assertEqual(msg['msg_type'], 'job_status_all')
+        self.assertEqual(msg['content']['job1']['spec'], {'info': {'name': 'Some App'}})
+        # it's the new baseline, so the next unchanged lookup sends nothing.
+        self.jm._comm.messages = list()
+        self.jm._scheduler.add_job('job1')
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        self.assertEqual(self.jm._comm.messages, [])
+
+    def test_finished_jobs_not_looked_up(self):
+        self._add_jobs(['done_job', 'running_job'])
+        self.njs.check_jobs.side_effect = lambda p: {'job_states': dict(
+            (j, {'job_state': 'completed', 'finished': 1} if j == 'done_job'
+             else {'job_state': 'in-progress', 'finished': 0}) for j in p['job_ids'])}
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._lookup_all_job_status()
+            self.jm._lookup_all_job_status()
+        self.assertEqual(self.njs.check_jobs.call_args[0][0]['job_ids'], ['running_job'])
+        status = self.jm._comm.messages[-1]['content']
+        self.assertEqual(status['done_job']['state']['job_state'], 'completed')
+        self.assertEqual(self.njs.check_job.call_count, 0)
+
+    def _initialize_jobs(self, job_ids, check_jobs, get_job_params=None):
+        """
+        Runs initialize_jobs against a fake UJS that lists the given job ids, and a fake
+        NJS with the given check_jobs (and get_job_params) functions. Doesn't start
+        the lookup loop.
+        """
+        ujs = mock.MagicMock()
+        ujs.list_jobs2.return_value = [
+            [job_id, ['some_user'], None, None, None, None, None, None, None, None,
+             {'tag': 'release'}]
+            for job_id in job_ids]
+        self.njs.check_jobs.side_effect = check_jobs
+        if get_job_params is not None:
+            self.njs.get_job_params.side_effect = get_job_params
+        clients = {'user_and_job_state': ujs, 'job_service': self.njs}
+        get_client = clients.__getitem__
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', side_effect=get_client), \
+                mock.patch('biokbase.narrative.jobs.job.clients.get', side_effect=get_client), \
+                mock.patch('biokbase.narrative.jobs.jobmanager.system_variable',
+                           return_value=12345), \
+                mock.patch.object(self.jm, '_lookup_job_status_loop'), \
+                mock.patch('biokbase.narrative.jobs.job.Job.app_spec', return_value={}):
+            self.jm.initialize_jobs()
+
+    @mock.patch('biokbase.narrative.jobs.jobmanager.JOB_STATUS_BATCH_SIZE', 2)
+    def test_initialize_jobs_batched(self):
+        job_ids = ['job{}'.format(i) for i in range(5)]
+
+        def check_jobs(params):
+            return {
+                'job_states': dict((j, {'job_state': 'queued', 'finished': 0})
+                                   for j in params['job_ids']),
+                'job_params': dict((j, {'params': [{}], 'app_id': 'SomeModule/some_app'})
+                                   for j in params['job_ids'] if params['with_job_params'])
+            }
+        self._initialize_jobs(job_ids, check_jobs)
+        self.assertEqual(sorted(self.jm._running_jobs.keys()), job_ids)
+        self.assertEqual(self.njs.get_job_params.call_count, 0)
+        init_calls = [c for c in self.njs.check_jobs.call_args_list if c[0][0]['with_job_params']]
+        self.assertEqual(len(init_calls), 3)
+        progress = [m['content'] for m in self.jm._comm.messages
+                    if m['msg_type'] == 'job_init_progress']
+        self.assertEqual(len(progress), 3)
+        self.assertEqual(progress[-1], {'loaded': 5, 'total': 5})
+        self.assertEqual(self.jm._comm.messages[-1]['msg_type'], 'job_status_all')
+        self.assertEqual(self.jm.get_job('job0').parameters()[0]['app_id'], 'SomeModule/some_app')
+
+    def test_initialize_jobs_bad_job(self):
+        def check_jobs(params):
+            good_ids = [j for j in params['job_ids'] if j != 'bad_job']
+            return {
+                'job_states': dict((j, {'job_state': 'completed', 'finished': 1})
+                                   for j in good_ids),
+                'job_params': dict((j, {'params': [{}], 'app_id': 'SomeModule/some_app'})
+                                   for j in good_ids),
+                'check_error': {'bad_job': {'message': 'no such job'}}
+            }
+        self._initialize_jobs(['good_job', 'bad_job'], check_jobs)
+        self.assertIn('unavailable', self.jm._running_jobs['bad_job'])
+        self.assertFalse(self.jm._running_jobs['bad_job']['refresh'])
+        # the front end gets the bad job's error in the first status message
+        msg = self.jm._comm.messages[-1]
+        self.assertEqual(msg['msg_type'], 'job_status_all')
+        status = msg['content']
+        self.assertEqual(sorted(status.keys()), ['bad_job', 'good_job'])
+        self.assertEqual(status['bad_job']['state']['job_state'], 'error')
+        self.assertIn('no such job', status['bad_job']['state']['error']['message'])
+        # the finished job came with its state, so it's not looked up again, and the
+        # bad one isn't looked up at all.
+        self.assertEqual(self.njs.check_jobs.call_count, 1)
+        self.assertFalse(self.jm._scheduler.has_job('bad_job'))
+
+    def test_initialize_jobs_batch_failure(self):
+        def check_jobs(params):
+            if params['with_job_params']:
+                raise Exception('check_jobs is broken')
+            return {'job_states': dict((j, {'job_state': 'queued', 'finished': 0})
+                                       for j in params['job_ids'])}
+
+        def get_job_params(job_id):
+            if job_id == 'bad_job':
+                raise Exception('get_job_params is broken')
+            return [{'params': [{}], 'app_id': 'SomeModule/some_app'}, {}]
+        self._initialize_jobs(['job1', 'job2', 'bad_job'], check_jobs, get_job_params)
+        self.assertEqual(self.njs.get_job_params.call_count, 3)
+        self.assertNotIn('unavailable', self.jm._running_jobs['job1'])
+        self.assertIn('unavailable', self.jm._running_jobs['bad_job'])
+        progress = [m['content'] for m in self.jm._comm.messages
+                    if m['msg_type'] == 'job_init_progress']
+        self.assertEqual(progress[-1], {'loaded': 3, 'total': 3})
+
+    def test_initialize_jobs_from_cache(self):
+        def check_jobs(params):
+            return {
+                'job_states': dict((j, {'job_state': 'error', 'finished': 1} if j == 'done_job'
+                                    else {'job_state': 'in-progress', 'finished': 0})
+                                   for j in params['job_ids']),
+                'job_params': dict((j, {'params': [{}], 'app_id': 'SomeModule/some_app'})
+                                   for j in params['job_ids'] if params['with_job_params'])
+            }
+        self._initialize_jobs(['done_job', 'running_job'], check_jobs)
+        self.njs.reset_mock()
+
+        # a new session only looks up the job that wasn't finished yet.
+        self.jm._running_jobs.clear()
+        self._initialize_jobs(['done_job', 'running_job', 'new_job'], check_jobs)
+        looked_up = sorted(j for c in self.njs.check_jobs.call_args_list
+                           for j in c[0][0]['job_ids'])
+        self.assertEqual(looked_up, ['new_job', 'new_job', 'running_job', 'running_job'])
+        self.assertEqual(self.njs.get_job_params.call_count, 0)
+        job = self.jm.get_job('done_job')
+        self.assertEqual(job.final_state()['job_state'], 'error')
+        self.assertEqual(job.parameters()[0]['app_id'], 'SomeModule/some_app')
+        self.assertEqual(job.owner, 'some_user')
+        status = [m['content'] for m in self.jm._comm.messages
+                  if m['msg_type'] == 'job_status_all'][-1]
+        self.assertEqual(status['done_job']['state']['job_state'], 'error')
+        self.assertEqual(status['new_job']['state']['job_state'], 'in-progress')
+        self.assertFalse(self.jm._scheduler.has_job('done_job'))
+
+    def test_initialize_jobs_without_cache(self):
+        def check_jobs(params):
+            return {
+                'job_states': dict((j, {'job_state': 'completed', 'finished': 1})
+                                   for j in params['job_ids']),
+                'job_params': dict((j, {'params': [{}], 'app_id': 'SomeModule/some_app'})
+                                   for j in params['job_ids'] if params['with_job_params'])
+            }
+        self.jm._job_cache = mock.MagicMock()
+        # e.g. the cache directory can't be made
+        with mock.patch('biokbase.narrative.jobs.jobmanager.JobStateCache',
+                        side_effect=OSError(13, 'Permission denied')):
+            self._initialize_jobs(['job1'], check_jobs)
+        self.assertIsNone(self.jm._job_cache)
+        self.assertEqual(self.jm.get_job('job1').final_state()['job_state'], 'completed')
+        self.assertEqual(self.jm._comm.messages[-1]['msg_type'], 'job_status_all')
+
+    def test_finished_job_cached(self):
+        def check_jobs(params):
+            return {
+                'job_states': dict((j, {'job_state': 'in-progress', 'finished': 0})
+                                   for j in params['job_ids']),
+                'job_params': dict((j, {'params': [{}], 'app_id': 'SomeModule/some_app'})
+                                   for j in params['job_ids'] if params['with_job_params'])
+            }
+        self._initialize_jobs(['job1'], check_jobs)
+        self.assertFalse(self.jm._job_cache.has_job('job1'))
+        self.jm._running_jobs['job1']['job'].app_spec = mock.MagicMock(return_value={})
+        self._run_lookup_ticks(3, lambda t: {'job_state': 'suspend', 'finished': 1})
+        self.assertTrue(self.jm._job_cache.has_job('job1'))
+        self.assertEqual(self.jm._job_cache.load()['job1']['final_state']['job_state'], 'suspend')
+
+    def _fake_logs(self, total):
+        self.njs.get_job_logs.side_effect = lambda p: {
+            'lines': [{'is_error': 0, 'line': str(i)} for i in range(p['skip_lines'], total[0])],
+            'last_line_number': total[0]
+        }
+
+    def _log_messages(self):
+        return [m['content'] for m in self.jm._comm.messages
+                if m['msg_type'] == 'job_logs' and m['content'].get('subscribed')]
+
+    def _subscribe(self, job_id, first_line=None):
+        data = {'request_type': 'subscribe_job_logs', 'job_id': job_id}
+        if first_line is not None:
+            data['first_line'] = first_line
+        self._send_comm_request(data)
+
+    def test_subscribe_job_logs(self):
+        self._add_jobs(['job1'])
+        total = [10]
+        self._fake_logs(total)
+        self._subscribe('job1')
+        # starts at the end of the log, so nothing to push yet
+        self.assertEqual(self._log_messages(), [])
+        self.assertEqual(self.jm._log_subscriptions['job1'], 10)
+
+        total[0] = 15
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'in-progress', 'finished': 0})
+        pushed = self._log_messages()
+        self.assertEqual(len(pushed), 1)
+        self.assertEqual(pushed[0]['first'], 10)
+        self.assertEqual([line['line'] for line in pushed[0]['lines']],
+                         ['10', '11', '12', '13', '14'])
+        self.assertEqual(self.njs.get_job_logs.call_args[0][0]['skip_lines'], 10)
+
+        # not due for a lookup, so no new fetch, and nothing new to send.
+        fetches = self.njs.get_job_logs.call_count
+        total[0] = 20
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'in-progress', 'finished': 0})
+        self.assertEqual(self.njs.get_job_logs.call_count, fetches)
+        self.assertEqual(len(self._log_messages()), 1)
+
+        self._send_comm_request({'request_type': 'unsubscribe_job_logs', 'job_id': 'job1'})
+        self.assertNotIn('job1', self.jm._log_subscriptions)
+
+    @mock.patch('biokbase.narrative.jobs.jobmanager.LOG_PUSH_MAX_LINES', 4)
+    def test_subscribe_job_logs_batched(self):
+        self._add_jobs(['job1'])
+        self._fake_logs([10])
+        self._subscribe('job1', first_line=0)
+        self.assertEqual(len(self._log_messages()), 1)
+        # the rest goes out in batches, without fetching again.
+        fetches = self.njs.get_job_logs.call_count
+        self.jm._scheduler.add_job('job1')
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'in-progress', 'finished': 0})
+        self.jm._push_job_logs('job1', fetch=False)
+        pushed = self._log_messages()
+        self.assertEqual([(p['first'], len(p['lines'])) for p in pushed], [(0, 4), (4, 4), (8, 2)])
+        self.assertEqual(self.njs.get_job_logs.call_count, fetches + 1)
+
+    @mock.patch('biokbase.narrative.jobs.jobmanager.LOG_PUSH_MAX_BYTES', 50)
+    def test_subscribe_job_logs_max_bytes(self):
+        self._add_jobs(['job1'])
+        self._fake_logs([10])
+        self._subscribe('job1', first_line=0)
+        pushed = self._log_messages()
+        self.assertEqual(len(pushed[0]['lines']), 1)
+
+    def test_subscription_ends_when_finished(self):
+        self._add_jobs(['job1'])
+        self._fake_logs([5])
+        self._subscribe('job1', first_line=0)
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'completed', 'finished': 1})
+        self.assertNotIn('job1', self.jm._log_subscriptions)
+        self.assertEqual(sum(len(p['lines']) for p in self._log_messages()), 5)
+
+    def test_comm_messages_run_on_worker(self):
+        self._add_jobs(['job1'])
+        threads = list()
+        self.njs.check_job.side_effect = lambda j: threads.append(threading.current_thread()) or {
+            'job_state': 'queued', 'finished': 0
+        }
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self._send_comm_request({'request_type': 'job_status', 'job_id': 'job1'})
+        self.assertEqual(threads, [self.jm._worker])
+        self.assertEqual(self.jm._comm.messages[-1]['msg_type'], 'job_status')
+
+    def test_comm_messages_not_waited_for(self):
+        self._add_jobs(['job1'])
+        release = threading.Event()
+        self.njs.check_job.side_effect = lambda j: release.wait(5) and {
+            'job_state': 'queued', 'finished': 0
+        }
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm._handle_comm_message({'content': {'data': {
+                'request_type': 'job_status', 'job_id': 'job1'}}})
+            # it's handed off while the job service is still busy
+            self.assertEqual(self.jm._comm.messages, [])
+            release.set()
+            self.jm._run_on_worker(lambda: None)
+        self.assertEqual(self.jm._comm.messages[-1]['msg_type'], 'job_status')
+
+    def test_worker_raises_errors(self):
+        with self.assertRaises(ValueError):
+            self.jm.delete_job(None)
+        with self.assertRaises(ValueError):
+            self.jm.get_job('not_a_job')
+
+    def test_delete_job_closes_log(self):
+        self._add_jobs(['job1'])
+        self.njs.check_job.return_value = {'job_state': 'completed', 'finished': 1}
+        log_store = mock.MagicMock()
+        self.jm._running_jobs['job1']['job']._log_store = log_store
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm.delete_job('job1')
+        self.assertNotIn('job1', self.jm._running_jobs)
+        log_store.close.assert_called_once_with()
+
+    def test_cancel_job_sends_canceling_status(self):
+        self._add_jobs(['job1'])
+        self.njs.check_job.return_value = {'job_state': 'in-progress', 'finished': 0}
+        sent_before_cancel = list()
+
+        def cancel_job(params):
+            sent_before_cancel.extend(self.jm._comm.messages)
+            self.assertEqual(self.jm._running_jobs['job1']['refresh'], False)
+        self.njs.cancel_job.side_effect = cancel_job
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm.cancel_job('job1')
+        # the front end hears the job's canceling before the cancel call goes out.
+        self.assertEqual(sent_before_cancel[-1]['msg_type'], 'job_status')
+        self.assertEqual(sent_before_cancel[-1]['content']['state']['job_state'], 'canceling')
+        # and gets its real state afterwards.
+        self.assertEqual(self.jm._comm.messages[-1]['content']['state']['job_state'],
+                         'in-progress')
+        self.assertNotIn('canceling', self.jm._running_jobs['job1'])
+        self.assertEqual(self.jm._running_jobs['job1']['refresh'], True)
+
+    def test_concurrent_register_and_lookup(self):
+        self.njs.check_jobs.side_effect = lambda p: {
+            'job_states': dict((j, {'job_state': 'queued', 'finished': 0}) for j in p['job_ids'])
+        }
+        self.njs.check_job.side_effect = lambda j: {'job_state': 'queued', 'finished': 0}
+        errors = list()
+
+        def register(start):
+            try:
+                for i in range(start, start + 20):
+                    self.jm.register_new_job(make_job('job{}'.format(i), self.njs))
+            except Exception as e:
+                errors.append(e)
+
+        def look_up():
+            try:
+                for i in range(20):
+                    self._send_comm_request({'request_type': 'all_status'})
+                    self.jm.get_jobs_list()
+            except Exception as e:
+                errors.append(e)
+
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            threads = [threading.Thread(target=register, args=(i * 20,)) for i in range(3)]
+            threads.append(threading.Thread(target=look_up))
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len(self.jm._running_jobs), 60)
+
+    def test_stopped_job_not_due(self):
+        self._add_jobs(['job1', 'job2'])
+        self._send_comm_request({'request_type': 'stop_job_update', 'job_id': 'job1'})
+        self.jm._running_jobs['job2']['refresh'] = False
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        # neither gets looked up, and neither keeps the loop from sleeping.
+        self.assertEqual(self.njs.check_jobs.call_count, 0)
+        self.assertIsNone(self.jm._scheduler.time_to_next_poll())
+
+    def test_unavailable_job_not_due(self):
+        self._add_jobs(['job1'])
+        self.jm._running_jobs['job1']['unavailable'] = {'error': 'no such job'}
+        self.jm._running_jobs['job1']['refresh'] = False
+        self.jm._scheduler.remove_job('job1')
+        self._send_comm_request({'request_type': 'start_job_update', 'job_id': 'job1'})
+        self.assertFalse(self.jm._scheduler.has_job('job1'))
+        # even if it gets scheduled, its first lookup takes it back out.
+        self.jm._scheduler.add_job('job1')
+        self._run_lookup_ticks(1, lambda t: {'job_state': 'queued', 'finished': 0})
+        self.assertEqual(self.njs.check_jobs.call_count, 0)
+        self.assertIsNone(self.jm._scheduler.time_to_next_poll())
+
+    def test_register_new_jobs(self):
+        self.njs.check_jobs.side_effect = lambda p: {
+            'job_states': dict((j, {'job_state': 'queued', 'finished': 0}) for j in p['job_ids'])
+        }
+        jobs = [make_job('job{}'.format(i), self.njs) for i in range(3)]
+        with mock.patch('biokbase.narrative.jobs.jobmanager.clients.get', return_value=self.njs):
+            self.jm.register_new_jobs(jobs)
+        self.assertEqual(self.njs.check_jobs.call_count, 1)
+        self.assertEqual(self.njs.check_job.call_count, 0)
+        msg_types = [m['msg_type'] for m in self.jm._comm.messages]
+        self.assertEqual(msg_types, ['job_status_delta', 'new_job'])
+        self.assertEqual(sorted(self.jm._comm.messages[0]['content']['jobs'].keys()),
+                         ['job0', 'job1', 'job2'])
+        self.assertEqual(sorted(self.jm._job_ids()), ['job0', 'job1', 'job2'])
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+import os
+import shutil
+import tempfile
+from biokbase.narrative.jobs.jobstatecache import JobStateCache
+
+"""
+Tests for the on-disk cache of finished jobs
+"""
+
+
+def record(job_id, job_state='completed'):
+    return {'job_id': job_id, 'final_state': {'job_state': job_state, 'finished': 1}}
+
+
+class JobStateCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.cache = JobStateCache(123, cache_dir=self.cache_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_empty(self):
+        self.assertEqual(self.cache.load(), {})
+        self.assertFalse(self.cache.has_job('job1'))
+
+    def test_add_and_load(self):
+        self.cache.add(record('job1'))
+        self.cache.add(record('job2', job_state='error'))
+        # already added, so it's not added again
+        self.cache.add(record('job1', job_state='suspend'))
+        self.assertTrue(self.cache.has_job('job1'))
+        records = JobStateCache(123, cache_dir=self.cache_dir).load()
+        self.assertEqual(sorted(records.keys()), ['job1', 'job2'])
+        self.assertEqual(records['job1']['final_state']['job_state'], 'completed')
+        # other workspaces have their own cache
+        self.assertEqual(JobStateCache(456, cache_dir=self.cache_dir).load(), {})
+
+    def test_save_replaces(self):
+        self.cache.add(record('job1'))
+        self.cache.save([record('job2')])
+        self.assertFalse(self.cache.has_job('job1'))
+        self.assertEqual(self.cache.load().keys(), ['job2'])
+        self.assertEqual(os.listdir(self.cache_dir), ['ws_123.jsonl'])
+
+    def test_bad_lines_skipped(self):
+        self.cache.add(record('job1'))
+        with open(self.cache.path, 'a') as f:
+            f.write('not json\n{"no_job_id": 1}\n')
+        self.cache.add(record('job2'))
+        self.assertEqual(sorted(self.cache.load().keys()), ['job1', 'job2'])
+
+
+if __name__ == "__main__":
+    unittest.main()
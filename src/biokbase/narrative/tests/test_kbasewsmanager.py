@@ -0,0 +1,55 @@
+"""
+Tests for the KBaseWSManager contents manager, against a mocked Workspace.
+"""
+import unittest
+import mock
+from tornado.web import HTTPError
+from biokbase.narrative.contents.kbasewsmanager import KBaseWSManager
+from biokbase.narrative.contents.narrativeio import KBaseWSManagerMixin
+from biokbase.workspace.baseclient import ServerError
+from util import read_json_file
+
+
+class KBaseWSManagerGetTestCase(unittest.TestCase):
+    def setUp(self):
+        self.nar = read_json_file('data/small_narrative_4.0.json')
+        self.path = 'ws.{}.obj.{}'.format(self.nar['info'][6], self.nar['info'][0])
+        self.ws = mock.MagicMock()
+        self.ws.get_objects.side_effect = lambda refs: [dict(self.nar)]
+        self.ws.get_permissions.return_value = {'wjriehl': 'a'}
+        patcher = mock.patch.object(KBaseWSManagerMixin, 'ws_client', return_value=self.ws)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.manager = KBaseWSManager()
+        self.manager.get_userid = lambda: 'wjriehl'
+
+    def test_get(self):
+        model = self.manager.get(self.path)
+        self.assertEquals(model['type'], 'notebook')
+        self.assertTrue(model['writable'])
+
+    def test_get_missing(self):
+        for message in ['No object with id 5 exists in workspace 6312',
+                        'Object 5 (name Narrative) in workspace 6312 (name ws) has been deleted']:
+            self.ws.get_objects.side_effect = ServerError('JSONRPCError', -32500, message)
+            model = self.manager.get(self.path)
+            self.assertIsNone(model['type'])
+            self.assertIsNone(model['content'])
+
+    def test_get_workspace_error(self):
+        self.ws.get_objects.side_effect = ServerError(
+            'JSONRPCError', -32500, 'Connection to the database timed out')
+        with self.assertRaises(HTTPError) as cm:
+            self.manager.get(self.path)
+        self.assertEquals(cm.exception.status_code, 500)
+
+    def test_get_no_permission(self):
+        self.ws.get_objects.side_effect = ServerError(
+            'JSONRPCError', -32500, 'User someone may not read workspace 6312')
+        with self.assertRaises(HTTPError) as cm:
+            self.manager.get(self.path)
+        self.assertEquals(cm.exception.status_code, 403)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+import unittest
+from biokbase.narrative.jobs.logstore import JobLogStore
+
+"""
+Tests for the job log store
+"""
+
+
+def make_lines(first, last):
+    return [{'is_error': 0, 'line': 'line {}'.format(i)} for i in range(first, last)]
+
+
+class JobLogStoreTestCase(unittest.TestCase):
+    def test_append_and_get(self):
+        store = JobLogStore()
+        store.append(make_lines(0, 10))
+        store.append(make_lines(10, 15))
+        self.assertEqual(len(store), 15)
+        self.assertEqual(store.get_lines(0, 15), make_lines(0, 15))
+        self.assertEqual(store.get_lines(12, 100), make_lines(12, 15))
+        self.assertEqual(store.get_lines(15, 5), [])
+        self.assertEqual(store.get_lines(-5, 2), make_lines(0, 2))
+        self.assertEqual(store.get_lines(3, 0), [])
+
+    def test_spill(self):
+        store = JobLogStore(max_memory_lines=10)
+        for i in range(0, 100, 7):
+            store.append(make_lines(i, min(i + 7, 100)))
+        self.assertEqual(len(store), 100)
+        self.assertLessEqual(len(store._lines), 10)
+        self.assertEqual(store.first_available_line(), 0)
+        self.assertEqual(store.get_lines(0, 100), make_lines(0, 100))
+        self.assertEqual(store.get_lines(42, 3), make_lines(42, 45))
+        self.assertEqual(store.get_lines(85, 10), make_lines(85, 95))
+        store.close()
+        self.assertEqual(len(store), 0)
+
+    def test_unicode_spill(self):
+        store = JobLogStore(max_memory_lines=2)
+        lines = [{'is_error': 1, 'line': u'caf\xe9\nline'}, {'is_error': 0, 'line': u'\u2028'}] * 3
+        store.append(lines)
+        self.assertEqual(store.get_lines(0, 6), lines)
+
+    def test_no_spill(self):
+        store = JobLogStore(max_memory_lines=10, spill=False)
+        store.append(make_lines(0, 25))
+        self.assertEqual(len(store), 25)
+        first = store.first_available_line()
+        self.assertGreater(first, 0)
+        self.assertIsNone(store._spill_file)
+        self.assertEqual(store.get_lines(0, 25), make_lines(first, 25))
+
+
+if __name__ == "__main__":
+    unittest.main()
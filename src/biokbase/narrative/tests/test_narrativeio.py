@@ -5,19 +5,24 @@ Narrative and workspace service.
 __author__ = 'Bill Riehl <wjriehl@lbl.gov>'
 
 import unittest
+import mock
 from getpass import getpass
 from biokbase.narrative.contents.narrativeio import (
     KBaseWSManagerMixin,
-    PermissionsError
+    NarrativeCache,
+    PermissionsError,
+    MAX_METADATA_SIZE_BYTES
 )
 from biokbase.workspace.client import Workspace
 from biokbase.workspace.baseclient import ServerError
 import biokbase.auth
 import os
+import copy
 import re
 from tornado.web import HTTPError
 import ConfigParser
 import narrative_test_helper as test_util
+from util import read_json_file
 
 metadata_fields = set(['objid', 'name', 'type', 'save_date', 'ver',
                        'saved_by', 'wsid', 'workspace', 'chsum',
@@ -424,5 +429,281 @@ class NarrIOTestCase(unittest.TestCase):
         self.assertIsNotNone(err)
         self.logout()
 
+
+class NarrIOMemoTestCase(unittest.TestCase):
+    """
+    Tests for remembering narrative lookups, against a mocked Workspace.
+    """
+    def setUp(self):
+        self.nar = read_json_file('data/small_narrative_4.0.json')
+        self.ref = '{}/{}'.format(self.nar['info'][6], self.nar['info'][0])
+        self.ws = mock.MagicMock()
+        self.ws.get_objects.side_effect = lambda refs: [dict(self.nar)]
+        self.ws.get_object_info_new.return_value = [self.nar['info']]
+        self.ws.get_permissions.return_value = {'wjriehl': 'a', 'someone': 'r'}
+        patcher = mock.patch.object(KBaseWSManagerMixin, 'ws_client', return_value=self.ws)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mixin = KBaseWSManagerMixin()
+        self.token = os.environ.get('KB_AUTH_TOKEN')
+        os.environ['KB_AUTH_TOKEN'] = 'un=wjriehl|token=some_token'
+
+    def tearDown(self):
+        if self.token is None:
+            os.environ.pop('KB_AUTH_TOKEN', None)
+        else:
+            os.environ['KB_AUTH_TOKEN'] = self.token
+
+    def test_fetch_narrative(self):
+        (nar, writable) = self.mixin.fetch_narrative(self.ref, user='wjriehl')
+        self.assertEquals(nar['info'], self.nar['info'])
+        self.assertTrue(writable)
+        (nar, writable) = self.mixin.fetch_narrative(self.ref, user='someone')
+        self.assertFalse(writable)
+        (nar, writable) = self.mixin.fetch_narrative(self.ref)
+        self.assertIsNone(writable)
+        # the narrative's cached, but nothing's remembered from one fetch to the next
+        self.assertEquals(self.ws.get_objects.call_count, 1)
+        self.assertEquals(self.ws.get_permissions.call_count, 2)
+        self.assertIsNone(self.mixin._memo())
+
+    def test_fetch_narrative_errors(self):
+        self.ws.get_objects.side_effect = ServerError('JSONRPCError', -32500,
+            'User someone may not read workspace 6312')
+        with self.assertRaises(PermissionsError):
+            self.mixin.fetch_narrative(self.ref, user='someone')
+
+    def test_read_narrative_memo(self):
+        with self.mixin._memo_scope():
+            self.mixin.read_narrative(self.ref)
+            self.assertEquals(self.mixin.read_narrative(self.ref, content=False),
+                              {'info': self.nar['info']})
+            self.assertTrue(self.mixin.narrative_exists(self.ref))
+        self.assertEquals(self.ws.get_objects.call_count, 1)
+        self.assertEquals(self.ws.get_object_info_new.call_count, 0)
+
+    def test_memo_forget(self):
+        with self.mixin._memo_scope():
+            self.mixin.read_narrative(self.ref, content=False)
+            self.mixin.narrative_permissions(self.ref)
+            self.mixin._memo_forget(self.nar['info'][6])
+            self.mixin.read_narrative(self.ref, content=False)
+            self.mixin.narrative_permissions(self.ref)
+        self.assertEquals(self.ws.get_object_info_new.call_count, 2)
+        self.assertEquals(self.ws.get_permissions.call_count, 2)
+
+    def test_memo_scope(self):
+        # nothing's remembered outside a scope
+        self.mixin.narrative_permissions(self.ref)
+        self.mixin.narrative_permissions(self.ref)
+        self.assertEquals(self.ws.get_permissions.call_count, 2)
+        with self.mixin._memo_scope():
+            with self.mixin._memo_scope():
+                self.mixin.narrative_permissions(self.ref)
+            # the outer scope's still open
+            self.mixin.narrative_permissions(self.ref)
+        self.assertEquals(self.ws.get_permissions.call_count, 3)
+        self.assertIsNone(self.mixin._memo())
+        self.mixin.narrative_permissions(self.ref)
+        self.assertEquals(self.ws.get_permissions.call_count, 4)
+
+    def test_memo_copies(self):
+        with self.mixin._memo_scope():
+            perms = self.mixin.narrative_permissions(self.ref)
+            perms['someone'] = 'a'
+            self.assertEquals(self.mixin.narrative_permissions(self.ref)['someone'], 'r')
+            self.mixin.read_narrative(self.ref, content=False)
+            info = self.mixin.read_narrative(self.ref, content=False)
+            info['info'][4] += 1
+            self.assertEquals(self.mixin.read_narrative(self.ref, content=False)['info'],
+                              self.nar['info'])
+        self.assertEquals(self.ws.get_permissions.call_count, 1)
+        self.assertEquals(self.ws.get_object_info_new.call_count, 1)
+
+    def test_read_narrative_cached(self):
+        self.mixin.read_narrative(self.ref)
+        nar = self.mixin.read_narrative(self.ref)
+        self.assertEquals(nar['info'], self.nar['info'])
+        self.assertEquals(self.ws.get_objects.call_count, 1)
+        self.assertEquals(self.ws.get_object_info_new.call_count, 1)
+        # a new version means fetching it again
+        info = list(self.nar['info'])
+        info[4] += 1
+        self.ws.get_object_info_new.return_value = [info]
+        self.mixin.read_narrative(self.ref)
+        self.assertEquals(self.ws.get_objects.call_count, 2)
+
+    def test_write_narrative_memo(self):
+        info = list(self.nar['info'])
+        info[4] += 1
+        self.ws.save_objects.return_value = [info]
+        self.mixin.read_narrative(self.ref)
+        result = self.mixin.write_narrative(self.ref, self.nar['data'], 'wjriehl')
+        self.assertEquals(result[3], info)
+        # the saved narrative gets looked up again
+        self.ws.get_object_info_new.return_value = [info]
+        self.mixin.read_narrative(self.ref)
+        self.assertEquals(self.ws.get_objects.call_count, 2)
+
+    def test_write_narrative_unchanged(self):
+        self.ws.save_objects.return_value = [self.nar['info']]
+        self.mixin.write_narrative(self.ref, copy.deepcopy(self.nar['data']), 'wjriehl')
+        result = self.mixin.write_narrative(self.ref, copy.deepcopy(self.nar['data']), 'wjriehl')
+        self.assertEquals(result[3], self.nar['info'])
+        self.assertEquals(self.ws.save_objects.call_count, 1)
+        self.assertEquals(self.ws.alter_workspace_metadata.call_count, 1)
+        # any change to a cell gets saved
+        nar = copy.deepcopy(self.nar['data'])
+        nar['cells'][0]['source'] += 'more text'
+        self.mixin.write_narrative(self.ref, nar, 'wjriehl')
+        self.assertEquals(self.ws.save_objects.call_count, 2)
+
+    def test_write_narrative_saved_elsewhere(self):
+        self.ws.save_objects.return_value = [self.nar['info']]
+        self.mixin.write_narrative(self.ref, copy.deepcopy(self.nar['data']), 'wjriehl')
+        # someone else saves a new version, so the same narrative gets saved over it
+        info = list(self.nar['info'])
+        info[4] += 1
+        self.ws.get_object_info_new.return_value = [info]
+        self.mixin.write_narrative(self.ref, copy.deepcopy(self.nar['data']), 'wjriehl')
+        self.assertEquals(self.ws.save_objects.call_count, 2)
+        # or if the current version can't be looked up
+        self.ws.save_objects.return_value = [info]
+        self.ws.get_object_info_new.side_effect = ServerError('JSONRPCError', -32500, 'oops')
+        self.mixin.write_narrative(self.ref, copy.deepcopy(self.nar['data']), 'wjriehl')
+        self.assertEquals(self.ws.save_objects.call_count, 3)
+
+    def test_saved_narratives_bounded(self):
+        with mock.patch('biokbase.narrative.contents.narrativeio.SAVED_DIGESTS_MAX_ENTRIES', 2):
+            for obj_id in range(1, 4):
+                info = list(self.nar['info'])
+                info[0] = obj_id
+                self.ws.save_objects.return_value = [info]
+                self.mixin.write_narrative('{}/{}'.format(info[6], obj_id),
+                                           copy.deepcopy(self.nar['data']), 'wjriehl')
+        saved = self.mixin._saved_narratives()
+        self.assertEquals(len(saved), 2)
+        self.assertEquals([key[-1] for key in saved], ['2', '3'])
+
+    def test_write_narrative_strip_outputs(self):
+        self.ws.save_objects.return_value = [self.nar['info']]
+        output = {'output_type': 'display_data', 'metadata': {},
+                  'data': {'application/javascript': 'alert("hi")'}}
+        nar = copy.deepcopy(self.nar['data'])
+        nar['cells'][1]['outputs'] = [output]
+        nar['cells'][1]['metadata']['kbase'] = {'type': 'app'}
+        nar['cells'][5]['outputs'] = [output]
+        self.mixin.strip_outputs = True
+        self.mixin.write_narrative(self.ref, nar, 'wjriehl')
+        saved = self.ws.save_objects.call_args[0][0]['objects'][0]['data']
+        self.assertEquals(saved['cells'][1]['outputs'], [])
+        self.assertEquals(saved['cells'][5]['outputs'], [output])
+
+    def test_memo_per_token(self):
+        with self.mixin._memo_scope():
+            self.mixin.narrative_permissions(self.ref)
+            os.environ['KB_AUTH_TOKEN'] = 'un=someone|token=other_token'
+            self.mixin.narrative_permissions(self.ref)
+        self.assertEquals(self.ws.get_permissions.call_count, 2)
+
+
+class NarrativeCacheTestCase(unittest.TestCase):
+    def make_nar(self, ws_id, obj_id, ver=1, size=100, chsum='abc'):
+        info = [obj_id, 'Narrative', 'KBaseNarrative.Narrative-4.0', '2017-01-0{}T00:00:00+0000'.format(ver),
+                ver, 'someone', ws_id, 'some_ws', chsum, size, {}]
+        return {'info': info, 'data': {'cells': [], 'metadata': {}}}
+
+    def test_get_put(self):
+        cache = NarrativeCache()
+        nar = self.make_nar(1, 2)
+        self.assertIsNone(cache.get(nar['info']))
+        self.assertFalse(cache.has_object('1', '2'))
+        cache.put(nar)
+        self.assertTrue(cache.has_object('1', '2'))
+        self.assertEquals(cache.get(list(nar['info']))['data'], nar['data'])
+        # a new version, or a changed checksum, isn't a hit
+        self.assertIsNone(cache.get(self.make_nar(1, 2, ver=2)['info']))
+        self.assertIsNone(cache.get(self.make_nar(1, 2, chsum='def')['info']))
+        self.assertEquals(cache.stats()['hits'], 1)
+        self.assertEquals(cache.stats()['misses'], 3)
+
+    def test_copies(self):
+        cache = NarrativeCache()
+        nar = self.make_nar(1, 2)
+        cache.put(nar)
+        # neither what was put in nor what comes out is the cached narrative
+        nar['data']['cells'].append({'source': 'changed'})
+        cached = cache.get(nar['info'])
+        self.assertEquals(cached['data']['cells'], [])
+        cached['data']['metadata']['name'] = 'changed'
+        self.assertEquals(cache.get(nar['info'])['data']['metadata'], {})
+
+    def test_limits(self):
+        cache = NarrativeCache(max_bytes=250, max_entries=3)
+        for i in range(3):
+            cache.put(self.make_nar(1, i))
+        # over max_bytes, so the least recently used one goes
+        self.assertFalse(cache.has_object(1, 0))
+        self.assertEquals(cache.stats()['bytes'], 200)
+        cache.get(self.make_nar(1, 1)['info'])
+        cache.put(self.make_nar(1, 3, size=50))
+        cache.put(self.make_nar(1, 4, size=50))
+        self.assertTrue(cache.has_object(1, 1))
+        self.assertFalse(cache.has_object(1, 2))
+        self.assertEquals(cache.stats()['entries'], 3)
+        # too big to keep at all
+        cache.put(self.make_nar(1, 5, size=1000))
+        self.assertFalse(cache.has_object(1, 5))
+
+    def test_invalidate(self):
+        cache = NarrativeCache()
+        cache.put(self.make_nar(1, 1))
+        cache.put(self.make_nar(1, 2))
+        cache.put(self.make_nar(2, 1))
+        cache.invalidate(1, 1)
+        self.assertFalse(cache.has_object(1, 1))
+        self.assertTrue(cache.has_object(1, 2))
+        cache.invalidate('1')
+        self.assertFalse(cache.has_object(1, 2))
+        self.assertTrue(cache.has_object(2, 1))
+        self.assertEquals(cache.stats()['bytes'], 100)
+
+
+
+class CellUsageTestCase(unittest.TestCase):
+    """
+    Tests for tallying the apps and methods in a narrative for its metadata.
+    """
+    def setUp(self):
+        patcher = mock.patch.object(KBaseWSManagerMixin, 'ws_client')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mixin = KBaseWSManagerMixin()
+
+    def app_cell(self, app_id):
+        return {'cell_type': 'code', 'metadata': {'kbase': {'type': 'app', 'appCell': {
+            'app': {'id': app_id, 'gitCommitHash': 'abc123'}}}}}
+
+    def test_process_cell_usage(self):
+        cells = [self.app_cell('Mod/run'), self.app_cell('Mod/run'),
+                 {'cell_type': 'markdown', 'metadata': {}},
+                 {'cell_type': 'code', 'metadata': {'kb-cell': {'type': 'function_output'}}}]
+        meta = self.mixin._process_cell_usage({'cells': cells}, {u'name': u'Untitled'})
+        self.assertEquals(meta, {u'name': u'Untitled', u'method.Mod/run/abc123': 2,
+                                 'jupyter.markdown': 1, 'viewer': 1})
+
+    def test_process_cell_usage_overflow(self):
+        cells = [self.app_cell('Mod/app_{}'.format(i)) for i in range(1000)]
+        cells += [self.app_cell('Mod/popular')] * 3
+        meta = self.mixin._process_cell_usage({'cells': cells}, {u'name': u'Untitled'})
+        size = sum(len(k) + len(unicode(v)) for k, v in meta.items())
+        self.assertLessEqual(size, MAX_METADATA_SIZE_BYTES)
+        # the most used are kept, the rest are counted as overflow
+        self.assertEquals(meta[u'method.Mod/popular/abc123'], 3)
+        methods = [k for k in meta if k.startswith('method.')]
+        self.assertEquals(sum(meta[k] for k in methods), 1003)
+        self.assertGreater(meta[u'method.overflow'], 0)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
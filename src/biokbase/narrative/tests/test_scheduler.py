@@ -0,0 +1,99 @@
+import unittest
+from biokbase.narrative.jobs.scheduler import (
+    JobPollScheduler,
+    is_terminal_state
+)
+from util import FakeClock
+
+"""
+Tests for the job status poll scheduler
+"""
+
+
+def job_state(job_state, finished=0):
+    return {'job_state': job_state, 'finished': finished}
+
+
+class JobPollSchedulerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.sched = JobPollScheduler(clock=self.clock, fast_interval=2, backoff=2,
+                                      max_interval=10, max_state_intervals={'queued': 120})
+
+    def test_new_job_due_now(self):
+        self.sched.add_job('job1')
+        self.assertEqual(self.sched.due_jobs(), ['job1'])
+        self.assertEqual(self.sched.time_to_next_poll(), 0)
+
+    def test_no_jobs(self):
+        self.assertEqual(self.sched.due_jobs(), [])
+        self.assertIsNone(self.sched.time_to_next_poll())
+
+    def test_fast_after_transition(self):
+        self.sched.add_job('job1')
+        self.sched.job_polled('job1', job_state('queued'))
+        self.assertEqual(self.sched.time_to_next_poll(), 2)
+        self.assertEqual(self.sched.due_jobs(), [])
+        self.clock.advance(2)
+        self.assertEqual(self.sched.due_jobs(), ['job1'])
+        # same state, so it backs off
+        self.sched.job_polled('job1', job_state('queued'))
+        self.assertEqual(self.sched.time_to_next_poll(), 4)
+        # changed state, so it's fast again
+        self.clock.advance(4)
+        self.sched.job_polled('job1', job_state('in-progress'))
+        self.assertEqual(self.sched.time_to_next_poll(), 2)
+
+    def test_backoff_caps_by_state(self):
+        self.sched.add_job('queued_job')
+        self.sched.add_job('running_job')
+        intervals = {'queued_job': [], 'running_job': []}
+        for i in range(10):
+            for job_id, state in [('queued_job', 'queued'), ('running_job', 'in-progress')]:
+                self.sched.job_polled(job_id, job_state(state))
+                intervals[job_id].append(self.sched._jobs[job_id]['interval'])
+        self.assertEqual(intervals['queued_job'][:8], [2, 4, 8, 16, 32, 64, 120, 120])
+        self.assertEqual(intervals['running_job'][:5], [2, 4, 8, 10, 10])
+
+    def test_retire_terminal(self):
+        self.sched.add_job('done_job')
+        self.sched.add_job('canceled_job')
+        self.sched.job_polled('done_job', job_state('completed', finished=1))
+        self.sched.job_polled('canceled_job', {'job_state': 'canceled', 'canceled': 1})
+        self.assertFalse(self.sched.has_job('done_job'))
+        self.assertFalse(self.sched.has_job('canceled_job'))
+        self.assertIsNone(self.sched.time_to_next_poll())
+
+    def test_lookup_error_not_terminal(self):
+        self.sched.add_job('job1')
+        self.sched.job_polled('job1', {'job_state': 'error', 'error': {}})
+        self.assertTrue(self.sched.has_job('job1'))
+
+    def test_add_resets(self):
+        self.sched.add_job('job1')
+        for i in range(5):
+            self.sched.job_polled('job1', job_state('queued'))
+        self.sched.add_job('job1')
+        self.assertEqual(self.sched.due_jobs(), ['job1'])
+        self.sched.job_polled('job1', job_state('queued'))
+        self.assertEqual(self.sched.time_to_next_poll(), 2)
+
+    def test_remove_job(self):
+        self.sched.add_job('job1')
+        self.sched.remove_job('job1')
+        self.sched.remove_job('not_a_job')
+        self.assertEqual(self.sched.due_jobs(), [])
+        # polling a removed job doesn't bring it back
+        self.sched.job_polled('job1', job_state('queued'))
+        self.assertFalse(self.sched.has_job('job1'))
+
+    def test_is_terminal_state(self):
+        self.assertTrue(is_terminal_state({'finished': 1}))
+        self.assertTrue(is_terminal_state({'canceled': 1}))
+        self.assertFalse(is_terminal_state({'finished': 0}))
+        self.assertFalse(is_terminal_state({}))
+        self.assertFalse(is_terminal_state(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,6 +1,14 @@
-from biokbase.narrative.jobs.specmanager import SpecManager
+from biokbase.narrative.jobs.specmanager import (
+    SpecManager,
+    TagSpecs,
+    AppParams
+)
+import copy
 import unittest
 import mock
+import shutil
+import tempfile
+from util import read_json_file
 
 class SpecManagerTestCase(unittest.TestCase):
     @classmethod
@@ -30,5 +38,120 @@ class SpecManagerTestCase(unittest.TestCase):
             self.sm.check_app(self.bad_app_id, raise_exception=True)
 
 
+
+def make_spec(app_id, ver='1.0.0', git_commit_hash='abc'):
+    return {'info': {'id': app_id, 'ver': ver, 'git_commit_hash': git_commit_hash}}
+
+
+class TagSpecsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.nms = mock.MagicMock()
+        self.nms_specs = dict((app_id, make_spec(app_id)) for app_id in ['a/a', 'b/b', 'c/c', 'e/e', 'f/f'])
+        self.nms.list_methods_spec.side_effect = lambda p: self.nms_specs.values()
+        self.nms.list_methods.side_effect = lambda p: [s['info'] for s in self.nms_specs.values()]
+        self.nms.get_method_spec.side_effect = lambda p: [self.nms_specs[i] for i in p['ids']]
+        self.patch = mock.patch('biokbase.narrative.jobs.specmanager.clients.get', return_value=self.nms)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+        shutil.rmtree(self.cache_dir)
+
+    def test_lazy_load(self):
+        specs = TagSpecs(cache_dir=self.cache_dir)
+        self.assertTrue('dev' in specs)
+        self.assertFalse('NotARealTag' in specs)
+        self.assertEqual(self.nms.list_methods_spec.call_count, 0)
+        self.assertEqual(sorted(specs['dev'].keys()), ['a/a', 'b/b', 'c/c', 'e/e', 'f/f'])
+        specs['dev']
+        self.assertEqual(self.nms.list_methods_spec.call_count, 1)
+        self.assertEqual(self.nms.list_methods_spec.call_args[0][0], {'tag': 'dev'})
+        with self.assertRaises(KeyError):
+            specs['NotARealTag']
+
+    def test_cache_unchanged(self):
+        TagSpecs(cache_dir=self.cache_dir)['release']
+        specs = TagSpecs(cache_dir=self.cache_dir)
+        self.assertEqual(sorted(specs['release'].keys()), ['a/a', 'b/b', 'c/c', 'e/e', 'f/f'])
+        self.assertEqual(self.nms.list_methods_spec.call_count, 1)
+        self.assertEqual(self.nms.list_methods.call_count, 1)
+        self.assertEqual(self.nms.get_method_spec.call_count, 0)
+        # other tags are cached separately
+        specs['beta']
+        self.assertEqual(self.nms.list_methods_spec.call_count, 2)
+
+    def test_cache_changed(self):
+        TagSpecs(cache_dir=self.cache_dir)['release']
+        self.nms_specs['a/a'] = make_spec('a/a', git_commit_hash='def')
+        self.nms_specs['d/d'] = make_spec('d/d')
+        del self.nms_specs['c/c']
+        specs = TagSpecs(cache_dir=self.cache_dir)
+        self.assertEqual(sorted(specs['release'].keys()), ['a/a', 'b/b', 'd/d', 'e/e', 'f/f'])
+        self.assertEqual(specs['release']['a/a']['info']['git_commit_hash'], 'def')
+        self.assertEqual(sorted(self.nms.get_method_spec.call_args[0][0]['ids']), ['a/a', 'd/d'])
+        self.assertEqual(self.nms.list_methods_spec.call_count, 1)
+        # and the updates were saved
+        TagSpecs(cache_dir=self.cache_dir)['release']
+        self.assertEqual(self.nms.get_method_spec.call_count, 1)
+
+    def test_cache_used_when_nms_fails(self):
+        TagSpecs(cache_dir=self.cache_dir)['release']
+        self.nms.list_methods.side_effect = Exception('NMS is down')
+        specs = TagSpecs(cache_dir=self.cache_dir)
+        self.assertEqual(sorted(specs['release'].keys()), ['a/a', 'b/b', 'c/c', 'e/e', 'f/f'])
+
+    def test_reload(self):
+        specs = TagSpecs(cache_dir=self.cache_dir)
+        specs['dev']
+        self.nms_specs['b/b'] = make_spec('b/b', ver='2.0.0')
+        specs.load('dev')
+        self.assertEqual(specs['dev']['b/b']['info']['ver'], '2.0.0')
+        self.assertEqual(self.nms.get_method_spec.call_args[0][0], {'ids': ['b/b'], 'tag': 'dev'})
+
+
+class AppParamsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sm = SpecManager()
+        self.sm._param_indexes.clear()
+        self.spec = [s for s in read_json_file('data/specs.json')
+                     if s['info']['id'] == 'build_a_metabolic_model'][0]
+
+    def _index(self, spec):
+        with mock.patch.object(self.sm, 'get_spec', return_value=spec):
+            return self.sm.app_param_index('build_a_metabolic_model', 'release')
+
+    def test_index(self):
+        index = self._index(self.spec)
+        params = self.sm.app_params(self.spec)
+        self.assertEqual(list(index.params), params)
+        self.assertEqual(index.ids, frozenset(p['id'] for p in params))
+        self.assertEqual(index['input_genome']['allowed_types'], ['KBaseGenomes.Genome'])
+        self.assertEqual([p.pattern for p in index.type_patterns('input_genome')], ['KBaseGenomes.Genome'])
+        self.assertEqual(index.type_patterns('not_a_param'), ())
+        self.assertNotIn('not_a_param', index)
+
+    def test_memoized(self):
+        index = self._index(self.spec)
+        self.assertIs(self._index(self.spec), index)
+        # a reloaded copy of the same spec gets the same index
+        self.assertIs(self._index(copy.deepcopy(self.spec)), index)
+        changed = copy.deepcopy(self.spec)
+        changed['parameters'][0]['optional'] = 1 - changed['parameters'][0]['optional']
+        self.assertIsNot(self._index(changed), index)
+
+    def test_groups_and_regexes(self):
+        index = AppParams([
+            {'id': 'name', 'regex_constraint': ['^[a-z]+$', '[']},
+            {'id': 'group', 'is_group': True, 'parameter_ids': ['name', 'other']}
+        ])
+        regexes = index.regex_constraints('name')
+        self.assertTrue(regexes[0].match('abc'))
+        # bad regexes stay as strings
+        self.assertEqual(regexes[1], '[')
+        self.assertEqual(index.group_members('group'), frozenset(['name', 'other']))
+        self.assertEqual(index.group_members('name'), frozenset())
+
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
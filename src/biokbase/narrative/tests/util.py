@@ -1,5 +1,14 @@
 from biokbase.narrative.contents.narrativeio import PermissionsError
 import json
+import socket
+import threading
+import time
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
 
 def read_json_file(path):
     """
@@ -9,4 +18,137 @@ def read_json_file(path):
     with open(path, 'r') as f:
         narr = json.loads(f.read())
         f.close()
-        return narr
\ No newline at end of file
+        return narr
+
+
+class FakeClock(object):
+    """
+    A clock that only moves when it's told to. Call it to get the current time.
+    """
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class _StubRPCHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1, so connections are kept open between requests.
+    protocol_version = 'HTTP/1.1'
+    def setup(self):
+        # the headers and body get written separately, so without this Nagle's algorithm
+        # holds up every response on a kept-open connection.
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('content-length', 0)))
+        self.server.stub.record_connection(self.client_address)
+        status, resp = self.server.stub.handle_body(json.loads(body))
+        data = json.dumps(resp).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 makes extra concurrent connections wait to be retried
+    request_queue_size = 64
+
+
+class StubRPCServer(object):
+    """
+    A JSON-RPC 1.1 server on localhost, run in a background thread, for testing service
+    clients without a real service. Methods are registered by their full name (e.g.
+    'Workspace.ver') as functions that take the params list and return the result list;
+    anything they raise is sent back as an error. Each call waits for the given latency
+    before answering. It keeps track of the methods called, the number of HTTP requests
+    and the number of distinct client connections made.
+
+    If supports_batch is True, it also takes JSON-RPC batch requests, i.e. an array of
+    calls, and answers them with an array of responses.
+
+    Use it as a context manager, or call start() and stop().
+    """
+    def __init__(self, methods=None, latency=0, supports_batch=False):
+        self.methods = dict(methods or {})
+        self.latency = latency
+        self.supports_batch = supports_batch
+        self.calls = list()
+        self.request_count = 0
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:{}'.format(self._server.server_address[1])
+
+    @property
+    def connection_count(self):
+        with self._lock:
+            return len(self._connections)
+
+    def start(self):
+        self._server = _ThreadingHTTPServer(('127.0.0.1', 0), _StubRPCHandler)
+        self._server.stub = self
+        t = threading.Thread(target=self._server.serve_forever)
+        t.daemon = True
+        t.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def record_connection(self, client_address):
+        with self._lock:
+            self._connections.add(client_address)
+            self.request_count += 1
+
+    def handle_body(self, body):
+        """
+        Returns the HTTP status and JSON response for a request body.
+        """
+        if not isinstance(body, list):
+            return self.handle(body)
+        if not self.supports_batch:
+            return 500, {'version': '1.1',
+                         'error': {'name': 'JSONRPCError', 'code': -32600,
+                                   'message': 'Invalid request'}}
+        return 200, [self.handle(req)[1] for req in body]
+
+    def handle(self, req):
+        """
+        Returns the HTTP status and JSON response for a single request.
+        """
+        with self._lock:
+            self.calls.append(req['method'])
+        if self.latency:
+            time.sleep(self.latency)
+        if req['method'] not in self.methods:
+            return 500, {'version': '1.1', 'id': req.get('id'),
+                         'error': {'name': 'JSONRPCError', 'code': -32601,
+                                   'message': 'Method not found: ' + req['method']}}
+        try:
+            result = self.methods[req['method']](req['params'])
+        except Exception as e:
+            return 500, {'version': '1.1', 'id': req.get('id'),
+                         'error': {'name': 'JSONRPCError', 'code': -32500,
+                                   'message': str(e)}}
+        return 200, {'version': '1.1', 'id': req.get('id'), 'result': result}
@@ -11,6 +11,7 @@ import random as _random
 import base64 as _base64
 from ConfigParser import ConfigParser as _ConfigParser
 import os as _os
+from biokbase.workspace.baseclient import service_url_cache as _service_url_cache
 
 _CT = 'content-type'
 _AJ = 'application/json'
@@ -172,8 +173,14 @@ class Client(object):
         url = self.url
         if self.use_url_lookup:
             module_name = service_method.split('.')[0]
-            service_status_ret = self._call(self.url, 'ServiceWizard.get_service_status', 
-                                            [{'module_name' : module_name, 
-                                              'version' : service_version}], None)[0]
-            url = service_status_ret['url']
-        return self._call(url, service_method, param_list, json_rpc_context)
+            key = (self.url, module_name, service_version)
+            url = _service_url_cache.get(key, lambda: self._call(
+                self.url, 'ServiceWizard.get_service_status',
+                [{'module_name': module_name, 'version': service_version}], None)[0]['url'])
+        try:
+            return self._call(url, service_method, param_list, json_rpc_context)
+        except (_requests.exceptions.ConnectionError, _requests.exceptions.Timeout):
+            # the service may have moved, so look it up again next time
+            if self.use_url_lookup:
+                _service_url_cache.invalidate(key)
+            raise
@@ -11,6 +11,16 @@ import json as _json
 import requests as _requests
 import random as _random
 import os as _os
+import threading as _threading
+import copy as _copy
+import io as _io
+from multiprocessing.pool import ThreadPool as _ThreadPool
+from requests.adapters import HTTPAdapter as _HTTPAdapter
+
+try:
+    from urllib3.util.retry import Retry as _Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry as _Retry
 
 try:
     from configparser import ConfigParser as _ConfigParser  # py 3
@@ -27,6 +37,328 @@ _CT = 'content-type'
 _AJ = 'application/json'
 _URL_SCHEME = frozenset(['http', 'https'])
 
+# Settings for the connection pools of the shared session. pool_connections is the
+# number of hosts to keep pools for, pool_maxsize the number of connections kept
+# open to each host. max_retries is the number of times to retry a failed
+# connection. Requests that made it to the server are only retried for idempotent
+# HTTP methods, so JSON-RPC POSTs never get sent twice.
+_session_config = {
+    'pool_connections': 10,
+    'pool_maxsize': 10,
+    'max_retries': 3,
+    'backoff_factor': 0.1
+}
+_session = None
+_executor = None
+_session_lock = _threading.Lock()
+
+
+def _make_session(pool_connections, pool_maxsize, max_retries, backoff_factor):
+    retry = _Retry(total=max_retries, connect=max_retries, read=max_retries,
+                   status=0, backoff_factor=backoff_factor)
+    adapter = _HTTPAdapter(pool_connections=pool_connections,
+                           pool_maxsize=pool_maxsize, max_retries=retry)
+    session = _requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session():
+    '''
+    Returns the requests.Session shared by all clients that weren't given their
+    own, making it the first time it's asked for. The session keeps connections
+    to each host open, so calls after the first don't need a new TCP connection
+    or TLS handshake. Its connection pools are safe to use from many threads.
+    '''
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _make_session(**_session_config)
+        return _session
+
+
+def configure_session(pool_connections=None, pool_maxsize=None,
+                      max_retries=None, backoff_factor=None):
+    '''
+    Changes the connection pool settings of the shared session. The old session
+    is closed and replaced by one with these settings, which every client using
+    the shared session (including ones made before this) uses from its next call
+    on. Calls already under way finish on the old session. Clients that were
+    given their own session aren't affected.
+    pool_connections - the number of hosts to keep connection pools for.
+    pool_maxsize - the number of connections to keep open to each host. This
+        should be at least the number of threads making calls to one service.
+        It's also the number of threads submit uses.
+    max_retries - the number of times to retry a connection that fails.
+    backoff_factor - how long to wait between retries, as in urllib3's Retry.
+    '''
+    global _session, _executor
+    new_config = {'pool_connections': pool_connections,
+                  'pool_maxsize': pool_maxsize,
+                  'max_retries': max_retries,
+                  'backoff_factor': backoff_factor}
+    with _session_lock:
+        for key, value in new_config.items():
+            if value is not None:
+                _session_config[key] = value
+        if _session is not None:
+            _session.close()
+        _session = None
+        if pool_maxsize is not None and _executor is not None:
+            # calls already submitted still finish on the old pool
+            _executor.close()
+            _executor = None
+
+
+def _get_executor():
+    global _executor
+    with _session_lock:
+        if _executor is None:
+            _executor = _ThreadPool(_session_config['pool_maxsize'])
+        return _executor
+
+
+def submit(func, *args, **kwargs):
+    '''
+    Calls func(*args, **kwargs) on a thread pool shared by all clients, and
+    returns a CallFuture for its result. The pool has as many threads as the
+    shared session keeps connections open to each host.
+    '''
+    future = CallFuture(sent=True)
+
+    def run():
+        try:
+            future._set_result(func(*args, **kwargs))
+        except Exception as e:
+            future._set_exception(e)
+    _get_executor().apply_async(run)
+    return future
+
+
+class AsyncClient(object):
+    '''
+    Wraps a service client, so that calling any of its methods runs the call
+    with submit and returns a CallFuture. Independent calls can be made at the
+    same time without starting a thread for each:
+        ws = AsyncClient(Workspace(url))
+        futures = [ws.get_object_info_new(p) for p in params]
+        infos = [f.result() for f in futures]
+    '''
+    def __init__(self, service_client):
+        self._service_client = service_client
+
+    def __getattr__(self, name):
+        method = getattr(self._service_client, name)
+        if not callable(method):
+            return method
+
+        def call(*args, **kwargs):
+            return submit(method, *args, **kwargs)
+        return call
+
+
+class ServiceURLCache(object):
+    '''
+    Remembers the urls of dynamic services looked up from the Service Wizard,
+    keyed by Service Wizard url, module name and version, for ttl seconds.
+
+    If several threads look up the same service at once, only one of them
+    asks the Service Wizard, and the rest wait for its answer. It counts hits
+    (urls found in the cache) and misses (lookups made), see stats.
+    '''
+    def __init__(self, ttl=300, clock=time.time):
+        self.ttl = ttl
+        self._clock = clock
+        self._urls = dict()
+        self._pending = dict()
+        self._lock = _threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, lookup):
+        '''
+        Returns the url for key, calling lookup() to find it if it's not
+        cached or has expired.
+        '''
+        with self._lock:
+            entry = self._urls.get(key)
+            if entry is not None and entry[1] > self._clock():
+                self.hits += 1
+                return entry[0]
+            pending = self._pending.get(key)
+            leader = pending is None
+            if leader:
+                self.misses += 1
+                pending = self._pending[key] = _PendingLookup()
+        if not leader:
+            return pending.wait()
+        try:
+            url = lookup()
+        except Exception as e:
+            with self._lock:
+                del self._pending[key]
+            pending.finish(error=e)
+            raise
+        with self._lock:
+            self._urls[key] = (url, self._clock() + self.ttl)
+            del self._pending[key]
+        pending.finish(url=url)
+        return url
+
+    def invalidate(self, key=None):
+        '''
+        Forgets the url for key, or all urls if key is None.
+        '''
+        with self._lock:
+            if key is None:
+                self._urls.clear()
+            else:
+                self._urls.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self._urls)}
+
+
+class _PendingLookup(object):
+    def __init__(self):
+        self._done = _threading.Event()
+        self._url = None
+        self._error = None
+
+    def finish(self, url=None, error=None):
+        self._url = url
+        self._error = error
+        self._done.set()
+
+    def wait(self):
+        self._done.wait()
+        if self._error is not None:
+            raise self._error
+        return self._url
+
+
+# The dynamic service urls looked up by all clients.
+service_url_cache = ServiceURLCache()
+
+
+class _StdlibCodec(object):
+    name = 'json'
+
+    def dumps(self, obj):
+        return _json.dumps(obj, cls=_JSONObjectEncoder)
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return _json.loads(data)
+
+
+class _FastCodec(object):
+    '''
+    Uses a faster JSON library with the same dumps and loads as the stdlib's.
+    Anything the library can't encode (like sets) is encoded by the stdlib.
+    '''
+    def __init__(self, name, module):
+        self.name = name
+        self._module = module
+
+    def dumps(self, obj):
+        try:
+            return self._module.dumps(obj)
+        except (TypeError, OverflowError):
+            return _StdlibCodec().dumps(obj)
+
+    def loads(self, data):
+        return self._module.loads(data)
+
+
+def _load_codecs():
+    codecs = dict()
+    try:
+        import ujson
+        # older versions of ujson lose float precision when decoding
+        if int(ujson.__version__.split('.')[0]) >= 2:
+            codecs['ujson'] = _FastCodec('ujson', ujson)
+    except (ImportError, ValueError, AttributeError):
+        pass
+    try:
+        import simplejson
+        codecs['simplejson'] = _FastCodec('simplejson', simplejson)
+    except ImportError:
+        pass
+    codecs['json'] = _StdlibCodec()
+    return codecs
+
+
+_codecs = _load_codecs()
+_codec = [_codecs[name] for name in ('ujson', 'simplejson', 'json')
+          if name in _codecs][0]
+
+
+def _ijson_streams(ijson):
+    '''
+    Returns True if this ijson can be used to stream responses. That needs
+    kvitems with use_float (ijson 3.1 and up, so not on Python 2). Older
+    versions decode numbers as Decimals.
+    '''
+    try:
+        items = list(ijson.kvitems(_io.BytesIO(b'{"a": 0.5}'), '', use_float=True))
+    except Exception:
+        return False
+    return items == [('a', 0.5)] and type(items[0][1]) is float
+
+
+try:
+    import ijson as _ijson
+    if not _ijson_streams(_ijson):
+        _ijson = None
+except ImportError:
+    _ijson = None
+
+# Responses larger than this many bytes have their result decoded as it's read
+# from the connection, if a recent enough ijson is installed, instead of reading
+# the whole body first. None turns this off.
+stream_threshold = 10 * 1024 * 1024
+
+
+def json_codecs():
+    '''
+    Returns the names of the JSON libraries that can be used, fastest first.
+    '''
+    return [name for name in ('ujson', 'simplejson', 'json') if name in _codecs]
+
+
+def set_json_codec(name):
+    '''
+    Sets the JSON library all clients use to encode requests and decode
+    responses. By default it's the fastest one installed of ujson, simplejson
+    and the stdlib's json.
+    '''
+    global _codec
+    if name not in _codecs:
+        raise ValueError('JSON library {} is not available, use one of {}'.format(
+            name, json_codecs()))
+    _codec = _codecs[name]
+
+
+def get_json_codec():
+    return _codec.name
+
+
+def _stream_result(raw):
+    '''
+    Decodes the top level of a JSON-RPC response from a file-like object,
+    building each value as it's read.
+    '''
+    resp = dict()
+    for key, value in _ijson.kvitems(raw, '', use_float=True):
+        resp[key] = value
+    return resp
+
 
 def _get_token(user_id, password, auth_svc):
     # This is bandaid helper function until we get a full
@@ -93,6 +425,16 @@ class _JSONObjectEncoder(_json.JSONEncoder):
         return _json.JSONEncoder.default(self, obj)
 
 
+def _unpack_result(resp):
+    if 'result' not in resp:
+        raise ServerError('Unknown', 0, 'An unknown server error occurred')
+    if not resp['result']:
+        return
+    if len(resp['result']) == 1:
+        return resp['result'][0]
+    return resp['result']
+
+
 class BaseClient(object):
     '''
     The KBase base client.
@@ -113,9 +455,13 @@ class BaseClient(object):
     trust_all_ssl_certificates - set to True to trust self-signed certificates.
         If you don't understand the implications, leave as the default, False.
     auth_svc - the url of the KBase authorization service.
-    lookup_url - set to true when contacting KBase dynamic services.
+    lookup_url - set to true when contacting KBase dynamic services. The urls
+        looked up from the Service Wizard are cached in service_url_cache.
     async_job_check_time_ms - the wait time between checking job state for
         asynchronous jobs run with the run_job method.
+    session - the requests.Session to make calls with. By default, all clients
+        share one session with pooled, keep-alive connections (see
+        get_session and configure_session).
     '''
     def __init__(
             self, url=None, timeout=30 * 60, user_id=None,
@@ -125,7 +471,8 @@ class BaseClient(object):
             lookup_url=False,
             async_job_check_time_ms=100,
             async_job_check_time_scale_percent=150,
-            async_job_check_max_time_ms=300000):
+            async_job_check_max_time_ms=300000,
+            session=None):
         if url is None:
             raise ValueError('A url is required')
         scheme, _, _, _, _, _ = _urlparse(url)
@@ -136,6 +483,7 @@ class BaseClient(object):
         self._headers = dict()
         self.trust_all_ssl_certificates = trust_all_ssl_certificates
         self.lookup_url = lookup_url
+        self._own_session = session
         self.async_job_check_time = async_job_check_time_ms / 1000.0
         self.async_job_check_time_scale_percent = (
             async_job_check_time_scale_percent)
@@ -160,7 +508,43 @@ class BaseClient(object):
         if self.timeout < 1:
             raise ValueError('Timeout value must be at least 1 second')
 
+    @property
+    def _session(self):
+        # the shared session is looked up on each call, so that configure_session
+        # applies to clients that already exist.
+        if self._own_session is not None:
+            return self._own_session
+        return get_session()
+
     def _call(self, url, method, params, context=None):
+        body = _codec.dumps(self._rpc_request(method, params, context))
+        ret = self._post(url, body, stream=True)
+        if ret.status_code == 500:
+            if ret.headers.get(_CT) == _AJ:
+                err = _codec.loads(ret.content)
+                if 'error' in err:
+                    raise ServerError(**err['error'])
+                else:
+                    raise ServerError('Unknown', 0, ret.text)
+            else:
+                raise ServerError('Unknown', 0, ret.text)
+        if not ret.ok:
+            ret.close()
+            ret.raise_for_status()
+        return _unpack_result(self._decode(ret))
+
+    def _decode(self, ret):
+        length = ret.headers.get('content-length')
+        if (_ijson is not None and stream_threshold is not None and
+                length is not None and int(length) > stream_threshold):
+            ret.raw.decode_content = True
+            try:
+                return _stream_result(ret.raw)
+            finally:
+                ret.close()
+        return _codec.loads(ret.content)
+
+    def _rpc_request(self, method, params, context=None):
         arg_hash = {'method': method,
                     'params': params,
                     'version': '1.1',
@@ -170,40 +554,24 @@ class BaseClient(object):
             if type(context) is not dict:
                 raise ValueError('context is not type dict as required.')
             arg_hash['context'] = context
+        return arg_hash
 
-        body = _json.dumps(arg_hash, cls=_JSONObjectEncoder)
-        ret = _requests.post(url, data=body, headers=self._headers,
-                             timeout=self.timeout,
-                             verify=not self.trust_all_ssl_certificates)
+    def _post(self, url, body, stream=False):
+        ret = self._session.post(url, data=body, headers=self._headers,
+                                 timeout=self.timeout, stream=stream,
+                                 verify=not self.trust_all_ssl_certificates)
         ret.encoding = 'utf-8'
-        if ret.status_code == 500:
-            if ret.headers.get(_CT) == _AJ:
-                err = ret.json()
-                if 'error' in err:
-                    raise ServerError(**err['error'])
-                else:
-                    raise ServerError('Unknown', 0, ret.text)
-            else:
-                raise ServerError('Unknown', 0, ret.text)
-        if not ret.ok:
-            ret.raise_for_status()
-        resp = ret.json()
-        if 'result' not in resp:
-            raise ServerError('Unknown', 0, 'An unknown server error occurred')
-        if not resp['result']:
-            return
-        if len(resp['result']) == 1:
-            return resp['result'][0]
-        return resp['result']
+        return ret
 
     def _get_service_url(self, service_method, service_version):
         if not self.lookup_url:
             return self.url
         service, _ = service_method.split('.')
-        service_status_ret = self._call(
-            self.url, 'ServiceWizard.get_service_status',
-            [{'module_name': service, 'version': service_version}])
-        return service_status_ret['url']
+        return service_url_cache.get(
+            (self.url, service, service_version),
+            lambda: self._call(
+                self.url, 'ServiceWizard.get_service_status',
+                [{'module_name': service, 'version': service_version}])['url'])
 
     def _set_up_context(self, service_ver=None, context=None):
         if service_ver:
@@ -265,4 +633,275 @@ class BaseClient(object):
         '''
         url = self._get_service_url(service_method, service_ver)
         context = self._set_up_context(service_ver, context)
-        return self._call(url, service_method, args, context)
+        try:
+            return self._call(url, service_method, args, context)
+        except (_requests.exceptions.ConnectionError,
+                _requests.exceptions.Timeout):
+            # the service may have moved, so look it up again next time
+            if self.lookup_url:
+                service_url_cache.invalidate(
+                    (self.url, service_method.split('.')[0], service_ver))
+            raise
+
+    def batch(self, single_request=False, max_workers=8):
+        '''
+        Start a batch of calls. Use it as a context manager:
+            with client.batch() as b:
+                f1 = b.call_method('Workspace.get_object_info_new', [params1])
+                f2 = b.call_method('Workspace.get_object_info_new', [params2])
+            info1 = f1.result()
+        See Batch for the details.
+        Optional arguments:
+        single_request - if True, send the calls to each url as a single
+            JSON-RPC batch request.
+        max_workers - the most calls to have in flight at once.
+        '''
+        return Batch(self, single_request=single_request,
+                     max_workers=max_workers)
+
+
+class CallFuture(object):
+    '''
+    The result of a call made with submit or in a Batch. For a Batch, it's
+    filled in when the batch is sent, at the end of its with block.
+    '''
+    def __init__(self, sent=False):
+        self._done = _threading.Event()
+        self._result = None
+        self._exception = None
+        self._sent = sent
+
+    def _set_result(self, result):
+        self._result = result
+        self._done.set()
+
+    def _set_exception(self, exception):
+        self._exception = exception
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def exception(self, timeout=None):
+        '''
+        Returns the exception the call raised, or None if it succeeded.
+        '''
+        if not self._sent:
+            raise RuntimeError('The batch this call is in has not been sent')
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for the call to finish')
+        return self._exception
+
+    def result(self, timeout=None):
+        '''
+        Returns the result of the call, or raises the exception it raised.
+        '''
+        exception = self.exception(timeout)
+        if exception is not None:
+            raise exception
+        return self._result
+
+
+class Batch(object):
+    '''
+    Collects calls, and sends them all at once at the end of a with block, where
+    each call's CallFuture gets its result.
+
+    The calls are sent at the same time from a pool of up to max_workers
+    threads, over the pooled connections of the client's session. With
+    single_request=True, the calls to each url are instead sent as one JSON-RPC
+    batch request (an array of calls). If the service doesn't answer that with
+    an array of responses, those calls are sent separately instead.
+
+    There are two ways to add calls:
+    call_method - like BaseClient.call_method, for the client that started the
+        batch.
+    client - wraps a generated service client (e.g. Workspace, Catalog,
+        NarrativeJobService, NarrativeMethodStore), so that calling any of its
+        methods adds a call to the batch and returns a CallFuture.
+    Any other function can be added with submit.
+
+    If the with block raises an exception, nothing is sent.
+    '''
+    def __init__(self, base_client=None, single_request=False, max_workers=8):
+        self._base_client = base_client
+        self.single_request = single_request
+        self.max_workers = max_workers
+        self._rpc_calls = list()
+        self._other_calls = list()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def call_method(self, service_method, args, service_ver=None,
+                    context=None):
+        '''
+        Adds a call to the client that started the batch. Takes the same
+        arguments as BaseClient.call_method, and returns a CallFuture.
+        '''
+        if self._base_client is None:
+            raise ValueError('This batch was not started by a client')
+        return self._add_rpc(self._base_client, service_method, args,
+                             service_ver, context)
+
+    def submit(self, func, *args, **kwargs):
+        '''
+        Adds a call to func(*args, **kwargs) to the batch. Returns a CallFuture.
+        '''
+        future = CallFuture()
+        self._other_calls.append((future, func, args, kwargs))
+        return future
+
+    def client(self, service_client):
+        '''
+        Returns a wrapper around the given service client, where calling any
+        method adds the call to this batch and returns a CallFuture.
+        '''
+        return _BatchClient(self, service_client)
+
+    def _add_rpc(self, base_client, service_method, args, service_ver,
+                 context):
+        future = CallFuture()
+        self._rpc_calls.append((future, base_client, service_method, args,
+                                service_ver, context))
+        return future
+
+    def send(self):
+        '''
+        Sends all the calls added so far, and waits for them to finish.
+        '''
+        rpc_calls, self._rpc_calls = self._rpc_calls, list()
+        other_calls, self._other_calls = self._other_calls, list()
+        tasks = list()
+        if self.single_request:
+            groups = dict()
+            for call in rpc_calls:
+                groups.setdefault(id(call[1]), list()).append(call)
+            for calls in groups.values():
+                if isinstance(calls[0][1], BaseClient):
+                    tasks.append((self._send_single_request, (calls,)))
+                else:
+                    tasks.extend((self._send_rpc, (c,)) for c in calls)
+        else:
+            tasks.extend((self._send_rpc, (c,)) for c in rpc_calls)
+        tasks.extend((self._send_other, (c,)) for c in other_calls)
+        for call in rpc_calls + other_calls:
+            call[0]._sent = True
+        if not tasks:
+            return
+        if len(tasks) == 1:
+            tasks[0][0](*tasks[0][1])
+            return
+        pool = _ThreadPool(max(1, min(self.max_workers, len(tasks))))
+        try:
+            pool.map(lambda task: task[0](*task[1]), tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    def _send_other(self, call):
+        future, func, args, kwargs = call
+        try:
+            future._set_result(func(*args, **kwargs))
+        except Exception as e:
+            future._set_exception(e)
+
+    def _send_rpc(self, call):
+        future, base_client, service_method, args, service_ver, context = call
+        self._send_other((future, base_client.call_method,
+                          (service_method, args, service_ver, context), {}))
+
+    def _send_single_request(self, calls):
+        '''
+        Sends the calls made to one client as a single JSON-RPC batch request,
+        or separately if the service doesn't handle batch requests.
+        '''
+        base_client = calls[0][1]
+        by_url = dict()
+        try:
+            for call in calls:
+                _, _, service_method, args, service_ver, context = call
+                url = base_client._get_service_url(service_method, service_ver)
+                context = base_client._set_up_context(service_ver, context)
+                req = base_client._rpc_request(service_method, args, context)
+                by_url.setdefault(url, list()).append((call, req))
+        except Exception:
+            by_url = dict()
+        if not by_url:
+            for call in calls:
+                self._send_rpc(call)
+            return
+        for url, url_calls in by_url.items():
+            responses = None
+            try:
+                body = _codec.dumps([url_req for (url_call, url_req) in url_calls])
+                ret = base_client._post(url, body)
+                if ret.ok:
+                    responses = _codec.loads(ret.content)
+            except Exception:
+                pass
+            if not isinstance(responses, list):
+                for (call, _) in url_calls:
+                    self._send_rpc(call)
+                continue
+            responses = dict((r.get('id'), r) for r in responses
+                             if isinstance(r, dict))
+            for (call, req) in url_calls:
+                future = call[0]
+                resp = responses.get(req['id'])
+                if resp is None:
+                    self._send_rpc(call)
+                elif resp.get('error'):
+                    future._set_exception(ServerError(**resp['error']))
+                else:
+                    try:
+                        future._set_result(_unpack_result(resp))
+                    except Exception as e:
+                        future._set_exception(e)
+
+
+class _BatchClient(object):
+    '''
+    Stands in for a generated service client in a Batch. Clients that make their
+    calls through a BaseClient-like _client.call_method have those calls added
+    to the batch directly, so they can go in a single request. Calls to any
+    other client are added as a whole with Batch.submit.
+    '''
+    def __init__(self, batch, service_client):
+        self._batch = batch
+        self._service_client = service_client
+
+    def __getattr__(self, name):
+        method = getattr(self._service_client, name)
+        if not callable(method):
+            return method
+        base_client = getattr(self._service_client, '_client', None)
+        if base_client is None or not hasattr(base_client, 'call_method'):
+            def submit(*args, **kwargs):
+                return self._batch.submit(method, *args, **kwargs)
+            return submit
+
+        def add(*args, **kwargs):
+            recorder = _copy.copy(self._service_client)
+            recorder._client = _CallRecorder(self._batch, base_client)
+            return getattr(recorder, name)(*args, **kwargs)
+        return add
+
+
+class _CallRecorder(object):
+    '''
+    Stands in for the _client of a generated service client, adding calls to a
+    Batch instead of making them.
+    '''
+    def __init__(self, batch, base_client):
+        self._batch = batch
+        self._base_client = base_client
+
+    def call_method(self, service_method, args, service_ver=None,
+                    context=None):
+        return self._batch._add_rpc(self._base_client, service_method, args,
+                                    service_ver, context)